@@ -0,0 +1,220 @@
+from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from time import perf_counter
+import argparse
+import json
+import random
+import resource
+import sys
+
+from .structure import HashIndex, CompactHashIndex, FileIndex
+
+# Benchmark de indexação e consulta, executado pela linha de comando:
+#   python -m index.benchmark --docs 2000 --terms-per-doc 500 --zipf 1.0 --output bench.json
+# Para cada tipo de indice (em um processo proprio, para medir o pico de
+# memoria de cada um) mede a taxa de indexação, o tempo dos flushes, do merge
+# e do finish_indexing, a latencia das consultas (get_occurrence_list) e o
+# pico de RSS. O resultado é impresso (ou gravado) em JSON.
+
+INDEX_TYPES = {
+    "hash": lambda config: HashIndex(),
+    "compact": lambda config: CompactHashIndex(),
+    "file": lambda config: FileIndex(memory_budget=config["memory_budget"]),
+    "file-vbyte": lambda config: FileIndex(codec="vbyte", memory_budget=config["memory_budget"]),
+}
+PERCENTILES = [50, 90, 95, 99]
+
+
+def create_vocabulary(int_size: int) -> List[str]:
+    # termos de 3 letras em diante: aaa, aab, ...
+    lst_vocabulary = []
+    for i in range(int_size):
+        term = ""
+        while True:
+            i, letter = divmod(i, 26)
+            term = chr(97 + letter) + term
+            if i == 0 and len(term) >= 3:
+                break
+        lst_vocabulary.append(term)
+    return lst_vocabulary
+
+
+def zipf_cum_weights(int_size: int, zipf: float) -> List[float]:
+    # o termo de rank r é sorteado com probabilidade proporcional a 1/r^zipf
+    # (zipf = 0 é a distribuição uniforme)
+    return list(accumulate(1 / rank ** zipf for rank in range(1, int_size + 1)))
+
+
+def create_documents(config: dict):
+    # gera (doc_id, {termo: frequencia}) sem manter toda a coleção em memoria
+    rnd = random.Random(config["seed"])
+    lst_vocabulary = create_vocabulary(config["vocabulary"])
+    cum_weights = zipf_cum_weights(len(lst_vocabulary), config["zipf"])
+    for doc_id in range(1, config["docs"] + 1):
+        dic_terms = {}
+        for term in rnd.choices(lst_vocabulary, cum_weights=cum_weights, k=config["terms_per_doc"]):
+            dic_terms[term] = dic_terms.get(term, 0) + 1
+        yield doc_id, dic_terms
+
+
+def create_queries(config: dict) -> List[str]:
+    # consultas com a mesma distribuição dos termos da coleção
+    rnd = random.Random(config["seed"] + 1)
+    lst_vocabulary = create_vocabulary(config["vocabulary"])
+    return rnd.choices(lst_vocabulary, cum_weights=zipf_cum_weights(len(lst_vocabulary), config["zipf"]),
+                       k=config["lookups"])
+
+
+def percentiles(lst_values: List[float]) -> dict:
+    # percentis pelo metodo nearest-rank, em microssegundos
+    if not lst_values:
+        return {}
+    lst_sorted = sorted(lst_values)
+    dic_percentiles = {f"p{p}": lst_sorted[max(0, -(-p * len(lst_sorted) // 100) - 1)] * 10**6
+                       for p in PERCENTILES}
+    dic_percentiles["max"] = lst_sorted[-1] * 10**6
+    dic_percentiles["mean"] = sum(lst_sorted) / len(lst_sorted) * 10**6
+    return dic_percentiles
+
+
+def peak_rss() -> int:
+    # ru_maxrss é dado em KB no Linux e em bytes no macOS
+    int_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int_maxrss if sys.platform == "darwin" else int_maxrss * 1024
+
+
+def timed(dic_times: dict, str_name: str, method):
+    # acumula o tempo gasto nas chamadas de um metodo do indice
+    def wrapper(*args, **kwargs):
+        time = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            dic_times[str_name] = dic_times.get(str_name, 0) + perf_counter() - time
+            dic_times[f"{str_name}_count"] = dic_times.get(f"{str_name}_count", 0) + 1
+    return wrapper
+
+
+def run_benchmark(str_index_type: str, config: dict) -> dict:
+    index = INDEX_TYPES[str_index_type](config)
+    if config.get("posting_cache") and isinstance(index, FileIndex):
+        index.enable_posting_cache(config["posting_cache"], config.get("cache_policy", "lru"))
+    dic_times = {}
+    if isinstance(index, FileIndex):
+        index.save_tmp_occurrences = timed(dic_times, "flush", index.save_tmp_occurrences)
+        index.merge_all_runs = timed(dic_times, "merge", index.merge_all_runs)
+
+    int_occurrences = 0
+    time = perf_counter()
+    if config["mode"] == "term":
+        for doc_id, dic_terms in create_documents(config):
+            for term, freq in dic_terms.items():
+                index.index(term, doc_id, freq)
+            int_occurrences += len(dic_terms)
+    else:
+        for doc_id, dic_terms in create_documents(config):
+            index.index_document(doc_id, dic_terms)
+            int_occurrences += len(dic_terms)
+    delta_index = perf_counter() - time
+
+    time = perf_counter()
+    index.finish_indexing()
+    delta_finish = perf_counter() - time
+
+    lst_latencies = []
+    int_postings = 0
+    for term in create_queries(config):
+        time = perf_counter()
+        int_postings += len(index.get_occurrence_list(term))
+        lst_latencies.append(perf_counter() - time)
+
+    dic_result = {
+        "index": str_index_type,
+        "documents": config["docs"],
+        "vocabulary": len(index.vocabulary),
+        "occurrences": int_occurrences,
+        "index_seconds": delta_index,
+        "occurrences_per_second": int_occurrences / max(delta_index, 1e-9),
+        "flush_seconds": dic_times.get("flush", 0),
+        "flush_count": dic_times.get("flush_count", 0),
+        "merge_seconds": dic_times.get("merge", 0),
+        "finish_seconds": delta_finish,
+        "lookups": len(lst_latencies),
+        "lookup_postings": int_postings,
+        "lookup_latency_us": percentiles(lst_latencies),
+        "peak_rss_bytes": peak_rss(),
+    }
+    if index.posting_cache is not None:
+        dic_result["posting_cache"] = index.posting_cache.stats()
+
+    if isinstance(index, FileIndex):
+        index.remove_files()
+    return dic_result
+
+
+def run_isolated(str_index_type: str, config: dict) -> dict:
+    # cada indice em um novo processo: o pico de RSS não inclui os anteriores
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_benchmark, str_index_type, config).result()
+
+
+def print_summary(dic_result: dict, file=sys.stderr):
+    dic_latency = dic_result["lookup_latency_us"]
+    print((f"{dic_result['index']}: {dic_result['occurrences_per_second']:,.0f} ocorrencias/s; "
+           f"flush {dic_result['flush_seconds']:.2f}s ({dic_result['flush_count']} runs); "
+           f"merge {dic_result['merge_seconds']:.2f}s; finish {dic_result['finish_seconds']:.2f}s; "
+           f"consulta p50 {dic_latency.get('p50', 0):,.1f}us p99 {dic_latency.get('p99', 0):,.1f}us; "
+           f"pico RSS {dic_result['peak_rss_bytes'] / 10**6:,.1f} MB"), file=file, flush=True)
+
+
+def parse_args(lst_args: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark de indexação e consulta dos indices")
+    parser.add_argument("--docs", type=int, default=2000, help="quantidade de documentos")
+    parser.add_argument("--terms-per-doc", type=int, default=500, help="termos sorteados por documento")
+    parser.add_argument("--vocabulary", type=int, default=26**3, help="tamanho do vocabulario")
+    parser.add_argument("--zipf", type=float, default=1.0, help="expoente da distribuição de Zipf (0: uniforme)")
+    parser.add_argument("--lookups", type=int, default=10000, help="quantidade de consultas")
+    parser.add_argument("--indexes", default=",".join(INDEX_TYPES), help="tipos de indice, separados por virgula")
+    parser.add_argument("--mode", choices=["document", "term"], default="document",
+                        help="indexação por documento (index_document) ou termo a termo (index)")
+    parser.add_argument("--memory-budget", type=int, default=FileIndex.MEMORY_BUDGET,
+                        help="limite de memoria do FileIndex, em bytes")
+    parser.add_argument("--posting-cache", type=int, default=0,
+                        help="tamanho, em bytes, do cache de ocorrencias do FileIndex (0: sem cache)")
+    parser.add_argument("--cache-policy", choices=["lru", "slru"], default="lru")
+    parser.add_argument("--seed", type=int, default=10)
+    parser.add_argument("--no-isolate", action="store_true", help="executa todos os indices neste processo")
+    parser.add_argument("--output", help="arquivo JSON de saida (padrão: saida padrão)")
+    return parser.parse_args(lst_args)
+
+
+def main(lst_args: List[str] = None) -> dict:
+    args = parse_args(lst_args)
+    config = {"docs": args.docs, "terms_per_doc": args.terms_per_doc, "vocabulary": args.vocabulary,
+              "zipf": args.zipf, "lookups": args.lookups, "mode": args.mode,
+              "memory_budget": args.memory_budget, "posting_cache": args.posting_cache,
+              "cache_policy": args.cache_policy, "seed": args.seed}
+    lst_index_types = args.indexes.split(",")
+    for str_index_type in lst_index_types:
+        if str_index_type not in INDEX_TYPES:
+            raise Exception(f"Tipo de indice desconhecido: {str_index_type} (opções: {', '.join(INDEX_TYPES)})")
+
+    lst_results = []
+    for str_index_type in lst_index_types:
+        dic_result = (run_benchmark if args.no_isolate else run_isolated)(str_index_type, config)
+        print_summary(dic_result)
+        lst_results.append(dic_result)
+
+    dic_report = {"config": config, "python": sys.version.split()[0], "results": lst_results}
+    if args.output:
+        with open(args.output, "w") as w_file:
+            json.dump(dic_report, w_file, indent=2)
+    else:
+        json.dump(dic_report, sys.stdout, indent=2)
+        print()
+    return dic_report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from .benchmark import *
+import unittest
+import json
+import os
+import tempfile
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_vocabulary(self):
+        lst_vocabulary = create_vocabulary(800)
+        self.assertEqual(len(set(lst_vocabulary)), 800, "Os termos do vocabulario deveriam ser distintos")
+        self.assertListEqual(lst_vocabulary[:3], ["aaa", "aab", "aac"])
+
+    def test_zipf(self):
+        config = {"docs": 50, "terms_per_doc": 100, "vocabulary": 1000, "zipf": 1.0, "seed": 10}
+        dic_freqs = {}
+        for _, dic_terms in create_documents(config):
+            for term, freq in dic_terms.items():
+                dic_freqs[term] = dic_freqs.get(term, 0) + freq
+        self.assertEqual(sum(dic_freqs.values()), 50 * 100)
+        self.assertGreater(dic_freqs["aaa"], dic_freqs.get("aaz", 0) * 5, "O primeiro termo deveria ser muito mais frequente")
+        self.assertListEqual(list(create_documents(config)), list(create_documents(config)),
+                             "A coleção deveria ser a mesma para a mesma semente")
+
+    def test_percentiles(self):
+        dic_percentiles = percentiles([i / 10**6 for i in range(1, 101)])
+        self.assertAlmostEqual(dic_percentiles["p50"], 50)
+        self.assertAlmostEqual(dic_percentiles["p99"], 99)
+        self.assertAlmostEqual(dic_percentiles["max"], 100)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as str_dir:
+            str_output = os.path.join(str_dir, "bench.json")
+            main(["--docs", "30", "--terms-per-doc", "20", "--vocabulary", "100", "--lookups", "50",
+                  "--memory-budget", "25000", "--no-isolate", "--output", str_output])
+            with open(str_output) as r_file:
+                dic_report = json.load(r_file)
+
+        self.assertListEqual([result["index"] for result in dic_report["results"]], list(INDEX_TYPES))
+        for dic_result in dic_report["results"]:
+            self.assertEqual(dic_result["lookups"], 50)
+            self.assertGreater(dic_result["peak_rss_bytes"], 0)
+            self.assertIn("p99", dic_result["lookup_latency_us"])
+        # todos os indices devem retornar as mesmas ocorrencias
+        self.assertEqual(len({result["lookup_postings"] for result in dic_report["results"]}), 1)
+        self.assertGreater(dic_report["results"][2]["flush_count"], 1, "O FileIndex deveria gerar varias runs")
+
+
+if __name__ == "__main__":
+    unittest.main()
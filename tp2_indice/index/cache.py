@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+
+# Cache LRU limitado pela soma dos tamanhos das entradas (ex. bytes das listas
+# de ocorrencias ou, com tamanho 1 por entrada, quantidade de resultados).
+# Mantém as estatisticas de acertos, faltas e remoções
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        # chave -> (valor, tamanho), da entrada usada há mais tempo para a mais recente
+        self.dic_entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        entry = self.dic_entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.dic_entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size: int = 1):
+        self.remove(key)
+        # entradas maiores que o cache não são armazenadas
+        if size > self.max_size:
+            return
+        self.dic_entries[key] = (value, size)
+        self.size += size
+        self.evict()
+
+    def remove(self, key):
+        entry = self.dic_entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def evict(self):
+        while self.size > self.max_size:
+            _, (_, size) = self.dic_entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        # invalida todas as entradas (ex. o indice foi reconstruido)
+        self.dic_entries.clear()
+        self.size = 0
+        self.invalidations += 1
+
+    def __contains__(self, key) -> bool:
+        return key in self.dic_entries
+
+    def __len__(self):
+        return len(self.dic_entries)
+
+    @property
+    def hit_rate(self) -> float:
+        int_requests = self.hits + self.misses
+        return self.hits / int_requests if int_requests else 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self), "size": self.size,
+                "max_size": self.max_size}
+
+
+# LRU segmentado: entradas novas ficam no segmento de experiencia
+# (dic_entries) e só passam para o segmento protegido quando são acessadas
+# novamente. As remoções começam pelo segmento de experiencia, assim uma
+# sequencia de termos consultados uma unica vez não expulsa os termos
+# frequentes. O segmento protegido ocupa no maximo protected_ratio do cache;
+# o que exceder volta para o segmento de experiencia
+class SegmentedLRUCache(LRUCache):
+    PROTECTED_RATIO = 0.8
+
+    def __init__(self, max_size: int, protected_ratio: float = None):
+        super().__init__(max_size)
+        self.dic_protected = OrderedDict()
+        self.protected_size = 0
+        self.max_protected_size = int(max_size * (protected_ratio if protected_ratio else SegmentedLRUCache.PROTECTED_RATIO))
+
+    def get(self, key, default=None):
+        entry = self.dic_protected.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.dic_protected.move_to_end(key)
+            return entry[0]
+
+        entry = self.dic_entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        # segundo acesso: promove a entrada para o segmento protegido
+        self.hits += 1
+        self.dic_protected[key] = entry
+        self.protected_size += entry[1]
+        while self.protected_size > self.max_protected_size:
+            old_key, old_entry = self.dic_protected.popitem(last=False)
+            self.protected_size -= old_entry[1]
+            self.dic_entries[old_key] = old_entry
+        return entry[0]
+
+    def remove(self, key):
+        entry = self.dic_protected.pop(key, None)
+        if entry is not None:
+            self.protected_size -= entry[1]
+            self.size -= entry[1]
+            return
+        super().remove(key)
+
+    def evict(self):
+        while self.size > self.max_size:
+            dic_segment = self.dic_entries if self.dic_entries else self.dic_protected
+            _, (_, size) = dic_segment.popitem(last=False)
+            if dic_segment is self.dic_protected:
+                self.protected_size -= size
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.dic_protected.clear()
+        self.protected_size = 0
+        super().clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self.dic_protected or key in self.dic_entries
+
+    def __len__(self):
+        return len(self.dic_protected) + len(self.dic_entries)
+
+
+CACHE_POLICIES = {"lru": LRUCache, "slru": SegmentedLRUCache}
+
+
+def create_cache(max_size: int, policy: str = "lru") -> LRUCache:
+    if policy not in CACHE_POLICIES:
+        raise Exception(f"Politica de cache desconhecida: {policy} (opções: {', '.join(CACHE_POLICIES)})")
+    return CACHE_POLICIES[policy](max_size)
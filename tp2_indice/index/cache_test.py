@@ -0,0 +1,56 @@
+from .cache import *
+import unittest
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = LRUCache(10)
+        cache.put("a", 1, 4)
+        cache.put("b", 2, 4)
+        self.assertEqual(cache.get("a"), 1)
+        # "b" é a entrada usada há mais tempo
+        cache.put("c", 3, 4)
+        self.assertNotIn("b", cache)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.evictions, 1)
+
+        # entradas maiores que o cache não são armazenadas
+        cache.put("d", 4, 11)
+        self.assertNotIn("d", cache)
+        self.assertEqual(len(cache), 2)
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+        cache.clear()
+        self.assertEqual((len(cache), cache.size, cache.invalidations), (0, 0, 1))
+
+    def test_segmented_lru(self):
+        cache = create_cache(10, "slru")
+        self.assertIsInstance(cache, SegmentedLRUCache)
+        for key in ["a", "b"]:
+            cache.put(key, key, 2)
+            cache.get(key)
+        # uma sequencia de chaves acessadas uma unica vez não remove as frequentes
+        for i in range(20):
+            cache.put(i, i, 2)
+        self.assertIn("a", cache)
+        self.assertIn("b", cache)
+        self.assertEqual(cache.size, 10)
+        self.assertEqual(len(cache), 5)
+
+        # o segmento protegido é limitado: o excedente volta para o de experiencia
+        for key in [18, 19]:
+            cache.get(key)
+        self.assertLessEqual(cache.protected_size, 8)
+        cache.remove("a")
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.size, sum(size for _, size in list(cache.dic_entries.values()) + list(cache.dic_protected.values())))
+
+    def test_unknown_policy(self):
+        self.assertRaises(Exception, create_cache, 10, "xuxu")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+from typing import List, Tuple
+import struct
+
+# formato binario do arquivo de ocorrencias: cabeçalho versionado seguido de
+# registros de tamanho fixo (term_id, doc_id, term_freq), cada inteiro com 4 bytes
+IDX_FILE_MAGIC = b"OCIX"
+IDX_FILE_VERSION = 1
+IDX_FILE_HEADER = struct.Struct(">4sHH")
+OCCURRENCE_RECORD = struct.Struct(">III")
+# ponteiro de salto: (doc_id anterior ao bloco, posição do bloco nas ocorrencias do termo)
+SKIP_RECORD = struct.Struct(">II")
+# tamanho, em bytes, das posições de uma ocorrencia nas runs do indice posicional
+POSITIONS_LENGTH = struct.Struct(">I")
+# flag do arquivo final de posições: o bloco de cada termo com mais de um
+# bloco de ocorrencias começa com a posição (POSITIONS_LENGTH) das posições
+# de cada bloco
+POSITIONS_CHUNK_OFFSETS = 1
+# quantidade de registros lidos/escritos por vez no arquivo
+IO_BUFFER_RECORDS = 8192
+
+
+def write_idx_file_header(idx_file, flags: int = 0):
+    idx_file.write(IDX_FILE_HEADER.pack(IDX_FILE_MAGIC, IDX_FILE_VERSION, flags))
+
+
+def read_idx_file_header(idx_file) -> int:
+    header = idx_file.read(IDX_FILE_HEADER.size)
+    if len(header) < IDX_FILE_HEADER.size:
+        raise Exception("Bad structure format")
+
+    magic, version, flags = IDX_FILE_HEADER.unpack(header)
+    if magic != IDX_FILE_MAGIC or version != IDX_FILE_VERSION:
+        raise Exception(f"Bad structure format (magic: {magic}, version: {version})")
+    return flags
+
+
+# variable-byte: 7 bits por byte, com o bit mais significativo indicando que o
+# numero continua no proximo byte
+def vbyte_encode(values, buffer: bytearray = None) -> bytearray:
+    buffer = buffer if buffer is not None else bytearray()
+    for value in values:
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+    return buffer
+
+
+def vbyte_decode(buffer) -> List[int]:
+    values = []
+    append = values.append
+    value = 0
+    shift = 0
+    for byte in bytes(buffer):
+        if byte < 0x80:
+            append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+    return values
+
+
+# Posições de um termo em um documento (ordenadas), codificadas como gaps em
+# variable-byte. As posições de varios documentos são concatenadas e
+# separadas usando as frequencias (uma posição por ocorrencia do termo)
+def encode_positions(lst_positions: List[int]) -> bytes:
+    return bytes(vbyte_encode(b - a for a, b in zip([0] + lst_positions, lst_positions)))
+
+
+def decode_positions(buffer, lst_term_freqs: List[int]) -> List[List[int]]:
+    values = vbyte_decode(buffer)
+    lst_positions = []
+    start = 0
+    for term_freq in lst_term_freqs:
+        position = 0
+        positions = []
+        for gap in values[start:start + term_freq]:
+            position += gap
+            positions.append(position)
+        lst_positions.append(positions)
+        start += term_freq
+    return lst_positions
+
+
+def split_positions(buffer, lst_term_freqs: List[int]) -> List[bytes]:
+    # separa as posições concatenadas de varias ocorrencias (encode_positions
+    # de cada uma) sem decodifica-las: cada valor termina em um byte < 0x80
+    buffer = bytes(buffer)
+    lst_positions = []
+    start = 0
+    end = 0
+    for term_freq in lst_term_freqs:
+        while term_freq:
+            if buffer[end] < 0x80:
+                term_freq -= 1
+            end += 1
+        lst_positions.append(buffer[start:end])
+        start = end
+    return lst_positions
+
+
+# Um codec converte o bloco de ocorrencias de um termo, lista de (doc_id, term_freq)
+# ordenada por doc_id, em bytes e vice-versa. O flag do codec é gravado no
+# cabeçalho do arquivo final para que o leitor saiba como decodificar.
+# Como as ocorrencias são codificadas em sequencia, um bloco que começa no
+# meio da lista pode ser decodificado a partir do doc_id anterior a ele
+# (base_doc_id); a concatenação dos blocos é igual à codificação da lista toda.
+class PostingCodec:
+    flag = None
+    name = None
+
+    def encode(self, term_id: int, lst_postings: List[Tuple[int, int]], base_doc_id: int = 0) -> bytes:
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    def decode(self, term_id: int, buffer, base_doc_id: int = 0) -> List[Tuple[int, int]]:
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    def encode_chunks(self, term_id: int, lst_postings: List[Tuple[int, int]], chunk_size: int) -> List[Tuple[int, bytes]]:
+        # divide as ocorrencias em blocos de chunk_size, retornando (base_doc_id, bytes) de cada um
+        lst_chunks = []
+        base_doc_id = 0
+        for i in range(0, len(lst_postings), chunk_size):
+            lst_chunk = lst_postings[i:i + chunk_size]
+            lst_chunks.append((base_doc_id, self.encode(term_id, lst_chunk, base_doc_id)))
+            base_doc_id = lst_chunk[-1][0]
+        return lst_chunks
+
+
+class FixedWidthCodec(PostingCodec):
+    flag = 0
+    name = "fixed"
+
+    def encode(self, term_id: int, lst_postings: List[Tuple[int, int]], base_doc_id: int = 0) -> bytes:
+        pack = OCCURRENCE_RECORD.pack
+        return b"".join([pack(term_id, doc_id, term_freq) for doc_id, term_freq in lst_postings])
+
+    def decode(self, term_id: int, buffer, base_doc_id: int = 0) -> List[Tuple[int, int]]:
+        return [(doc_id, term_freq) for _, doc_id, term_freq in OCCURRENCE_RECORD.iter_unpack(buffer)]
+
+
+# doc_ids codificados como diferença em relação ao anterior (gaps) e, assim
+# como as frequencias, em variable-byte
+class VByteCodec(PostingCodec):
+    flag = 1
+    name = "vbyte"
+
+    def encode(self, term_id: int, lst_postings: List[Tuple[int, int]], base_doc_id: int = 0) -> bytes:
+        buffer = bytearray()
+        last_doc_id = base_doc_id
+        for doc_id, term_freq in lst_postings:
+            vbyte_encode((doc_id - last_doc_id, term_freq), buffer)
+            last_doc_id = doc_id
+        return bytes(buffer)
+
+    def decode(self, term_id: int, buffer, base_doc_id: int = 0) -> List[Tuple[int, int]]:
+        values = vbyte_decode(buffer)
+        lst_postings = []
+        doc_id = base_doc_id
+        for i in range(0, len(values), 2):
+            doc_id += values[i]
+            lst_postings.append((doc_id, values[i + 1]))
+        return lst_postings
+
+
+CODECS = {codec.flag: codec for codec in (FixedWidthCodec(), VByteCodec())}
+CODECS_BY_NAME = {codec.name: codec for codec in CODECS.values()}
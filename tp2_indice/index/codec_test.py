@@ -0,0 +1,41 @@
+from .codec import *
+import unittest
+
+
+class CodecTest(unittest.TestCase):
+    def setUp(self):
+        self.lst_postings = [(1, 3), (2, 1), (130, 200), (20000, 1), (2**31, 70000)]
+
+    def check_codec(self, codec: PostingCodec):
+        block = codec.encode(7, self.lst_postings)
+        self.assertListEqual(codec.decode(7, block), self.lst_postings,
+                             f"O codec {codec.name} deveria decodificar as mesmas ocorrencias codificadas")
+        self.assertListEqual(codec.decode(7, codec.encode(7, [])), [], "Um bloco vazio deveria ser decodificado como lista vazia")
+        return block
+
+    def test_fixed_width(self):
+        block = self.check_codec(FixedWidthCodec())
+        self.assertEqual(len(block), OCCURRENCE_RECORD.size * len(self.lst_postings))
+
+    def test_vbyte(self):
+        block = self.check_codec(VByteCodec())
+        # gaps/frequencias pequenos ocupam apenas um byte cada
+        self.assertEqual(len(VByteCodec().encode(1, [(1, 3), (2, 1), (3, 1)])), 6)
+        self.assertLess(len(block), OCCURRENCE_RECORD.size * len(self.lst_postings))
+
+    def test_positions(self):
+        lst_positions = [[0, 5, 200], [3], [1, 2, 3, 70000]]
+        buffer = b"".join([encode_positions(positions) for positions in lst_positions])
+        self.assertListEqual(decode_positions(buffer, [3, 1, 4]), lst_positions,
+                             "As posições de cada documento deveriam ser separadas pelas frequencias")
+        self.assertEqual(len(encode_positions([1, 2, 3])), 3)
+        self.assertListEqual(split_positions(buffer, [3, 1, 4]), [encode_positions(p) for p in lst_positions])
+
+    def test_codec_flags(self):
+        for flag, codec in CODECS.items():
+            self.assertIs(CODECS_BY_NAME[codec.name], codec)
+            self.assertEqual(codec.flag, flag)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,21 @@
 from .structure import *
+from .stats import IndexingStats
 import unittest
+import os
+import shutil
+import tempfile
 from .index_structure_test import StructureTest
 from .performance_test import PerformanceTest
 
 
 
 class FileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = None
+
+    def tearDown(self):
+        if self.index is not None:
+            self.index.remove_files()
 
     def check_idx_file(self, obj_index, set_occurrences):
         # print("verifica a ordem das ocorrencias")
@@ -42,11 +52,12 @@ class FileIndexTest(unittest.TestCase):
         print("Primeira execução (criação inicial do indice) [ok]")
 
         # print("adicina alguns")
+        # cada chamada gera uma run independente contendo apenas a lista atual
         self.index.lst_occurrences_tmp = [TermOccurrence(1,3,3),
                                         TermOccurrence(2,3,4)]
-        set_occurrences = set_occurrences | set(self.index.lst_occurrences_tmp)
+        set_all_occurrences = set_occurrences | set(self.index.lst_occurrences_tmp)
         self.index.save_tmp_occurrences()
-        self.check_idx_file(self.index, set_occurrences)
+        self.check_idx_file(self.index, {TermOccurrence(1,3,3), TermOccurrence(2,3,4)})
         print("Inserção de alguns itens - teste 1/2 [ok]")
 
 
@@ -58,11 +69,49 @@ class FileIndexTest(unittest.TestCase):
                                         TermOccurrence(3,1,1)]
 
         # print("checa ordenação do arquivo e verifica todas as ocorrencias existem")
-        set_occurrences = set_occurrences|set(self.index.lst_occurrences_tmp)
+        set_occurrences = set(self.index.lst_occurrences_tmp)
+        set_all_occurrences = set_all_occurrences | set_occurrences
         self.index.save_tmp_occurrences()
         self.check_idx_file(self.index, set_occurrences)
+        self.assertEqual(len(self.index.lst_run_files), 3, "Cada chamada de save_tmp_occurrences deve gerar uma nova run")
         print("Inserção de alguns itens - teste 2/2 [ok]")
 
+        # o merge k-way das runs gera o arquivo final com todas as ocorrencias
+        self.index.finish_indexing()
+        self.check_idx_file(self.index, set_all_occurrences)
+        self.assertEqual(len(self.index.lst_run_files), 0, "As runs devem ser removidas após o merge")
+        print("Merge das runs [ok]")
+
+    def test_merge_fan_in(self):
+        self.index = FileIndex(merge_fan_in=2)
+        set_occurrences = set()
+        for doc_id in range(5, 0, -1):
+            self.index.lst_occurrences_tmp = [TermOccurrence(doc_id, term_id, doc_id) for term_id in range(1, 4)]
+            set_occurrences = set_occurrences | set(self.index.lst_occurrences_tmp)
+            self.index.save_tmp_occurrences()
+
+        self.index.finish_indexing()
+        self.check_idx_file(self.index, set_occurrences)
+
+    def test_idx_file_format(self):
+        self.index = FileIndex()
+        self.index.lst_occurrences_tmp = [TermOccurrence(2,1,2), TermOccurrence(1,1,3)]
+        self.index.save_tmp_occurrences()
+
+        int_expected_size = IDX_FILE_HEADER.size + 2 * OCCURRENCE_RECORD.size
+        self.assertEqual(os.path.getsize(self.index.str_idx_file_name), int_expected_size,
+                         "O arquivo deve possuir o cabeçalho e um registro de tamanho fixo por ocorrência")
+
+        with open(self.index.str_idx_file_name, "r+b") as idx_file:
+            idx_file.write(b"XXXX")
+        with open(self.index.str_idx_file_name, "rb") as idx_file:
+            self.assertRaises(Exception, self.index.next_from_file, idx_file)
+
+        # o indice não foi finalizado: remove_files apaga as runs
+        str_run_dir = self.index.str_run_dir
+        self.index.remove_files()
+        self.assertFalse(os.path.exists(str_run_dir))
+
     def test_finish_indexing(self):
         self.index = FileIndex()
         self.index.lst_occurrences_tmp = [
@@ -111,6 +160,332 @@ class FileIndexTest(unittest.TestCase):
         arr_doc_por_termo = [3,3,1,2]
         [self.assertEqual(self.index.dic_index[arr_termos[i]].doc_count_with_term,arr_doc_por_termo[i],f"A quantidade de documentos que possuem o termo de id {self.index.dic_index[arr_termos[i]].term_id} seria {arr_doc_por_termo[i]} e não {self.index.dic_index[arr_termos[i]].doc_count_with_term}") for i in range(4)]
 
+        #testa o tamanho do bloco de ocorrencias de cada termo e a leitura direta pela posição
+        [self.assertEqual(self.index.dic_index[arr_termos[i]].term_file_length,int_size_of_occur*arr_doc_por_termo[i],f"O bloco de ocorrencias do termo de id {i+1} deveria ter {int_size_of_occur*arr_doc_por_termo[i]} bytes") for i in range(4)]
+        self.assertListEqual(self.index.get_occurrence_list("amarelo"),[TermOccurrence(1,4,5),TermOccurrence(2,4,5)])
+
+    def test_occurrence_buffer(self):
+        buffer = OccurrenceBuffer()
+        buffer.extend([TermOccurrence(2,4,5), TermOccurrence(2,2,1), TermOccurrence(1,2,1)])
+        buffer.add_document(3, [4, 1], [2, 7])
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(buffer.nbytes, 5 * 12, "Cada ocorrencia deveria ocupar 12 bytes no buffer")
+        self.assertEqual(buffer[-1], TermOccurrence(3,1,7))
+        self.assertListEqual(list(buffer.sorted_records()), [(1, 3, 7), (2, 1, 1), (2, 2, 1), (4, 2, 5), (4, 3, 2)])
+
+        buffer = OccurrenceBuffer(positional=True)
+        buffer.add(1, 1, 2, encode_positions([3, 9]))
+        buffer.add(1, 2, 1, encode_positions([4]))
+        self.assertEqual(buffer.pop(0), PositionalTermOccurrence(1, 1, 2, encode_positions([3, 9])))
+        self.assertEqual(buffer[0].positions, encode_positions([4]))
+
+    def test_occurrence_buffer_ids(self):
+        # doc_id e term_id ocupam 32 bits da chave: valores maiores não podem
+        # ser confundidos com outro documento ou termo
+        buffer = OccurrenceBuffer()
+        buffer.add(2**32 - 1, 2**32 - 1, 1)
+        self.assertEqual(buffer[0], TermOccurrence(2**32 - 1, 2**32 - 1, 1))
+        for doc_id, term_id in [(2**32 + 5, 1), (-1, 1), (5, 2**32)]:
+            self.assertRaises(ValueError, buffer.add, doc_id, term_id, 1)
+            self.assertRaises(ValueError, buffer.add_document, doc_id, [1, term_id], [1, 1])
+        self.assertEqual(len(buffer), 1)
+
+        self.index = FileIndex()
+        self.assertRaises(ValueError, self.index.index, "casa", 2**32 + 5, 1)
+        self.assertRaises(ValueError, self.index.index_document, 2**32 + 5, {"casa": 1})
+
+    def test_memory_budget(self):
+        # o vocabulario tambem conta no limite: com 3 termos sobram 20 ocorrencias por run
+        self.index = FileIndex(memory_budget=3 * FileIndex.VOCABULARY_ENTRY_BYTES + 20 * 12)
+        for doc_id in range(1, 31):
+            self.index.index_document(doc_id, {"casa": doc_id, "verde": 1, "azul": 2})
+        self.assertEqual(len(self.index.lst_run_files), 4, "Deveria ser gravada uma run a cada 7 documentos")
+        self.assertLess(self.index.memory_usage(), self.index.memory_budget)
+
+        self.index.finish_indexing()
+        self.assertListEqual([(o.doc_id, o.term_freq) for o in self.index.get_occurrence_list("casa")],
+                             [(doc_id, doc_id) for doc_id in range(1, 31)])
+
+    def test_vocabulary_over_budget(self):
+        # o vocabulario (que não é liberado pelas runs) ultrapassa o limite: o
+        # buffer mantém o tamanho minimo e não é gravada uma run por documento
+        int_budget = 10 * FileIndex.VOCABULARY_ENTRY_BYTES
+        self.index = FileIndex(memory_budget=int_budget)
+        for doc_id in range(1, 101):
+            self.index.index_document(doc_id, {f"t{doc_id}": 1, "casa": 1})
+        int_min_buffer = int(int_budget * FileIndex.MIN_BUFFER_FRACTION)
+        self.assertGreater(len(self.index.dic_index) * FileIndex.VOCABULARY_ENTRY_BYTES, int_budget)
+        self.assertLessEqual(len(self.index.lst_run_files), 100 * 24 // int_min_buffer + 1,
+                             "Cada run deveria ter ao menos o tamanho minimo do buffer")
+
+        self.index.finish_indexing()
+        self.assertListEqual([o.doc_id for o in self.index.get_occurrence_list("casa")], list(range(1, 101)))
+
+    def test_track_memory(self):
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            self.index = FileIndex(track_memory=True)
+            self.index.index("casa", 1, 1)
+            int_estimate = self.index.memory_usage()
+            lst_garbage = [object() for _ in range(100000)]
+            self.assertGreater(self.index.memory_usage(), int_estimate,
+                               "Com o tracemalloc a memoria alocada deveria ser considerada")
+            del lst_garbage
+        finally:
+            tracemalloc.stop()
+        self.index.finish_indexing()
+
+class RepeatedFinishTest(unittest.TestCase):
+    def tearDown(self):
+        self.index.remove_files()
+
+    def test_finish_twice(self):
+        self.index = FileIndex()
+        self.index.index("casa", 1, 2)
+        self.index.finish_indexing()
+        self.index.finish_indexing()
+        self.assertListEqual(self.index.get_occurrence_list("casa"), [TermOccurrence(1, 1, 2)],
+                             "Um novo finish_indexing sem ocorrencias novas não deveria alterar o indice")
+
+    def test_index_after_finish(self):
+        for codec in ["fixed", "vbyte"]:
+            self.index = FileIndex(codec=codec, skip_interval=2, merge_fan_in=2)
+            for doc_id in range(1, 6):
+                self.index.index_document(doc_id, {"casa": doc_id, "verde": 1})
+            self.index.finish_indexing()
+            for doc_id in range(6, 9):
+                self.index.index_document(doc_id, {"casa": 1, "azul": 3})
+                self.index.save_tmp_occurrences()
+            self.index.finish_indexing()
+
+            self.assertListEqual([(o.doc_id, o.term_freq) for o in self.index.get_occurrence_list("casa")],
+                                 [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 1), (7, 1), (8, 1)])
+            self.assertListEqual([o.doc_id for o in self.index.get_occurrence_list("verde")], [1, 2, 3, 4, 5])
+            self.assertEqual(self.index.document_count_with_term("azul"), 3)
+            cursor = self.index.get_posting_cursor("casa")
+            cursor.advance_to(7)
+            self.assertEqual(cursor.doc_id, 7)
+            self.index.remove_files()
+
+    def test_merge_fan_in(self):
+        for merge_fan_in in [1, 0, -1]:
+            self.assertRaises(ValueError, FileIndex, merge_fan_in=merge_fan_in)
+        self.index = FileIndex(merge_fan_in=2)
+        for doc_id in range(1, 6):
+            self.index.index("casa", doc_id, 1)
+            self.index.save_tmp_occurrences()
+        self.index.finish_indexing()
+        self.assertListEqual([o.doc_id for o in self.index.get_occurrence_list("casa")], [1, 2, 3, 4, 5])
+
+    def test_reader_after_finish(self):
+        # um leitor aberto antes de um novo finish_indexing continua com o
+        # indice da sua abertura
+        self.index = FileIndex(skip_interval=2)
+        self.index.enable_posting_cache(10**6)
+        for doc_id in range(1, 6):
+            self.index.index_document(doc_id, {"casa": doc_id, "verde": 1})
+        self.index.finish_indexing()
+        with self.index.open_reader() as reader:
+            self.assertListEqual([o.doc_id for o in reader.get_occurrence_list("casa")], [1, 2, 3, 4, 5])
+            for doc_id in range(6, 9):
+                self.index.index_document(doc_id, {"casa": 1, "azul": 3})
+            self.index.finish_indexing()
+
+            self.assertListEqual([o.doc_id for o in reader.get_occurrence_list("verde")], [1, 2, 3, 4, 5])
+            self.assertListEqual([o.doc_id for o in reader.get_occurrence_list("casa")], [1, 2, 3, 4, 5])
+            self.assertListEqual(reader.get_occurrence_list("azul"), [])
+            self.assertEqual(reader.document_count, 5)
+            self.assertListEqual([o.doc_id for o in self.index.get_occurrence_list("casa")], list(range(1, 9)))
+        with self.index.open_reader() as reader:
+            self.assertListEqual([o.doc_id for o in reader.get_occurrence_list("azul")], [6, 7, 8])
+            self.assertEqual(reader.document_count, 8)
+
+    def test_positional_index_after_finish(self):
+        self.index = FileIndex(positional=True)
+        self.index.index("casa", 1, 2, [0, 300])
+        self.index.finish_indexing()
+        self.index.index("casa", 2, 1, [5])
+        self.index.index("verde", 2, 1, [6])
+        self.index.finish_indexing()
+        self.assertDictEqual(self.index.get_position_lists("casa", [1, 2]), {1: [0, 300], 2: [5]})
+        self.assertDictEqual(self.index.get_position_lists("verde", [2]), {2: [6]})
+
+
+class PositionsTest(unittest.TestCase):
+    def tearDown(self):
+        self.index.remove_files()
+
+    def create_index(self, codec: str, int_docs: int) -> dict:
+        self.index = FileIndex(positional=True, codec=codec, skip_interval=4, merge_fan_in=2)
+        self.index.stats = IndexingStats()
+        dic_positions = {}
+        for doc_id in range(int_docs):
+            dic_positions[doc_id] = [doc_id % 3, 10 + doc_id, 200 + doc_id % 7] if doc_id % 5 else [doc_id]
+            self.index.index_document(doc_id, {"casa": dic_positions[doc_id], "verde": [1000 + doc_id]})
+        self.index.finish_indexing()
+        return dic_positions
+
+    def test_candidate_blocks(self):
+        for codec in ["fixed", "vbyte"]:
+            dic_positions = self.create_index(codec, 100)
+            lst_doc_ids = [0, 4, 5, 50, 99, 200]
+            dic_expected = {doc_id: dic_positions[doc_id] for doc_id in lst_doc_ids if doc_id in dic_positions}
+            for obj_index in [self.index, self.index.open_reader()]:
+                self.assertDictEqual(obj_index.get_position_lists("casa", lst_doc_ids), dic_expected,
+                                     f"Posições incorretas ({codec})")
+                self.assertDictEqual(obj_index.get_position_lists("casa", list(dic_positions)), dic_positions)
+                self.assertDictEqual(obj_index.get_position_lists("verde", [7]), {7: [1007]})
+            obj_index.close()
+
+            # apenas o bloco de ocorrencias do documento procurado é lido
+            int_bytes_read = self.index.stats.counter("bytes_read")
+            self.index.get_position_lists("casa", [50])
+            self.assertLess(self.index.stats.counter("bytes_read") - int_bytes_read,
+                            self.index.dic_index["casa"].term_file_length / 10)
+            self.index.remove_files()
+
+    def test_index_after_finish(self):
+        # o merge com o arquivo final anterior reconstroi a posição dos blocos
+        dic_positions = self.create_index("vbyte", 30)
+        for doc_id in range(30, 45):
+            dic_positions[doc_id] = [doc_id, doc_id + 1]
+            self.index.index_document(doc_id, {"casa": dic_positions[doc_id]})
+        self.index.finish_indexing()
+        self.assertDictEqual(self.index.get_position_lists("casa", list(dic_positions)), dic_positions)
+        self.assertDictEqual(self.index.get_position_lists("casa", [3, 40]), {3: [0, 13, 203], 40: [40, 41]})
+
+
+class PostingCacheTest(unittest.TestCase):
+    def test_posting_cache(self):
+        self.index = FileIndex()
+        for doc_id in range(1, 51):
+            self.index.index_document(doc_id, {"casa": doc_id, "verde": 1} if doc_id % 2 else {"casa": 1})
+        self.index.enable_posting_cache(10**6)
+        self.index.finish_indexing()
+        self.assertEqual(self.index.posting_cache.invalidations, 1, "O finish_indexing deveria invalidar o cache")
+
+        lst_occurrences = self.index.get_occurrence_list("casa")
+        self.assertEqual(len(lst_occurrences), 50)
+        self.assertListEqual(self.index.get_occurrence_list("casa"), lst_occurrences)
+        cursor = self.index.get_posting_cursor("casa")
+        cursor.advance_to(30)
+        self.assertEqual((cursor.doc_id, cursor.term_freq), (30, 1))
+        self.assertEqual((self.index.posting_cache.hits, self.index.posting_cache.misses), (2, 1))
+
+        # o leitor tem o seu proprio cache, do mesmo tamanho
+        with self.index.open_reader() as obj_reader:
+            self.assertListEqual(obj_reader.get_occurrence_list("casa"), lst_occurrences)
+            self.assertListEqual([o.doc_id for o in obj_reader.get_occurrence_list("verde")], list(range(1, 51, 2)))
+            self.assertListEqual(obj_reader.get_occurrence_list("casa"), lst_occurrences)
+            self.assertEqual(obj_reader.posting_cache.max_size, self.index.posting_cache.max_size)
+            self.assertEqual((obj_reader.posting_cache.hits, obj_reader.posting_cache.misses), (1, 2))
+        self.assertEqual(self.index.posting_cache.hits, 2)
+        self.assertEqual(len(self.index.posting_cache), 1)
+
+    def test_posting_cache_eviction(self):
+        self.index = FileIndex()
+        for doc_id in range(1, 11):
+            self.index.index_document(doc_id, {f"t{i}": 1 for i in range(20)})
+        self.index.finish_indexing()
+        with self.index.open_reader() as obj_reader:
+            obj_reader.enable_posting_cache(1000, "slru")
+            for i in range(20):
+                self.assertEqual(len(obj_reader.get_occurrence_list(f"t{i}")), 10)
+            self.assertLessEqual(obj_reader.posting_cache.size, 1000)
+            self.assertGreater(obj_reader.posting_cache.evictions, 0)
+
+
+class LexiconTest(unittest.TestCase):
+    def test_lexicon(self):
+        import tempfile
+        from .lexicon import Lexicon, write_lexicon
+        lst_terms = sorted({f"{prefix}{i}" for prefix in ["casa", "casaco", "verde", "ção"] for i in range(40)} | {"a"})
+        with tempfile.TemporaryDirectory() as str_dir:
+            str_file_name = os.path.join(str_dir, "lexicon")
+            write_lexicon(str_file_name, [(term, (i, i * 10, 1, 2, 3, 4, None, None, None))
+                                          for i, term in enumerate(lst_terms)])
+            lexicon = Lexicon(str_file_name)
+            self.assertEqual(len(lexicon), len(lst_terms))
+            self.assertListEqual(list(lexicon), lst_terms, "O lexico deveria manter os termos ordenados")
+            for i, term in enumerate(lst_terms):
+                self.assertEqual(lexicon[term], (i, i * 10, 1, 2, 3, 4, None, None, 0))
+            for term in ["", "b", "casa", "zzz", "casa399"]:
+                self.assertNotIn(term, lexicon)
+            self.assertIsNone(lexicon.get("xuxu"))
+
+            # intervalos que atravessam varios blocos
+            self.assertListEqual(lexicon.prefix_terms("casa"), [term for term in lst_terms if term.startswith("casa")])
+            self.assertListEqual(lexicon.prefix_terms("casaco1"), [term for term in lst_terms if term.startswith("casaco1")])
+            self.assertListEqual(lexicon.wildcard_terms("*1?"), [term for term in lst_terms if term[-2:-1] == "1"])
+            self.assertListEqual(lexicon.wildcard_terms("ção?"), ["ção0", "ção1", "ção2", "ção3", "ção4",
+                                                                  "ção5", "ção6", "ção7", "ção8", "ção9"])
+            self.assertListEqual(lexicon.prefix_terms("zz"), [])
+            self.assertListEqual(lexicon.prefix_terms(""), lst_terms)
+
+            # front coding: menor que a soma dos termos
+            self.assertLess(os.path.getsize(str_file_name) - lexicon.strings_pos,
+                            sum(len(term.encode("utf-8")) for term in lst_terms))
+            lexicon.close()
+
+
+class SavedFileIndexTest(unittest.TestCase):
+    def setUp(self):
+        # os arquivos do indice e o indice salvo ficam em diretorios temporarios
+        self.str_work_dir = tempfile.mkdtemp(prefix="file_index_")
+        self.str_idx_file_name = os.path.join(self.str_work_dir, "occur_idx_file")
+        self.str_dir = tempfile.mkdtemp(prefix="saved_index_")
+        self.index = None
+
+    def tearDown(self):
+        if self.index is not None:
+            self.index.remove_files()
+        shutil.rmtree(self.str_work_dir, ignore_errors=True)
+        shutil.rmtree(self.str_dir, ignore_errors=True)
+
+    def test_save_open(self):
+        str_dir = self.str_dir
+        self.index = FileIndex(tmp_dir=self.str_work_dir, positional=True, skip_interval=2,
+                               str_idx_file_name=self.str_idx_file_name)
+        for doc_id in [10, 7, 100102]:
+            for position, term in enumerate(["casa", "verde", f"doc{doc_id}"]):
+                self.index.index(term, doc_id, 1, [position])
+        self.assertRaises(Exception, self.index.save, str_dir)
+        self.index.finish_indexing()
+        self.index.save(str_dir)
+
+        with FileIndex.open(str_dir) as obj_reader:
+            self.assertIsNone(obj_reader.dic_document_length.doc_ids, "A tabela de documentos deveria ser lida sob demanda")
+            self.assertEqual(obj_reader.document_count, 3)
+            self.assertEqual(obj_reader.average_document_length, 3)
+            self.assertSetEqual(set(obj_reader.vocabulary), set(self.index.vocabulary))
+            for term in self.index.vocabulary:
+                self.assertListEqual(obj_reader.get_occurrence_list(term), self.index.get_occurrence_list(term))
+            self.assertEqual(obj_reader.document_length(100102), 3)
+            self.assertIn(7, obj_reader.set_documents)
+            self.assertDictEqual(obj_reader.get_position_lists("verde", [7, 10]), {7: [1], 10: [1]})
+
+            cursor = obj_reader.get_posting_cursor("casa")
+            cursor.advance_to(11)
+            self.assertEqual(cursor.doc_id, 100102)
+
+    def test_save_open_dense(self):
+        from .query import QueryProcessor
+        str_dir = self.str_dir
+        self.index = FileIndex(tmp_dir=self.str_work_dir, dense_doc_ids=True,
+                               str_idx_file_name=self.str_idx_file_name)
+        for doc_id in [100102, 7, 55]:
+            self.index.index("casa", doc_id, 1)
+        self.index.index("verde", 55, 2)
+        self.index.finish_indexing()
+        self.index.save(str_dir)
+
+        with FileIndex.open(str_dir) as obj_reader:
+            self.assertEqual(obj_reader.external_doc_id(0), 100102)
+            self.assertEqual(obj_reader.document_length(obj_reader.internal_doc_id(55)), 3)
+            self.assertListEqual(QueryProcessor(obj_reader).search_boolean("casa AND NOT verde"), [7, 100102])
+
+
 
 
 
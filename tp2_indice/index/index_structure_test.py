@@ -2,6 +2,70 @@ from index.structure import *
 
 import unittest
 
+class TermOccurrenceTest(unittest.TestCase):
+    def test_sort_key(self):
+        lst_occurrences = [TermOccurrence(2,4,5), TermOccurrence(2,2,1), TermOccurrence(1,2,1), TermOccurrence(1,1,3)]
+        buffer = OccurrenceBuffer()
+        buffer.extend(lst_occurrences)
+        self.assertListEqual([TermOccurrence(doc_id, term_id, term_freq)
+                              for term_id, doc_id, term_freq in buffer.sorted_records()], sorted(lst_occurrences),
+                             "A ordenação pela chave empacotada deve ser a mesma dos comparadores de TermOccurrence")
+
+    def test_slots(self):
+        self.assertFalse(hasattr(TermOccurrence(1,1,1), "__dict__"), "TermOccurrence não deveria possuir __dict__")
+        self.assertFalse(hasattr(TermFilePosition(1), "__dict__"), "TermFilePosition não deveria possuir __dict__")
+
+class PostingCursorTest(unittest.TestCase):
+    def test_advance_to(self):
+        lst_doc_ids = list(range(1, 1000, 3))
+        cursor = ListPostingCursor(lst_doc_ids, [1] * len(lst_doc_ids))
+        for doc_id in [1, 2, 5, 300, 301, 302, 997]:
+            cursor.advance_to(doc_id)
+            self.assertEqual(cursor.doc_id, min(x for x in lst_doc_ids if x >= doc_id),
+                             f"O cursor deveria estar no primeiro documento >= {doc_id}")
+        cursor.advance_to(5)
+        self.assertEqual(cursor.doc_id, 997, "O cursor não deveria voltar")
+        cursor.advance_to(1000)
+        self.assertEqual(cursor.doc_id, ListPostingCursor.END)
+
+    def test_file_cursor(self):
+        # blocos pequenos para testar os ponteiros de salto
+        for codec in CODECS_BY_NAME:
+            index = FileIndex(codec=codec, skip_interval=4)
+            lst_doc_ids = list(range(2, 200, 3))
+            for doc_id in lst_doc_ids:
+                index.index("casa", doc_id, doc_id % 7 + 1)
+            index.index("verde", 1, 1)
+            index.finish_indexing()
+
+            self.assertIsNotNone(index.dic_index["casa"].skip_file_start_pos)
+            self.assertIsNone(index.dic_index["verde"].skip_file_start_pos)
+            for obj_index in [index, index.open_reader()]:
+                cursor = obj_index.get_posting_cursor("casa")
+                self.assertEqual(len(cursor), len(lst_doc_ids))
+                lst_result = []
+                while cursor.doc_id != ListPostingCursor.END:
+                    lst_result.append((cursor.doc_id, cursor.term_freq))
+                    cursor.next()
+                self.assertListEqual(lst_result, [(doc_id, doc_id % 7 + 1) for doc_id in lst_doc_ids],
+                                     f"O cursor ({codec}) deveria percorrer todas as ocorrencias")
+
+                cursor = obj_index.get_posting_cursor("casa")
+                for doc_id in [3, 60, 61, 150]:
+                    cursor.advance_to(doc_id)
+                    self.assertEqual(cursor.doc_id, min(x for x in lst_doc_ids if x >= doc_id))
+                self.assertLess(cursor.decoded_postings, len(lst_doc_ids) // 2,
+                                "O cursor deveria decodificar apenas os blocos necessários")
+                cursor.advance_to(500)
+                self.assertEqual(cursor.doc_id, ListPostingCursor.END)
+                self.assertEqual(obj_index.get_posting_cursor("xuxu").doc_id, ListPostingCursor.END)
+            # o cursor ainda referencia o arquivo do leitor
+            cursor = obj_index.get_posting_cursor("casa")
+            obj_index.close()
+            self.assertIsNone(obj_index.mm_idx_file, "O leitor deveria ser fechado mesmo com um cursor em uso")
+            self.assertIsNone(obj_index.skip_file)
+            self.assertEqual(cursor.doc_id, lst_doc_ids[0])
+
 class StructureTest(unittest.TestCase):
     def create_terms(self):
         #casa apareceu 10 vezes no doc. 1
@@ -35,6 +99,14 @@ class StructureTest(unittest.TestCase):
 
         self.assertCountEqual(set_expected_vocab,set_vocab,f"Deveria haver a seguinte lista/conjunto: {set_expected_vocab} mas foi retornado: {set_vocab}")
 
+    def test_prefix_terms(self):
+        self.assertListEqual(self.index.prefix_terms("ver"), ["verde", "vermelho"])
+        self.assertListEqual(self.index.prefix_terms("casa"), ["casa"])
+        self.assertListEqual(self.index.prefix_terms("x"), [])
+        self.assertListEqual(self.index.wildcard_terms("ver?e"), ["verde"])
+        self.assertListEqual(self.index.wildcard_terms("*a"), ["casa"])
+        self.assertListEqual(self.index.wildcard_terms("*"), ["casa", "verde", "vermelho"])
+
     def test_document_count_with_term(self):
         self.assertEqual(2,self.index.document_count_with_term("casa"), f"Casa apareceu em dois documentos")
         self.assertEqual(3,self.index.document_count_with_term("vermelho"), f"Vemelho apareceu em dois documentos")
@@ -59,10 +131,128 @@ class StructureTest(unittest.TestCase):
         list_occur = self.index.get_occurrence_list('xuxu')
         self.assertListEqual(list_occur,[],"O termo xuxu não existe, deveria retornar lista vazia")
 
+class SortedLexiconTest(unittest.TestCase):
+    def test_term_id(self):
+        index = HashIndex()
+        for doc_id, term in enumerate(["verde", "casa", "azul", "casaco"]):
+            index.index(term, doc_id, 1)
+        index.finish_indexing()
+        self.assertListEqual(list(index.lexicon), ["azul", "casa", "casaco", "verde"])
+        for term in index.vocabulary:
+            self.assertEqual(index.lexicon.term_id(term), index.get_term_id(term))
+        self.assertIsNone(index.lexicon.term_id("xuxu"))
+
+        # termos indexados depois do finish_indexing também são encontrados
+        index.index("casinha", 5, 1)
+        self.assertListEqual(index.prefix_terms("cas"), ["casa", "casaco", "casinha"])
+
+class DenseDocumentIdTest(unittest.TestCase):
+    def test_document_mapping(self):
+        mapping = DocumentMapping()
+        self.assertListEqual([mapping.internal_id(doc_id) for doc_id in [100102, 7, 100102, 55]], [0, 1, 0, 2])
+        self.assertEqual(mapping.external_id(2), 55)
+        self.assertIn(7, mapping)
+        self.assertIsNone(mapping.find_internal_id(8))
+        self.assertEqual(len(mapping), 3)
+
+    def test_dense_document_length(self):
+        dic_length = DenseDocumentLength()
+        dic_length[3] = 10
+        dic_length[0] = 2
+        dic_length[3] = 12
+        self.assertEqual(len(dic_length), 2)
+        self.assertEqual(dic_length.get(3), 12)
+        self.assertEqual(dic_length.get(1, 0), 0)
+        self.assertNotIn(1, dic_length)
+        self.assertListEqual(list(dic_length.items()), [(0, 2), (3, 12)])
+
+    def test_dense_index(self):
+        index = HashIndex(dense_doc_ids=True)
+        for doc_id, term, freq in [(100102, "casa", 2), (100102, "verde", 1), (7, "casa", 1)]:
+            index.index(term, doc_id, freq)
+        index.finish_indexing()
+
+        self.assertSetEqual(index.set_documents, {0, 1})
+        self.assertListEqual([(o.doc_id, o.term_freq) for o in index.get_occurrence_list("casa")], [(0, 2), (1, 1)])
+        self.assertEqual(index.document_length(index.internal_doc_id(100102)), 3)
+        self.assertEqual(index.external_doc_id(1), 7)
+        self.assertEqual(index.get_term_id("casa"), 1)
+        self.assertEqual(index.get_term_id("verde"), 2)
+        self.assertIsInstance(index.dic_document_length, DenseDocumentLength)
+
+class BatchStructureTest(StructureTest):
+    def create_terms(self):
+        self.index.index_batch([(1, {"casa": 10, "vermelho": 3, "verde": 1}),
+                                (2, {"vermelho": 1, "casa": 3}),
+                                (3, {"vermelho": 1})])
+        self.index.finish_indexing()
+
+    def test_document_length(self):
+        self.assertEqual(self.index.document_length(1), 14, "O tamanho do documento 1 deveria ser a soma das frequencias")
+        self.assertEqual(self.index.average_document_length, 19 / 3)
+
+class CompactBatchStructureTest(BatchStructureTest):
+    def setUp(self):
+        self.index = CompactHashIndex()
+        self.create_terms()
+
+class FileBatchStructureTest(BatchStructureTest):
+    def setUp(self):
+        self.index = FileIndex()
+        self.create_terms()
+
+class CompactHashStructureTest(StructureTest):
+    def setUp(self):
+        self.index = CompactHashIndex()
+        self.create_terms()
+
 class FileStructureTest(StructureTest):
     def setUp(self):
         self.index = FileIndex()
         self.create_terms()
 
+class FileVByteStructureTest(StructureTest):
+    def setUp(self):
+        self.index = FileIndex(codec="vbyte")
+        self.create_terms()
+
+class FileVByteReaderStructureTest(StructureTest):
+    def setUp(self):
+        self.index = FileIndex(codec="vbyte")
+        self.create_terms()
+        self.index = self.index.open_reader()
+
+    def tearDown(self):
+        self.index.close()
+
+class FileReaderStructureTest(StructureTest):
+    def setUp(self):
+        self.index = FileIndex()
+        self.create_terms()
+        self.index = self.index.open_reader()
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_pickle_reader(self):
+        import pickle
+        obj_reader = pickle.loads(pickle.dumps(self.index))
+        self.assertListEqual(obj_reader.get_occurrence_list("casa"), self.index.get_occurrence_list("casa"))
+        obj_reader.close()
+class FileSavedStructureTest(FileReaderStructureTest):
+    def setUp(self):
+        import tempfile
+        self.str_dir = tempfile.mkdtemp(prefix="saved_index_")
+        obj_index = FileIndex(codec="vbyte")
+        self.index = obj_index
+        self.create_terms()
+        obj_index.save(self.str_dir)
+        self.index = FileIndex.open(self.str_dir)
+
+    def tearDown(self):
+        import shutil
+        self.index.close()
+        shutil.rmtree(self.str_dir, ignore_errors=True)
+
 if __name__ == "__main__":
     unittest.main()
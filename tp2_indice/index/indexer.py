@@ -2,17 +2,62 @@ import fnmatch
 
 from nltk.stem.snowball import SnowballStemmer
 from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from multiprocessing import Pool
+from collections import OrderedDict
+from copy import copy
+from threading import Event, Thread
+from queue import Full, Queue
 from pathlib import Path
+from typing import Set
 import string
+import json
+import io
+import re
 import nltk
 import os
 
+from .stats import IndexingStats
+
 # nltk.download('punkt')
 
+# Extrator de texto em streaming: percorre o HTML com o HTMLParser da biblioteca
+# padrão, sem construir a arvore do documento, coletando apenas os textos
+# fora de blocos de script, estilo e navegação
+class PlainTextExtractor(HTMLParser):
+    SKIP_TAGS = {"script", "style", "noscript", "template", "nav"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lst_text = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in PlainTextExtractor.SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in PlainTextExtractor.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.lst_text.append(data)
+
+    def get_text(self, html_doc: str) -> str:
+        self.reset()
+        self.lst_text = []
+        self.skip_depth = 0
+        self.feed(html_doc)
+        self.close()
+        return "".join(self.lst_text)
+
+
 class Cleaner:
     def __init__(self,stop_words_file:str,language:str,
                         perform_stop_words_removal:bool,perform_accents_removal:bool,
-                        perform_stemming:bool):
+                        perform_stemming:bool, cache_size:int = 100000,
+                        html_extractor:str = "beautifulsoup"):
         self.set_stop_words = self.read_stop_words(stop_words_file)
 
         self.stemmer = SnowballStemmer(language)
@@ -27,8 +72,31 @@ class Cleaner:
         self.perform_accents_removal = perform_accents_removal
         self.perform_stemming = perform_stemming
 
+        # cache LRU palavra -> termo preprocessado (None para palavras descartadas)
+        self.cache_size = cache_size
+        self.dic_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # "beautifulsoup" ou "fast" (PlainTextExtractor)
+        self.html_extractor = html_extractor
+        self.text_extractor = PlainTextExtractor()
+
+        # estatisticas opcionais (IndexingStats): tempo de remoção do HTML e de stemming
+        self.stats = None
+
     def html_to_plain_text(self,html_doc:str) ->str:
+        if self.stats is None:
+            return self.html_to_plain_text_uncounted(html_doc)
+        with self.stats.timer("html"):
+            return self.html_to_plain_text_uncounted(html_doc)
+
+    def html_to_plain_text_uncounted(self,html_doc:str) ->str:
         try: 
+            if self.html_extractor == "fast":
+                if hasattr(html_doc, "read"):
+                    html_doc = html_doc.read()
+                return self.text_extractor.get_text(html_doc)
             return BeautifulSoup(html_doc, features="lxml").get_text()
         except: 
             return None
@@ -51,6 +119,22 @@ class Cleaner:
         return term.translate(self.accents_translation_table)
 
     def preprocess_word(self,term:str) -> str:
+        if not self.cache_size:
+            return self.preprocess_word_uncached(term)
+
+        if term in self.dic_cache:
+            self.cache_hits += 1
+            self.dic_cache.move_to_end(term)
+            return self.dic_cache[term]
+
+        self.cache_misses += 1
+        processed_term = self.preprocess_word_uncached(term)
+        self.dic_cache[term] = processed_term
+        if len(self.dic_cache) > self.cache_size:
+            self.dic_cache.popitem(last=False)
+        return processed_term
+
+    def preprocess_word_uncached(self,term:str) -> str:
         term = str.lower(term)
 
         if self.perform_stop_words_removal and self.is_stop_word(term):
@@ -60,10 +144,56 @@ class Cleaner:
             term = self.remove_accents(term)  
 
         if self.perform_stemming:
-            term = self.word_stem(term)
+            if self.stats is None:
+                term = self.word_stem(term)
+            else:
+                with self.stats.timer("stemming"):
+                    term = self.word_stem(term)
 
         return term
 
+    def save_cache(self, str_file: str):
+        with open(str_file, "w") as cache_file:
+            json.dump(list(self.dic_cache.items()), cache_file)
+
+    def load_cache(self, str_file: str):
+        # o arquivo deve ter sido gerado com as mesmas flags de preprocessamento
+        with open(str_file, "r") as cache_file:
+            for term, processed_term in json.load(cache_file):
+                self.dic_cache[term] = processed_term
+        while len(self.dic_cache) > self.cache_size:
+            self.dic_cache.popitem(last=False)
+
+    def clear_cache(self):
+        self.dic_cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+class Tokenizer:
+    def tokenize(self, plain_text: str):
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+
+class NLTKTokenizer(Tokenizer):
+    def tokenize(self, plain_text: str):
+        # tokeniza uma linha por vez
+        for line in io.StringIO(plain_text):
+            yield from nltk.word_tokenize(line)
+
+
+# Tokenizador padrão: uma unica passada de expressão regular que já emite
+# apenas palavras, ou seja, sequencias de caracteres que não são espaço nem
+# pontuação (set_punctuation do Cleaner)
+class RegexTokenizer(Tokenizer):
+    def __init__(self, set_punctuation: Set[str]):
+        str_punctuation = re.escape("".join(sorted(set_punctuation)))
+        self.word_regex = re.compile(f"[^\\s{str_punctuation}]+")
+
+    def tokenize(self, plain_text: str):
+        for match in self.word_regex.finditer(plain_text):
+            yield match.group()
+
+
 class HTMLIndexer:
     cleaner = Cleaner(stop_words_file="stopwords.txt",
                         language="portuguese",
@@ -71,45 +201,268 @@ class HTMLIndexer:
                         perform_accents_removal=True,
                         perform_stemming=True)
     
-    def __init__(self, index: "HashIndex"):
+    def __init__(self, index: "HashIndex", tokenizer: Tokenizer = None, positional: bool = None,
+                 stats: IndexingStats = None):
         self.index = index
+        self.tokenizer = tokenizer if tokenizer else RegexTokenizer(self.cleaner.set_punctuation)
+        # no modo posicional, cada documento é representado por termo -> lista
+        # de posições (ao inves de termo -> frequencia); por padrão, segue o indice
+        self.positional = positional if positional is not None else bool(index is not None and index.positional)
+
+        # as estatisticas são compartilhadas com o indice e com um cleaner
+        # proprio do indexador: uma copia rasa do cleaner da classe, que
+        # compartilha o stemmer, as stopwords e o cache de stemming, mas não
+        # as estatisticas. Com num_workers > 1, html, tokenize e normalize são
+        # executados nos processos do pool e não são contabilizados
+        self.stats = stats
+        if stats is not None:
+            self.cleaner = copy(HTMLIndexer.cleaner)
+            self.cleaner.stats = stats
+            if index is not None:
+                index.stats = stats
 
     def text_word_count(self,plain_text:str):
+        return self.count_terms(self.normalize(self.tokenize(plain_text)))
+
+    def text_word_positions(self, plain_text: str) -> dict:
+        dic_word_positions = {}
+        for position, term in self.normalize_positions(self.tokenize(plain_text)):
+            dic_word_positions.setdefault(term, []).append(position)
+        return dic_word_positions
+
+    def text_terms(self, plain_text: str) -> dict:
+        if self.stats is not None:
+            return self.text_terms_with_stats(plain_text)
+        return self.text_word_positions(plain_text) if self.positional else self.text_word_count(plain_text)
+
+    def text_terms_with_stats(self, plain_text: str) -> dict:
+        # os tokens são materializados para medir a tokenização separadamente
+        # da normalização (que inclui o tempo de stemming)
+        with self.stats.timer("tokenize"):
+            lst_tokens = list(self.tokenize(plain_text))
+        # o cache de stemming é compartilhado: são contados apenas os acessos
+        # deste documento
+        int_cache_hits = self.cleaner.cache_hits
+        int_cache_misses = self.cleaner.cache_misses
+        with self.stats.timer("normalize"):
+            if self.positional:
+                dic_terms = {}
+                for position, term in self.normalize_positions(lst_tokens):
+                    dic_terms.setdefault(term, []).append(position)
+                int_terms = sum(map(len, dic_terms.values()))
+            else:
+                dic_terms = self.count_terms(self.normalize(lst_tokens))
+                int_terms = sum(dic_terms.values())
+
+        self.stats.add("tokens", len(lst_tokens))
+        self.stats.add("stopwords_dropped", len(lst_tokens) - int_terms)
+        self.stats.add("stem_cache_hits", self.cleaner.cache_hits - int_cache_hits)
+        self.stats.add("stem_cache_misses", self.cleaner.cache_misses - int_cache_misses)
+        return dic_terms
+
+    # Pipeline de indexação em geradores: descobrir arquivos -> ler -> remover
+    # HTML -> tokenizar -> normalizar -> contar -> indexar. Cada etapa consome
+    # e produz um item por vez, então nenhuma delas materializa a coleção (nem
+    # a lista de tokens de um documento) e as etapas podem ser trocadas ou
+    # paralelizadas de forma independente.
+    def discover_files(self, path: str):
+        for i, file_path in enumerate(sorted(Path(path).rglob('*.html'))):
+            yield i, file_path
+
+    def discover_files_by_name(self, path: str):
+        # Exercício 14: o doc_id é o nome do arquivo
+        for str_sub_dir in os.listdir(path):
+            path_sub_dir = f"{path}/{str_sub_dir}"
+            for str_sub_sub in os.listdir(path_sub_dir):
+                yield int(str_sub_sub.split(".")[0]), f"{path_sub_dir}/{str_sub_sub}"
+
+    def read_documents(self, files):
+        # arquivos que não puderam ser lidos são ignorados (texto None), assim
+        # um erro de leitura não interrompe a indexação (nem a thread de leitura)
+        for doc_id, file_path in files:
+            try:
+                if self.stats is None:
+                    text_html = self.read_document(file_path)
+                else:
+                    with self.stats.timer("read"):
+                        text_html = self.read_document(file_path)
+                    self.stats.add("html_bytes_read", len(text_html))
+            except (OSError, UnicodeDecodeError):
+                self.document_failed()
+                text_html = None
+            yield doc_id, text_html
+
+    def read_document(self, file_path) -> str:
+        with open(file_path, "r") as idx_file:
+            return idx_file.read()
+
+    def plain_texts(self, documents):
+        for doc_id, text_html in documents:
+            if text_html is None:
+                yield doc_id, None
+                continue
+            try:
+                plain_text = self.cleaner.html_to_plain_text(text_html)
+            except:
+                self.document_failed()
+                plain_text = None
+            yield doc_id, plain_text
+
+    def tokenize(self, plain_text: str):
+        return self.tokenizer.tokenize(plain_text)
+
+    def normalize(self, tokens):
+        preprocess_word = self.cleaner.preprocess_word
+        for token in tokens:
+            term = preprocess_word(token)
+            if term:
+                yield term
+
+    def normalize_positions(self, tokens):
+        # a posição é a do token no texto: termos removidos (ex. stopwords)
+        # também contam, assim a distancia entre os termos é preservada
+        preprocess_word = self.cleaner.preprocess_word
+        for position, token in enumerate(tokens):
+            term = preprocess_word(token)
+            if term:
+                yield position, term
+
+    def count_terms(self, terms) -> dict:
         dic_word_count = {}
-        
-        words = [self.cleaner.preprocess_word(w) for w in nltk.word_tokenize(plain_text)]
-        
-        for w in words:
-            if w in dic_word_count:
-                dic_word_count[w] = dic_word_count[w] + 1
-            elif w:
-                dic_word_count[w] = 1
+        for w in terms:
+            dic_word_count[w] = dic_word_count.get(w, 0) + 1
         return dic_word_count
 
-    def index_text(self,doc_id:int, text_html:str):
+    def word_counts(self, plain_texts):
+        # documentos com erro são ignorados (dicionário None); os que falharam
+        # nas etapas anteriores (texto None) já foram contabilizados
+        for doc_id, plain_text in plain_texts:
+            if plain_text is None:
+                yield doc_id, None
+                continue
+            try:
+                yield doc_id, self.text_terms(plain_text)
+            except:
+                self.document_failed()
+                yield doc_id, None
+
+    def document_failed(self):
+        if self.stats is not None:
+            self.stats.add("documents_failed")
+
+    def parallel_word_counts(self, files, pool: Pool, chunksize: int = 16):
+        # remoção do HTML, tokenização e normalização feitas nos processos do pool;
+        # imap mantém a ordem dos arquivos e limita o que é enviado por vez (chunksize)
+        lst_files = list(files)
+        lst_doc_ids = [doc_id for doc_id, _ in lst_files]
+        lst_paths = [file_path for _, file_path in lst_files]
+        yield from zip(lst_doc_ids, pool.imap(html_file_word_count, lst_paths, chunksize))
+
+    def index_word_counts(self, word_counts):
+        for doc_id, dict_text in word_counts:
+            if dict_text is not None:
+                self.index_word_count(doc_id, dict_text)
+
+    def html_word_count(self, text_html: str):
         plain_text = self.cleaner.html_to_plain_text(text_html) # (1)
-        dict_text = self.text_word_count(plain_text) #(2)
-        
-        for w, freq in dict_text.items():
-            self.index.index(w, doc_id, freq)
+        return self.text_terms(plain_text) #(2)
+
+    def index_text(self,doc_id:int, text_html:str):
+        dict_text = self.html_word_count(text_html)
+        self.index_word_count(doc_id, dict_text)
+
+    def index_word_count(self, doc_id: int, dict_text: dict):
+        # termo -> frequencia ou, no modo posicional, termo -> posições
+        if self.stats is None:
+            self.index.index_document(doc_id, dict_text)
+            return
+
+        with self.stats.timer("index"):
+            self.index.index_document(doc_id, dict_text)
+        self.stats.add("documents")
+        self.stats.add("postings", len(dict_text))
+        self.stats.progress()
+
+    def index_files(self, files, num_workers: int = 1, chunksize: int = 16, buffer_size: int = 64):
+        if num_workers <= 1:
+            # a leitura dos arquivos é feita em uma thread, à frente do parsing,
+            # com no maximo buffer_size documentos em memória
+            documents = prefetch(self.read_documents(files), buffer_size)
+            self.index_word_counts(self.word_counts(self.plain_texts(documents)))
+            return
+
+        with Pool(num_workers, initializer=init_word_count_worker, initargs=(self.tokenizer, self.positional)) as pool:
+            self.index_word_counts(self.parallel_word_counts(files, pool, chunksize))
 
     def index_text_dir(self, path: str):
-        # Exercício 14
-        for str_sub_dir in os.listdir(path):
-            path_sub_dir = f"{path}/{str_sub_dir}"
-            for str_sub_sub in os.listdir(path_sub_dir):
-                file_path = f"{path_sub_dir}/{str_sub_sub}"
-                with open(file_path, "r") as idx_file:
-                    idx_file.read
-                    ID = int(str_sub_sub.split(".")[0])
-                    self.index_text(ID, idx_file)
+        self.index_files(self.discover_files_by_name(path))
 
     # Wikipedia
-    def index_all_text_recursively(self, path: str):
-        for i, path in enumerate(Path(path).rglob('*.html')):
-            with open(path, "r") as idx_file:
-                idx_file.read
-                try:
-                    self.index_text(i, idx_file)
-                except:
-                    pass
\ No newline at end of file
+    # Com num_workers > 1, o parsing, a tokenização e o stemming são feitos em
+    # um pool de processos que retornam apenas o dicionário termo -> frequencia
+    # de cada documento; a indexação continua em um unico processo. Os arquivos
+    # são percorridos em ordem e os resultados consumidos na mesma ordem
+    # (imap), assim os doc_ids são os mesmos da execução sequencial.
+    def index_all_text_recursively(self, path: str, num_workers: int = 1, chunksize: int = 16):
+        self.index_files(self.discover_files(path), num_workers, chunksize)
+
+
+def prefetch(iterable, buffer_size: int = 64, put_timeout: float = 0.1):
+    # consome o iteravel em uma thread separada mantendo no maximo buffer_size
+    # itens prontos; exceções da thread são repassadas ao consumidor. Se o
+    # consumidor parar antes do fim (exceção ou gerador fechado), a thread é
+    # avisada por stop e deixa de esperar espaço na fila
+    queue = Queue(maxsize=buffer_size)
+    stop = Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=put_timeout)
+                return True
+            except Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(end)
+        except BaseException as e:
+            put(e)
+
+    thread = Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is end:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# indexador usado pelos processos do pool, criado uma vez por processo
+worker_html_indexer = None
+
+
+def init_word_count_worker(tokenizer: Tokenizer, positional: bool = False):
+    global worker_html_indexer
+    worker_html_indexer = HTMLIndexer(None, tokenizer, positional)
+
+
+def html_file_word_count(file_path: Path):
+    # executado nos processos do pool: precisa estar no nivel do modulo para
+    # ser serializado. Arquivos com erro são ignorados (retorna None)
+    html_indexer = worker_html_indexer if worker_html_indexer else HTMLIndexer(None)
+    try:
+        with open(file_path, "r") as idx_file:
+            return html_indexer.html_word_count(idx_file.read())
+    except:
+        return None
@@ -1,5 +1,8 @@
 from index.indexer import *
 from index.structure import *
+from index.query import QueryProcessor
+from datetime import datetime
+from pathlib import Path
 import unittest
 
 
@@ -33,5 +36,187 @@ class IndexerTest(unittest.TestCase):
                              f"A frequencia do termo 'cas' no documento {occur.doc_id} deveria ser {occur.term_freq}")
 
 
+    def test_indexer_parallel(self):
+        obj_index = HashIndex()
+        HTMLIndexer(obj_index).index_all_text_recursively("index/docs_test")
+        obj_index_parallel = HashIndex()
+        HTMLIndexer(obj_index_parallel).index_all_text_recursively("index/docs_test", num_workers=2)
+
+        self.assertCountEqual(obj_index.vocabulary, obj_index_parallel.vocabulary,
+                              "A indexação paralela deveria gerar o mesmo vocabulário")
+        for term in obj_index.vocabulary:
+            self.assertListEqual(obj_index.get_occurrence_list(term), obj_index_parallel.get_occurrence_list(term),
+                                 f"As ocorrencias do termo {term} deveriam ser as mesmas (inclusive os doc_ids)")
+
+
+class TokenizerTest(unittest.TestCase):
+    def test_regex_tokenizer(self):
+        tokenizer = RegexTokenizer(HTMLIndexer.cleaner.set_punctuation)
+        self.assertListEqual(list(tokenizer.tokenize("A casa é verde, não é? casa!")),
+                             ["A", "casa", "é", "verde", "não", "é", "casa"])
+
+    def test_text_word_count(self):
+        dic_expected = {'dad': 2, 'o': 1, 'ola': 1, 'precis': 1, 'qual': 1, 'que': 1}
+        for tokenizer in [None, NLTKTokenizer()]:
+            html_indexer = HTMLIndexer(HashIndex(), tokenizer)
+            self.assertDictEqual(html_indexer.text_word_count("Olá! Qual é o dado dado que precisa?"), dic_expected)
+
+    def test_text_word_positions(self):
+        # "é" é removido, mas sua posição é mantida
+        html_indexer = HTMLIndexer(HashIndex(positional=True))
+        self.assertTrue(html_indexer.positional)
+        self.assertDictEqual(html_indexer.text_word_positions("Olá! Qual é o dado dado que precisa?"),
+                             {'ola': [0], 'qual': [1], 'o': [3], 'dad': [4, 5], 'que': [6], 'precis': [7]})
+
+        html_indexer.index_text(1, "<html><body>o dado que precisa</body></html>")
+        self.assertListEqual(QueryProcessor(html_indexer.index, html_indexer).search_phrase("dado que"), [1])
+
+
+class PipelineTest(unittest.TestCase):
+    def test_prefetch(self):
+        self.assertListEqual(list(prefetch(iter(range(100)), buffer_size=3)), list(range(100)))
+
+        def fail():
+            yield 1
+            raise ValueError("erro na etapa")
+        self.assertRaises(ValueError, list, prefetch(fail()))
+
+    def test_prefetch_stop(self):
+        # o consumidor para antes do fim: a thread de leitura deve terminar
+        import threading
+        import time
+        lst_produced = []
+
+        def produce():
+            for i in range(1000):
+                lst_produced.append(i)
+                yield i
+        int_threads = threading.active_count()
+        documents = prefetch(produce(), buffer_size=2, put_timeout=0.01)
+        self.assertEqual(next(documents), 0)
+        documents.close()
+        for _ in range(100):
+            if threading.active_count() == int_threads:
+                break
+            time.sleep(0.01)
+        self.assertEqual(threading.active_count(), int_threads, "A thread de leitura deveria terminar")
+        self.assertLess(len(lst_produced), 10)
+
+    def test_pipeline_stages(self):
+        html_indexer = HTMLIndexer(HashIndex())
+        documents = html_indexer.read_documents(html_indexer.discover_files_by_name("index/docs_test"))
+        dic_word_counts = dict(html_indexer.word_counts(html_indexer.plain_texts(documents)))
+
+        self.assertCountEqual(dic_word_counts.keys(), [100102, 100110, 111])
+        self.assertEqual(dic_word_counts[100102]["cas"], 2)
+        self.assertDictEqual(html_indexer.count_terms(iter(["a", "b", "a"])), {"a": 2, "b": 1})
+
+    def test_read_error(self):
+        # arquivos inexistentes ou que não podem ser decodificados são ignorados
+        # sem interromper a leitura (feita na thread de prefetch)
+        stats = IndexingStats()
+        html_indexer = HTMLIndexer(HashIndex(), stats=stats)
+        lst_files = [(1, "index/docs_test/xuxu.html"), (2, "index/docs_test")] + \
+                    list(html_indexer.discover_files_by_name("index/docs_test"))
+        html_indexer.index_files(lst_files)
+
+        self.assertEqual(stats.counter("documents_failed"), 2)
+        self.assertEqual(stats.counter("documents"), 3)
+        self.assertEqual(html_indexer.index.document_count, 3)
+        self.assertListEqual(list(html_indexer.read_documents([(1, "index/docs_test/xuxu.html")])), [(1, None)])
+
+
+    def test_stats(self):
+        lst_progress = []
+        stats = IndexingStats(progress_callback=lst_progress.append, progress_interval=0)
+        html_indexer = HTMLIndexer(HashIndex(), stats=stats)
+        html_indexer.index_files(html_indexer.discover_files_by_name("index/docs_test"))
+
+        self.assertIs(html_indexer.index.stats, stats)
+        self.assertIsNone(HTMLIndexer.cleaner.stats, "O cleaner compartilhado não deveria receber as estatisticas")
+        self.assertEqual(stats.counter("stem_cache_hits") + stats.counter("stem_cache_misses"),
+                         stats.counter("tokens"), "Deveriam ser contados apenas os acessos ao cache desta indexação")
+        self.assertEqual(stats.counter("documents"), 3)
+        self.assertEqual(len(lst_progress), 3, "O progresso deveria ser informado a cada documento")
+        self.assertGreater(stats.counter("tokens"), stats.counter("stopwords_dropped"))
+        self.assertGreater(stats.counter("stopwords_dropped"), 0)
+        self.assertEqual(stats.counter("postings"), sum(html_indexer.index.document_count_with_term(term)
+                                                        for term in html_indexer.index.vocabulary))
+        for str_stage in ["read", "html", "tokenize", "normalize", "index"]:
+            self.assertIn(str_stage, stats.dic_times, f"A etapa {str_stage} deveria ser medida")
+
+
+class HTMLExtractorTest(unittest.TestCase):
+    def test_fast_extractor(self):
+        extractor = PlainTextExtractor()
+        self.assertEqual(extractor.get_text("&copy; oi! Meu nome é <strong>Hasan</strong>"), "© oi! Meu nome é Hasan")
+        self.assertEqual(extractor.get_text("<p>a<script>var x = 1;</script>b<nav><a>menu</a></nav>c</p>"), "abc")
+
+    def test_same_words(self):
+        cleaner_fast = Cleaner(stop_words_file="stopwords.txt", language="portuguese",
+                               perform_stop_words_removal=True, perform_accents_removal=True,
+                               perform_stemming=True, html_extractor="fast")
+        for file_path in Path("index/docs_test").rglob("*.html"):
+            with open(file_path, "r") as html_file:
+                text_html = html_file.read()
+            self.assertListEqual(HTMLIndexer.cleaner.html_to_plain_text(text_html).split(),
+                                 cleaner_fast.html_to_plain_text(text_html).split(),
+                                 f"Os extratores deveriam gerar o mesmo texto para {file_path}")
+
+
+class HTMLExtractorPerformanceTest(unittest.TestCase):
+    NUM_REPETITIONS = 2000
+
+    def test_extractor_performance(self):
+        lst_docs = []
+        for file_path in Path("index/docs_test").rglob("*.html"):
+            with open(file_path, "r") as html_file:
+                lst_docs.append(html_file.read())
+
+        for str_extractor in ["beautifulsoup", "fast"]:
+            cleaner = Cleaner(stop_words_file="stopwords.txt", language="portuguese",
+                              perform_stop_words_removal=True, perform_accents_removal=True,
+                              perform_stemming=True, html_extractor=str_extractor)
+            time = datetime.now()
+            for _ in range(HTMLExtractorPerformanceTest.NUM_REPETITIONS):
+                for text_html in lst_docs:
+                    cleaner.html_to_plain_text(text_html)
+            delta = (datetime.now() - time).total_seconds()
+            total = HTMLExtractorPerformanceTest.NUM_REPETITIONS * len(lst_docs)
+            print(f"Extrator {str_extractor}: {total / max(delta, 1e-9):,.0f} documentos/s", flush=True)
+
+
+class CleanerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cleaner = Cleaner(stop_words_file="stopwords.txt",
+                               language="portuguese",
+                               perform_stop_words_removal=True,
+                               perform_accents_removal=True,
+                               perform_stemming=True,
+                               cache_size=2)
+
+    def test_cache(self):
+        self.assertEqual(self.cleaner.preprocess_word("Verdade"), "verdad")
+        self.assertEqual(self.cleaner.preprocess_word("Verdade"), "verdad")
+        self.assertIsNone(self.cleaner.preprocess_word("é"))
+        self.assertIsNone(self.cleaner.preprocess_word("é"))
+        self.assertEqual((self.cleaner.cache_hits, self.cleaner.cache_misses), (2, 2))
+
+        # cache limitado a 2 termos: o menos usado recentemente é descartado
+        self.cleaner.preprocess_word("estudante")
+        self.assertNotIn("Verdade", self.cleaner.dic_cache)
+        self.assertIn("é", self.cleaner.dic_cache)
+
+    def test_save_load_cache(self):
+        self.cleaner.preprocess_word("amado")
+        self.cleaner.save_cache("cleaner_cache_test.json")
+        self.cleaner.clear_cache()
+        self.cleaner.load_cache("cleaner_cache_test.json")
+        os.remove("cleaner_cache_test.json")
+
+        self.assertEqual(self.cleaner.preprocess_word("amado"), "amad")
+        self.assertEqual(self.cleaner.cache_hits, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,342 @@
+from typing import List, Tuple
+from array import array
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+import struct
+import mmap
+import sys
+
+from .codec import vbyte_encode
+
+# Arquivo de lexico: cabeçalho, posição de inicio de cada bloco de termos,
+# um registro de tamanho fixo por termo (na ordem dos termos) e os termos
+# ordenados com front coding: em cada bloco de LEXICON_BLOCK_SIZE termos o
+# primeiro é gravado inteiro e os demais apenas como (tamanho do prefixo em
+# comum com o anterior, sufixo). Assim a busca é binaria entre os primeiros
+# termos dos blocos e sequencial dentro de um unico bloco.
+LEXICON_MAGIC = b"OCLX"
+LEXICON_VERSION = 1
+LEXICON_HEADER = struct.Struct(">4sHHII")
+LEXICON_BLOCK_OFFSET = struct.Struct(">I")
+# term_id, term_file_start_pos, doc_count_with_term, term_file_length, max_term_freq,
+# min_document_length, skip_file_start_pos, positions_file_start_pos, positions_file_length
+LEXICON_RECORD = struct.Struct(">IqIIIIqqI")
+LEXICON_BLOCK_SIZE = 16
+
+# tabela de documentos: cabeçalho e (doc_id, tamanho) ordenados por doc_id
+DOCUMENT_TABLE_MAGIC = b"OCDT"
+DOCUMENT_TABLE_HEADER = struct.Struct(">4sHI")
+DOCUMENT_RECORD = struct.Struct(">II")
+
+
+def read_vbyte(buffer, pos: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def write_lexicon(str_file_name: str, lst_entries: List[Tuple[str, tuple]], block_size: int = LEXICON_BLOCK_SIZE):
+    # lst_entries: (termo, campos do registro) ordenados pelo termo; campos None
+    # são gravados como -1 (posições) ou 0 (contadores)
+    lst_block_offsets = []
+    records = bytearray()
+    strings = bytearray()
+    last_term = b""
+    for i, (term, fields) in enumerate(lst_entries):
+        term = term.encode("utf-8")
+        if i % block_size == 0:
+            lst_block_offsets.append(len(strings))
+            vbyte_encode((len(term),), strings)
+            strings += term
+        else:
+            prefix = 0
+            while prefix < min(len(term), len(last_term)) and term[prefix] == last_term[prefix]:
+                prefix += 1
+            vbyte_encode((prefix, len(term) - prefix), strings)
+            strings += term[prefix:]
+        last_term = term
+
+        records += LEXICON_RECORD.pack(*[
+            (-1 if LEXICON_RECORD.format[j + 1] == "q" else 0) if value is None else value
+            for j, value in enumerate(fields)])
+
+    with open(str_file_name, "wb") as lexicon_file:
+        lexicon_file.write(LEXICON_HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION, block_size,
+                                               len(lst_entries), len(lst_block_offsets)))
+        lexicon_file.write(b"".join([LEXICON_BLOCK_OFFSET.pack(offset) for offset in lst_block_offsets]))
+        lexicon_file.write(records)
+        lexicon_file.write(strings)
+
+
+# Busca por intervalos nos lexicos ordenados: as subclasses informam a
+# primeira posição com termo >= term (lower_bound) e percorrem os termos de
+# um intervalo de posições (iter_terms)
+class SortedTerms:
+    # maior caractere possivel: termo + MAX_CHAR é maior que qualquer termo
+    # que comece com o prefixo
+    MAX_CHAR = "\U0010ffff"
+    WILDCARD_CHARS = "*?["
+
+    def lower_bound(self, term: str) -> int:
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    def iter_terms(self, start: int, end: int):
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        return self.lower_bound(prefix), self.lower_bound(prefix + SortedTerms.MAX_CHAR)
+
+    def prefix_terms(self, prefix: str) -> List[str]:
+        return list(self.iter_terms(*self.prefix_range(prefix)))
+
+    def wildcard_terms(self, pattern: str) -> List[str]:
+        # padrão no formato do fnmatch (*, ? e [...]): apenas os termos com o
+        # prefixo fixo do padrão (antes do primeiro coringa) são verificados
+        prefix_len = len(pattern)
+        for char in SortedTerms.WILDCARD_CHARS:
+            if char in pattern:
+                prefix_len = min(prefix_len, pattern.index(char))
+        return [term for term in self.iter_terms(*self.prefix_range(pattern[:prefix_len]))
+                if fnmatchcase(term, pattern)]
+
+
+# Lexico em memória construido no finish_indexing: termos ordenados em uma
+# lista (os mesmos objetos str das chaves do dic_index) e, opcionalmente, os
+# term_ids na mesma ordem em um array (4 bytes por termo)
+class SortedLexicon(SortedTerms):
+    def __init__(self, terms, term_ids: dict = None):
+        self.lst_terms = sorted(terms)
+        self.term_ids = array("I", [term_ids[term] for term in self.lst_terms]) if term_ids is not None else None
+
+    def lower_bound(self, term: str) -> int:
+        return bisect_left(self.lst_terms, term)
+
+    def iter_terms(self, start: int, end: int):
+        return iter(self.lst_terms[start:end])
+
+    def find(self, term: str) -> int:
+        i = bisect_left(self.lst_terms, term)
+        return i if i < len(self.lst_terms) and self.lst_terms[i] == term else -1
+
+    def term_id(self, term: str) -> int:
+        i = self.find(term)
+        if i < 0 or self.term_ids is None:
+            return None
+        return self.term_ids[i]
+
+    def __contains__(self, term: str) -> bool:
+        return self.find(term) >= 0
+
+    def __len__(self):
+        return len(self.lst_terms)
+
+    def __iter__(self):
+        return iter(self.lst_terms)
+
+
+# Lexico somente leitura sobre o arquivo mapeado em memória: nada é
+# decodificado na abertura, cada consulta decodifica apenas os blocos que
+# precisa. Funciona como um dicionário termo -> entrada (criada por
+# create_entry a partir dos campos do registro)
+class Lexicon(SortedTerms):
+    def __init__(self, str_file_name: str, create_entry=None):
+        self.str_file_name = str_file_name
+        self.create_entry = create_entry
+        self.open_file()
+
+    def open_file(self):
+        self.lexicon_file = open(self.str_file_name, "rb")
+        self.mm_lexicon = mmap.mmap(self.lexicon_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.block_size, self.term_count, self.block_count = \
+            LEXICON_HEADER.unpack_from(self.mm_lexicon)
+        if magic != LEXICON_MAGIC or version != LEXICON_VERSION:
+            raise Exception(f"Bad structure format (magic: {magic}, version: {version})")
+
+        self.block_offsets_pos = LEXICON_HEADER.size
+        self.records_pos = self.block_offsets_pos + LEXICON_BLOCK_OFFSET.size * self.block_count
+        self.strings_pos = self.records_pos + LEXICON_RECORD.size * self.term_count
+        # ultimo termo buscado: o mesmo termo costuma ser buscado varias
+        # vezes seguidas (term in lexico, lexico[term], ...)
+        self.last_term = None
+        self.last_find = -1
+
+    def close(self):
+        if self.mm_lexicon is None:
+            return
+        self.mm_lexicon.close()
+        self.lexicon_file.close()
+        self.mm_lexicon = None
+
+    def __getstate__(self):
+        return {"str_file_name": self.str_file_name, "create_entry": self.create_entry}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open_file()
+
+    def block_terms(self, block: int) -> List[str]:
+        pos = self.strings_pos + LEXICON_BLOCK_OFFSET.unpack_from(
+            self.mm_lexicon, self.block_offsets_pos + LEXICON_BLOCK_OFFSET.size * block)[0]
+        length, pos = read_vbyte(self.mm_lexicon, pos)
+        term = self.mm_lexicon[pos:pos + length]
+        pos += length
+
+        lst_terms = [term]
+        for _ in range(min(self.block_size, self.term_count - block * self.block_size) - 1):
+            prefix, pos = read_vbyte(self.mm_lexicon, pos)
+            length, pos = read_vbyte(self.mm_lexicon, pos)
+            term = term[:prefix] + self.mm_lexicon[pos:pos + length]
+            pos += length
+            lst_terms.append(term)
+        return [term.decode("utf-8") for term in lst_terms]
+
+    def first_term(self, block: int) -> str:
+        pos = self.strings_pos + LEXICON_BLOCK_OFFSET.unpack_from(
+            self.mm_lexicon, self.block_offsets_pos + LEXICON_BLOCK_OFFSET.size * block)[0]
+        length, pos = read_vbyte(self.mm_lexicon, pos)
+        return self.mm_lexicon[pos:pos + length].decode("utf-8")
+
+    def find(self, term: str) -> int:
+        # posição do termo no lexico ou -1
+        if term == self.last_term:
+            return self.last_find
+        self.last_term = term
+        self.last_find = self.find_uncached(term)
+        return self.last_find
+
+    def find_uncached(self, term: str) -> int:
+        block = self.find_block(term)
+        if block < 0:
+            return -1
+        lst_terms = self.block_terms(block)
+        i = bisect_left(lst_terms, term)
+        return block * self.block_size + i if i < len(lst_terms) and lst_terms[i] == term else -1
+
+    def find_block(self, term: str) -> int:
+        # ultimo bloco cujo primeiro termo é <= term (-1 se term é menor que todos)
+        low, high = 0, self.block_count
+        while low < high:
+            mid = (low + high) // 2
+            if self.first_term(mid) <= term:
+                low = mid + 1
+            else:
+                high = mid
+        return low - 1
+
+    def lower_bound(self, term: str) -> int:
+        block = self.find_block(term)
+        if block < 0:
+            return 0
+        return block * self.block_size + bisect_left(self.block_terms(block), term)
+
+    def iter_terms(self, start: int, end: int):
+        for block in range(start // self.block_size, (end + self.block_size - 1) // self.block_size):
+            block_start = block * self.block_size
+            yield from self.block_terms(block)[max(start - block_start, 0):end - block_start]
+
+    def entry(self, i: int):
+        fields = LEXICON_RECORD.unpack_from(self.mm_lexicon, self.records_pos + LEXICON_RECORD.size * i)
+        fields = [None if value == -1 else value for value in fields]
+        return self.create_entry(*fields) if self.create_entry else tuple(fields)
+
+    def __getitem__(self, term: str):
+        i = self.find(term)
+        if i < 0:
+            raise KeyError(term)
+        return self.entry(i)
+
+    def get(self, term: str, default=None):
+        i = self.find(term)
+        return self.entry(i) if i >= 0 else default
+
+    def __contains__(self, term: str) -> bool:
+        return self.find(term) >= 0
+
+    def __len__(self):
+        return self.term_count
+
+    def __iter__(self):
+        for block in range(self.block_count):
+            yield from self.block_terms(block)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for i in range(self.term_count):
+            yield self.entry(i)
+
+    def items(self):
+        return zip(self, self.values())
+
+
+def write_document_table(str_file_name: str, dic_document_length: dict):
+    with open(str_file_name, "wb") as table_file:
+        table_file.write(DOCUMENT_TABLE_HEADER.pack(DOCUMENT_TABLE_MAGIC, LEXICON_VERSION, len(dic_document_length)))
+        table_file.write(b"".join([DOCUMENT_RECORD.pack(doc_id, length)
+                                   for doc_id, length in sorted(dic_document_length.items())]))
+
+
+# Documentos do indice salvo e seus tamanhos: só o cabeçalho é lido na
+# abertura; os arrays são carregados no primeiro acesso. Funciona como o
+# conjunto de documentos e como o dicionário doc_id -> tamanho
+class DocumentTable:
+    def __init__(self, str_file_name: str):
+        self.str_file_name = str_file_name
+        self.doc_ids = None
+        self.lengths = None
+        with open(str_file_name, "rb") as table_file:
+            magic, version, self.count = DOCUMENT_TABLE_HEADER.unpack(table_file.read(DOCUMENT_TABLE_HEADER.size))
+        if magic != DOCUMENT_TABLE_MAGIC or version != LEXICON_VERSION:
+            raise Exception(f"Bad structure format (magic: {magic}, version: {version})")
+
+    def load(self):
+        with open(self.str_file_name, "rb") as table_file:
+            table_file.seek(DOCUMENT_TABLE_HEADER.size)
+            values = array("I")
+            values.frombytes(table_file.read(DOCUMENT_RECORD.size * self.count))
+        if sys.byteorder == "little":
+            values.byteswap()
+        self.doc_ids = values[0::2]
+        self.lengths = values[1::2]
+
+    def find(self, doc_id: int) -> int:
+        if self.doc_ids is None:
+            self.load()
+        i = bisect_left(self.doc_ids, doc_id)
+        return i if i < len(self.doc_ids) and self.doc_ids[i] == doc_id else -1
+
+    def __contains__(self, doc_id: int) -> bool:
+        return self.find(doc_id) >= 0
+
+    def __getitem__(self, doc_id: int) -> int:
+        i = self.find(doc_id)
+        if i < 0:
+            raise KeyError(doc_id)
+        return self.lengths[i]
+
+    def get(self, doc_id: int, default=None):
+        i = self.find(doc_id)
+        return self.lengths[i] if i >= 0 else default
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if self.doc_ids is None:
+            self.load()
+        return iter(self.doc_ids)
+
+    def values(self):
+        if self.lengths is None:
+            self.load()
+        return iter(self.lengths)
+
+    def __getstate__(self):
+        return {"str_file_name": self.str_file_name, "count": self.count, "doc_ids": None, "lengths": None}
@@ -1,5 +1,5 @@
-from IPython.display import clear_output
 from index.structure import *
+from index.codec import *
 from datetime import datetime
 import math
 import tracemalloc
@@ -32,7 +32,6 @@ class PerformanceTest(unittest.TestCase):
         porc_complete = math.floor(count/total*100)
         current, peak = tracemalloc.get_traced_memory()
 
-        clear_output(wait=True)
         print((f"Memoria usada: {current / 10**6:,} MB; Máximo {peak / 10**6:,} MB"),flush=True)
         print((f"Indexando ocorrencia #{count:,}/{total:,} ({porc_complete}%)"),flush=True)
         print((f"Tempo gasto: {delta.total_seconds()}s"),flush=True)
@@ -53,6 +52,43 @@ class PerformanceTest(unittest.TestCase):
                 count+=1
         return count
 
+    def create_documents(self):
+        # os mesmos termos sorteados em index_words, agrupados por documento
+        seed(10)
+        count = 0
+        lst_documents = []
+        for doc_i in range(PerformanceTest.NUM_DOCS):
+            dic_terms = {}
+            for term_j in range(PerformanceTest.NUM_TERM_PER_DOC):
+                str_term = self.vocabulary[randrange(0,len(self.vocabulary))]
+                dic_terms[str_term] = dic_terms.get(str_term, 0) + (count%10)+1
+                count += 1
+            lst_documents.append((doc_i, dic_terms))
+        return lst_documents
+
+    def test_batch_performance(self):
+        # compara a indexação termo a termo (index) com a por documento (index_document)
+        self.vocabulary = self.create_vocabulary()
+        lst_documents = self.create_documents()
+        total = sum(len(dic_terms) for _, dic_terms in lst_documents)
+
+        index = type(self.index)()
+        time = datetime.now()
+        for doc_id, dic_terms in lst_documents:
+            for str_term, freq in dic_terms.items():
+                index.index(str_term, doc_id, freq)
+        delta_term = (datetime.now() - time).total_seconds()
+        index.finish_indexing()
+
+        index = type(self.index)()
+        time = datetime.now()
+        index.index_batch(lst_documents)
+        delta_batch = (datetime.now() - time).total_seconds()
+        index.finish_indexing()
+
+        print((f"{type(self.index).__name__}: index {total / max(delta_term, 1e-9):,.0f} ocorrencias/s; "
+               f"index_document {total / max(delta_batch, 1e-9):,.0f} ocorrencias/s"), flush=True)
+
     def test_performance(self):
 
 
@@ -65,16 +101,44 @@ class PerformanceTest(unittest.TestCase):
         self.print_status(total,total)
         tracemalloc.stop()
 
-import time
 class FilePerformanceTest(PerformanceTest):
     def setUp(self):
         self.index = FileIndex()
 
-def test():
-    for i in range(10):
-        clear_output(wait=True)
-        print(f"oi {i}")
-        time.sleep(1)
+class CompactPerformanceTest(PerformanceTest):
+    def setUp(self):
+        self.index = CompactHashIndex()
+
+class CodecPerformanceTest(unittest.TestCase):
+    NUM_DOCS = 20000
+    NUM_TERMS = 200
+
+    def create_postings(self):
+        # para cada termo, um subconjunto ordenado dos documentos com frequencias pequenas
+        seed(10)
+        dic_postings = {}
+        for term_id in range(1, CodecPerformanceTest.NUM_TERMS + 1):
+            prob = 1 / randrange(2, 50)
+            dic_postings[term_id] = [(doc_id, randrange(1, 20))
+                                     for doc_id in range(CodecPerformanceTest.NUM_DOCS)
+                                     if randrange(0, 1000) < prob * 1000]
+        return dic_postings
+
+    def test_codec_performance(self):
+        dic_postings = self.create_postings()
+        total_postings = sum(len(lst) for lst in dic_postings.values())
+
+        for codec in CODECS.values():
+            dic_blocks = {term_id: codec.encode(term_id, lst) for term_id, lst in dic_postings.items()}
+            size = sum(len(block) for block in dic_blocks.values())
+
+            time = datetime.now()
+            for term_id, block in dic_blocks.items():
+                codec.decode(term_id, block)
+            delta = (datetime.now() - time).total_seconds()
+
+            print((f"Codec {codec.name}: {size / 10**6:,} MB ({size / total_postings:.2f} bytes/ocorrencia); "
+                   f"decodificação: {total_postings / max(delta, 1e-9):,.0f} ocorrencias/s"), flush=True)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,400 @@
+from typing import List, Tuple
+from bisect import bisect_left
+import heapq
+import math
+import re
+
+from .structure import Index, ListPostingCursor
+from .lexicon import SortedTerms
+from .cache import create_cache
+
+
+class RankingModel:
+    def term_weight(self, index: Index, document_count_with_term: int) -> float:
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    def score(self, term_weight: float, term_freq: int, document_length: int, average_document_length: float) -> float:
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+
+class TFIDF(RankingModel):
+    def term_weight(self, index: Index, document_count_with_term: int) -> float:
+        return math.log(index.document_count / document_count_with_term)
+
+    def score(self, term_weight: float, term_freq: int, document_length: int, average_document_length: float) -> float:
+        return (1 + math.log(term_freq)) * term_weight
+
+
+class BM25(RankingModel):
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def term_weight(self, index: Index, document_count_with_term: int) -> float:
+        return math.log(1 + (index.document_count - document_count_with_term + 0.5) / (document_count_with_term + 0.5))
+
+    def score(self, term_weight: float, term_freq: int, document_length: int, average_document_length: float) -> float:
+        norm = 1 - self.b + (self.b * document_length / average_document_length if average_document_length else 0)
+        return term_weight * term_freq * (self.k1 + 1) / (term_freq + self.k1 * norm)
+
+
+# Processa consultas sobre qualquer subclasse de Index (HashIndex, FileIndex,
+# FileIndexReader...) usando apenas get_occurrence_list, get_posting_cursor e
+# document_count_with_term.
+# Caso um HTMLIndexer seja informado, a consulta passa pela mesma tokenização e
+# pelo mesmo Cleaner da indexação; senão, é apenas separada por espaços.
+# Com result_cache_size, os resultados das ultimas consultas (de qualquer
+# tipo) são mantidos em um cache LRU, descartado quando o indice é alterado.
+class QueryProcessor:
+    BOOLEAN_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+    def __init__(self, index: Index, html_indexer: "HTMLIndexer" = None, model: RankingModel = None,
+                 result_cache_size: int = 0, cache_policy: str = "lru"):
+        self.index = index
+        self.html_indexer = html_indexer
+        self.model = model if model else BM25()
+        # quantidade de ocorrencias pontuadas na ultima consulta
+        self.scored_postings = 0
+        self.result_cache = create_cache(result_cache_size, cache_policy) if result_cache_size else None
+        self.result_cache_generation = index.generation
+
+    def cached_result(self, key: tuple, compute) -> List:
+        if self.result_cache is None:
+            return compute()
+
+        if self.result_cache_generation != self.index.generation:
+            self.result_cache.clear()
+            self.result_cache_generation = self.index.generation
+        result = self.result_cache.get(key)
+        if result is None:
+            result = tuple(compute())
+            self.result_cache.put(key, result)
+        else:
+            self.scored_postings = 0
+        return list(result)
+
+    def query_terms(self, query: str) -> dict:
+        if self.html_indexer:
+            return self.html_indexer.text_word_count(query)
+
+        dic_terms = {}
+        for term in query.split():
+            dic_terms[term] = dic_terms.get(term, 0) + 1
+        return dic_terms
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        return self.cached_result(("search", query, k), lambda: self.search_uncached(query, k))
+
+    def search_uncached(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        # avaliação termo a termo: acumula o score de cada documento e
+        # seleciona os k maiores com um heap
+        dic_scores = {}
+        average_document_length = self.index.average_document_length
+        self.scored_postings = 0
+        for term, query_freq in self.query_terms(query).items():
+            document_count_with_term = self.index.document_count_with_term(term)
+            if not document_count_with_term:
+                continue
+
+            # todas as ocorrencias do termo são pontuadas
+            self.scored_postings += document_count_with_term
+            term_weight = query_freq * self.model.term_weight(self.index, document_count_with_term)
+            for occurrence in self.index.get_occurrence_list(term):
+                doc_id = occurrence.doc_id
+                dic_scores[doc_id] = dic_scores.get(doc_id, 0) + self.model.score(
+                    term_weight, occurrence.term_freq, self.index.document_length(doc_id), average_document_length)
+
+        return [(self.index.external_doc_id(doc_id), score) for doc_id, score in
+                heapq.nlargest(k, dic_scores.items(), key=lambda doc_score: (doc_score[1], -doc_score[0]))]
+
+    def create_cursors(self, query: str, average_document_length: float) -> List[Tuple[ListPostingCursor, float, float]]:
+        lst_cursors = []
+        for term, query_freq in self.query_terms(query).items():
+            document_count_with_term = self.index.document_count_with_term(term)
+            if not document_count_with_term:
+                continue
+
+            term_weight = query_freq * self.model.term_weight(self.index, document_count_with_term)
+            # limite superior da contribuição do termo: o score cresce com a
+            # frequencia e diminui com o tamanho do documento
+            max_term_freq, min_document_length = self.index.term_score_bounds(term)
+            upper_bound = self.model.score(term_weight, max_term_freq, min_document_length, average_document_length)
+
+            lst_cursors.append((self.index.get_posting_cursor(term), term_weight, upper_bound))
+        return lst_cursors
+
+    def search_wand(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        return self.cached_result(("wand", query, k), lambda: self.search_wand_uncached(query, k))
+
+    def search_wand_uncached(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        # avaliação documento a documento com WAND: um documento só é pontuado
+        # se a soma dos limites superiores dos termos que podem ocorrer nele
+        # supera o menor score do top-k atual; os demais são pulados
+        average_document_length = self.index.average_document_length
+        lst_cursors = self.create_cursors(query, average_document_length)
+        heap_top_k = []
+        self.scored_postings = 0
+
+        while True:
+            lst_cursors = [cursor for cursor in lst_cursors if cursor[0].doc_id != ListPostingCursor.END]
+            if not lst_cursors:
+                break
+            lst_cursors.sort(key=lambda cursor: cursor[0].doc_id)
+
+            threshold = heap_top_k[0][0] if len(heap_top_k) == k else float("-inf")
+            pivot = None
+            acc_upper_bound = 0
+            for i, (_, _, upper_bound) in enumerate(lst_cursors):
+                acc_upper_bound += upper_bound
+                if acc_upper_bound > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+
+            pivot_doc_id = lst_cursors[pivot][0].doc_id
+            if lst_cursors[0][0].doc_id == pivot_doc_id:
+                score = 0
+                document_length = self.index.document_length(pivot_doc_id)
+                for cursor, term_weight, _ in lst_cursors:
+                    if cursor.doc_id != pivot_doc_id:
+                        break
+                    score += self.model.score(term_weight, cursor.term_freq, document_length, average_document_length)
+                    cursor.next()
+                    self.scored_postings += 1
+
+                if len(heap_top_k) < k:
+                    heapq.heappush(heap_top_k, (score, -pivot_doc_id))
+                elif score > threshold:
+                    heapq.heapreplace(heap_top_k, (score, -pivot_doc_id))
+            else:
+                for cursor, _, _ in lst_cursors[:pivot]:
+                    cursor.advance_to(pivot_doc_id)
+
+        return [(self.index.external_doc_id(-neg_doc_id), score) for score, neg_doc_id in sorted(heap_top_k, reverse=True)]
+
+    # Consultas booleanas: termos combinados com AND, OR, NOT e parenteses.
+    # Termos consecutivos sem operador são combinados com AND e o AND tem
+    # precedencia sobre o OR:
+    #   expr := and_expr (OR and_expr)*
+    #   and_expr := factor ((AND)? factor)*
+    #   factor := NOT factor | ( expr ) | termo
+    # A arvore é formada por tuplas ("TERM", termo), ("NOT", no),
+    # ("AND", [nos]) e ("OR", [nos]); termos descartados na normalização
+    # (ex. stopwords) viram None e são ignorados. Termos com coringas
+    # (ex. "cas*", "verd?") viram o OR dos termos do vocabulario que casam
+    # com o padrão.
+    def parse_boolean(self, query: str):
+        lst_tokens = QueryProcessor.BOOLEAN_TOKEN.findall(query)
+        pos = 0
+
+        def peek():
+            return lst_tokens[pos] if pos < len(lst_tokens) else None
+
+        def expr():
+            nonlocal pos
+            lst_nodes = [and_expr()]
+            while peek() == "OR":
+                pos += 1
+                lst_nodes.append(and_expr())
+            return self.boolean_node("OR", lst_nodes)
+
+        def and_expr():
+            nonlocal pos
+            lst_nodes = [factor()]
+            while peek() not in (None, "OR", ")"):
+                if peek() == "AND":
+                    pos += 1
+                lst_nodes.append(factor())
+            return self.boolean_node("AND", lst_nodes)
+
+        def factor():
+            nonlocal pos
+            token = peek()
+            if token is None or token in ("AND", "OR", ")"):
+                raise Exception(f"Consulta booleana invalida: '{query}'")
+            pos += 1
+            if token == "NOT":
+                node = factor()
+                return ("NOT", node) if node else None
+            if token == "(":
+                node = expr()
+                if peek() != ")":
+                    raise Exception(f"Consulta booleana invalida: '{query}'")
+                pos += 1
+                return node
+            if any(char in token for char in SortedTerms.WILDCARD_CHARS):
+                lst_nodes = [("TERM", term) for term in self.index.wildcard_terms(self.wildcard_pattern(token))]
+                return lst_nodes[0] if len(lst_nodes) == 1 else ("OR", lst_nodes)
+            term = self.boolean_term(token)
+            return ("TERM", term) if term else None
+
+        node = expr()
+        if pos != len(lst_tokens):
+            raise Exception(f"Consulta booleana invalida: '{query}'")
+        return node
+
+    def boolean_node(self, operator: str, lst_nodes: List):
+        lst_nodes = [node for node in lst_nodes if node]
+        if len(lst_nodes) <= 1:
+            return lst_nodes[0] if lst_nodes else None
+        return (operator, lst_nodes)
+
+    def wildcard_pattern(self, token: str) -> str:
+        # o padrão não passa pelo stemming, apenas por minusculas e remoção de acentos
+        if not self.html_indexer:
+            return token
+        return self.html_indexer.cleaner.remove_accents(token.lower())
+
+    def boolean_term(self, token: str) -> str:
+        if not self.html_indexer:
+            return token
+        lst_terms = list(self.html_indexer.text_word_count(token))
+        return lst_terms[0] if lst_terms else None
+
+    def search_boolean(self, query: str) -> List[int]:
+        return self.cached_result(("boolean", query), lambda: self.search_boolean_uncached(query))
+
+    def search_boolean_uncached(self, query: str) -> List[int]:
+        # retorna os doc_ids que satisfazem a consulta, em ordem crescente
+        node = self.parse_boolean(query)
+        self.scored_postings = 0
+        return self.external_doc_ids(self.evaluate_boolean(node)) if node else []
+
+    def external_doc_ids(self, lst_doc_ids: List[int]) -> List[int]:
+        # com ids internos densos (dense_doc_ids) os resultados são convertidos
+        # para os doc_ids informados na indexação
+        if self.index.document_mapping is None:
+            return lst_doc_ids
+        return sorted(self.index.external_doc_id(doc_id) for doc_id in lst_doc_ids)
+
+    def boolean_cursor(self, node) -> ListPostingCursor:
+        if node[0] == "TERM":
+            return self.index.get_posting_cursor(node[1])
+        lst_doc_ids = self.evaluate_boolean(node)
+        return ListPostingCursor(lst_doc_ids, [0] * len(lst_doc_ids))
+
+    def evaluate_boolean(self, node) -> List[int]:
+        operator = node[0]
+        if operator == "TERM":
+            return self.cursor_doc_ids(self.index.get_posting_cursor(node[1]))
+        if operator == "NOT":
+            set_excluded = set(self.evaluate_boolean(node[1]))
+            return sorted(doc_id for doc_id in self.index.set_documents if doc_id not in set_excluded)
+        if operator == "OR":
+            lst_doc_ids = []
+            for doc_id in heapq.merge(*[self.evaluate_boolean(child) for child in node[1]]):
+                if not lst_doc_ids or lst_doc_ids[-1] != doc_id:
+                    lst_doc_ids.append(doc_id)
+            return lst_doc_ids
+        return self.intersect(node[1])
+
+    def cursor_doc_ids(self, cursor: ListPostingCursor) -> List[int]:
+        lst_doc_ids = []
+        while cursor.doc_id != ListPostingCursor.END:
+            lst_doc_ids.append(cursor.doc_id)
+            cursor.next()
+        self.scored_postings += len(lst_doc_ids)
+        return lst_doc_ids
+
+    def intersect(self, lst_nodes: List) -> List[int]:
+        # interseção por saltos: o cursor da lista mais rara propõe o candidato
+        # e os demais avançam até ele (advance_to usa os ponteiros de salto no
+        # FileIndex), sem percorrer as ocorrencias intermediarias. Filhos NOT
+        # apenas removem candidatos.
+        lst_cursors = [self.boolean_cursor(node) for node in lst_nodes if node[0] != "NOT"]
+        lst_excluded = [self.boolean_cursor(node[1]) for node in lst_nodes if node[0] == "NOT"]
+        if not lst_cursors:
+            return self.evaluate_boolean(("NOT", ("OR", [node[1] for node in lst_nodes])))
+        lst_cursors.sort(key=len)
+
+        lst_doc_ids = []
+        candidate = lst_cursors[0].doc_id
+        while candidate != ListPostingCursor.END:
+            for cursor in lst_cursors:
+                cursor.advance_to(candidate)
+                self.scored_postings += 1
+                if cursor.doc_id != candidate:
+                    candidate = cursor.doc_id
+                    break
+            else:
+                excluded = False
+                for cursor in lst_excluded:
+                    cursor.advance_to(candidate)
+                    excluded = excluded or cursor.doc_id == candidate
+                if not excluded:
+                    lst_doc_ids.append(candidate)
+                lst_cursors[0].next()
+                candidate = lst_cursors[0].doc_id
+        return lst_doc_ids
+
+    # Consultas por frase e proximidade (indice posicional): os documentos
+    # candidatos são obtidos pela interseção das ocorrencias, como no AND, e
+    # as posições são lidas apenas para os termos da consulta e apenas
+    # para os candidatos
+    def query_positions(self, query: str) -> List[Tuple[int, str]]:
+        if self.html_indexer:
+            return list(self.html_indexer.normalize_positions(self.html_indexer.tokenize(query)))
+        return list(enumerate(query.split()))
+
+    def candidate_positions(self, lst_terms: List[str]) -> Tuple[List[int], List[dict]]:
+        lst_doc_ids = self.intersect([("TERM", term) for term in lst_terms])
+        return lst_doc_ids, [self.index.get_position_lists(term, lst_doc_ids) for term in lst_terms]
+
+    def search_phrase(self, query: str, slop: int = 0) -> List[int]:
+        return self.cached_result(("phrase", query, slop), lambda: self.search_phrase_uncached(query, slop))
+
+    def search_phrase_uncached(self, query: str, slop: int = 0) -> List[int]:
+        # documentos em que os termos aparecem na ordem e na distancia da
+        # consulta; slop é o deslocamento tolerado de cada termo
+        lst_query_positions = self.query_positions(query)
+        self.scored_postings = 0
+        if not lst_query_positions:
+            return []
+
+        first_position = lst_query_positions[0][0]
+        lst_offsets = [position - first_position for position, _ in lst_query_positions]
+        lst_doc_ids, lst_term_positions = self.candidate_positions([term for _, term in lst_query_positions])
+        return self.external_doc_ids([doc_id for doc_id in lst_doc_ids
+                if self.phrase_match(lst_offsets, [dic_positions[doc_id] for dic_positions in lst_term_positions], slop)])
+
+    def phrase_match(self, lst_offsets: List[int], lst_positions: List[List[int]], slop: int) -> bool:
+        for start in lst_positions[0]:
+            for offset, positions in zip(lst_offsets[1:], lst_positions[1:]):
+                i = bisect_left(positions, start + offset - slop)
+                if i == len(positions) or positions[i] > start + offset + slop:
+                    break
+            else:
+                return True
+        return False
+
+    def search_proximity(self, query: str, window: int) -> List[int]:
+        return self.cached_result(("proximity", query, window), lambda: self.search_proximity_uncached(query, window))
+
+    def search_proximity_uncached(self, query: str, window: int) -> List[int]:
+        # documentos em que todos os termos (em qualquer ordem) aparecem em
+        # um trecho de no maximo window posições
+        lst_terms = list(dict.fromkeys(term for _, term in self.query_positions(query)))
+        self.scored_postings = 0
+        if not lst_terms:
+            return []
+
+        lst_doc_ids, lst_term_positions = self.candidate_positions(lst_terms)
+        return self.external_doc_ids([doc_id for doc_id in lst_doc_ids
+                if self.min_window([dic_positions[doc_id] for dic_positions in lst_term_positions]) <= window])
+
+    def min_window(self, lst_positions: List[List[int]]) -> int:
+        # menor trecho com uma posição de cada termo: avança sempre a lista
+        # com a menor posição atual, mantendo a maior posição atual
+        heap_positions = [(positions[0], i, 0) for i, positions in enumerate(lst_positions)]
+        heapq.heapify(heap_positions)
+        max_position = max(position for position, _, _ in heap_positions)
+        min_window = float("inf")
+        while True:
+            position, i, pos = heap_positions[0]
+            min_window = min(min_window, max_position - position + 1)
+            if pos + 1 == len(lst_positions[i]):
+                return min_window
+            next_position = lst_positions[i][pos + 1]
+            max_position = max(max_position, next_position)
+            heapq.heapreplace(heap_positions, (next_position, i, pos + 1))
@@ -0,0 +1,320 @@
+from .structure import *
+from .query import *
+import unittest
+import math
+import os
+from random import randrange, seed, shuffle
+
+
+class QueryTest(unittest.TestCase):
+    def create_index(self):
+        return HashIndex()
+
+    def setUp(self):
+        # doc 1: "casa verde casa", doc 2: "casa amarela", doc 3: "predio verde verde verde"
+        self.index = self.create_index()
+        for doc_id, dic_terms in [(1, {"casa": 2, "verde": 1}),
+                                  (2, {"casa": 1, "amarela": 1}),
+                                  (3, {"predio": 1, "verde": 3})]:
+            for term, freq in dic_terms.items():
+                self.index.index(term, doc_id, freq)
+        self.index.finish_indexing()
+
+    def test_document_length(self):
+        self.assertEqual(self.index.document_count, 3)
+        self.assertEqual(self.index.document_length(3), 4)
+        self.assertEqual(self.index.average_document_length, 3)
+
+    def test_bm25(self):
+        processor = QueryProcessor(self.index, model=BM25(k1=1.2, b=0.75))
+        lst_result = processor.search("verde", k=10)
+        self.assertListEqual([doc_id for doc_id, _ in lst_result], [3, 1],
+                             "O documento 3 possui mais ocorrencias de 'verde' e deveria vir primeiro")
+
+        idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+        expected = idf * 1 * 2.2 / (1 + 1.2 * (1 - 0.75 + 0.75 * 3 / 3))
+        self.assertAlmostEqual(dict(lst_result)[1], expected)
+
+    def test_top_k(self):
+        processor = QueryProcessor(self.index)
+        lst_result = processor.search("casa verde amarela", k=2)
+        self.assertEqual(len(lst_result), 2)
+        self.assertEqual(lst_result[0][0], 2, "O documento 2 possui o termo mais raro (amarela)")
+        self.assertGreaterEqual(lst_result[0][1], lst_result[1][1])
+        self.assertListEqual(processor.search("xuxu"), [])
+
+    def test_result_cache(self):
+        processor = QueryProcessor(self.index, result_cache_size=10)
+        lst_result = processor.search("casa verde")
+        self.assertListEqual(processor.search("casa verde"), lst_result)
+        self.assertListEqual(processor.search_boolean("casa AND NOT verde"), [2])
+        self.assertListEqual(processor.search_boolean("casa AND NOT verde"), [2])
+        self.assertEqual((processor.result_cache.hits, processor.result_cache.misses), (2, 2))
+
+        # o cache é descartado quando o indice muda
+        self.index.invalidate_caches()
+        self.assertListEqual(processor.search("casa verde"), lst_result)
+        self.assertEqual(processor.result_cache.misses, 3)
+        self.assertEqual(processor.result_cache.invalidations, 1)
+
+    def test_result_cache_update(self):
+        index = HashIndex()
+        index.index_document(1, {"casa": 1})
+        processor = QueryProcessor(index, result_cache_size=10)
+        self.assertListEqual(processor.search_boolean("casa"), [1])
+        index.index_document(2, {"casa": 1})
+        self.assertListEqual(processor.search_boolean("casa"), [1, 2], "Documentos novos deveriam invalidar o cache")
+
+    def test_tfidf(self):
+        processor = QueryProcessor(self.index, model=TFIDF())
+        lst_result = processor.search("amarela")
+        self.assertEqual(len(lst_result), 1)
+        self.assertAlmostEqual(lst_result[0][1], math.log(3))
+
+
+    def test_wand(self):
+        # indice maior com termos de frequencias bem diferentes
+        seed(10)
+        self.index = self.create_index()
+        for doc_id in range(1, 301):
+            dic_terms = {f"t{randrange(0, 30)}": randrange(1, 5) for _ in range(randrange(1, 15))}
+            dic_terms["comum"] = randrange(1, 3)
+            for term, freq in dic_terms.items():
+                self.index.index(term, doc_id, freq)
+        self.index.finish_indexing()
+
+        processor = QueryProcessor(self.index)
+        for query in ["t1 comum", "t2 t5 t7 comum", "t3", "xuxu t4"]:
+            lst_expected = processor.search(query, k=10)
+            total_postings = processor.scored_postings
+            lst_result = processor.search_wand(query, k=10)
+            self.assertListEqual([round(score, 9) for _, score in lst_result],
+                                 [round(score, 9) for _, score in lst_expected],
+                                 f"O WAND deveria retornar os mesmos scores da avaliação completa para '{query}'")
+            self.assertLessEqual(processor.scored_postings, total_postings)
+
+        processor.search_wand("t1 comum", k=10)
+        self.assertLess(processor.scored_postings, self.index.document_count_with_term("comum"),
+                        "O WAND deveria pular ocorrencias do termo comum")
+
+    def test_boolean(self):
+        processor = QueryProcessor(self.index)
+        self.assertListEqual(processor.search_boolean("casa AND verde"), [1])
+        self.assertListEqual(processor.search_boolean("casa verde"), [1], "Termos sem operador devem ser combinados com AND")
+        self.assertListEqual(processor.search_boolean("amarela OR predio"), [2, 3])
+        self.assertListEqual(processor.search_boolean("casa AND NOT verde"), [2])
+        self.assertListEqual(processor.search_boolean("NOT casa"), [3])
+        self.assertListEqual(processor.search_boolean("verde AND (amarela OR predio)"), [3])
+        self.assertListEqual(processor.search_boolean("casa OR verde AND predio"), [1, 2, 3],
+                             "O AND deveria ter precedencia sobre o OR")
+        self.assertListEqual(processor.search_boolean("casa AND xuxu"), [])
+        self.assertListEqual(processor.search_boolean("ama* OR pred*"), [2, 3])
+        self.assertListEqual(processor.search_boolean("verd? AND NOT c*"), [3])
+        self.assertListEqual(processor.search_boolean("casa AND xu*"), [])
+        self.assertRaises(Exception, processor.search_boolean, "casa AND (verde")
+        self.assertRaises(Exception, processor.search_boolean, "OR casa")
+
+    def test_boolean_skips(self):
+        seed(20)
+        self.index = self.create_index()
+        dic_docs = {}
+        for doc_id in range(1, 2001):
+            dic_docs[doc_id] = {"comum"} | {f"t{randrange(0, 50)}" for _ in range(3)}
+            if doc_id % 500 == 0:
+                dic_docs[doc_id].add("raro")
+            for term in dic_docs[doc_id]:
+                self.index.index(term, doc_id, 1)
+        self.index.finish_indexing()
+
+        processor = QueryProcessor(self.index)
+        for query, fn_filter in [("raro AND comum", lambda terms: "raro" in terms),
+                                 ("t1 AND NOT t2", lambda terms: "t1" in terms and "t2" not in terms),
+                                 ("(t1 OR t2) AND t3", lambda terms: ("t1" in terms or "t2" in terms) and "t3" in terms)]:
+            self.assertListEqual(processor.search_boolean(query),
+                                 [doc_id for doc_id, terms in dic_docs.items() if fn_filter(terms)],
+                                 f"Resultado incorreto para '{query}'")
+
+        processor.search_boolean("raro AND comum")
+        self.assertLess(processor.scored_postings, 100,
+                        "A interseção deveria pular as ocorrencias do termo comum")
+
+    def test_out_of_order(self):
+        # documentos indexados fora da ordem dos doc_ids
+        self.index = self.create_index()
+        for doc_id, dic_terms in [(100102, {"casa": 1, "verde": 2}),
+                                  (111, {"casa": 2}),
+                                  (5, {"casa": 1, "verde": 1})]:
+            for term, freq in dic_terms.items():
+                self.index.index(term, doc_id, freq)
+        self.index.finish_indexing()
+
+        processor = QueryProcessor(self.index)
+        self.assertListEqual(processor.search_boolean("cas* AND verd*"), [5, 100102])
+        self.assertListEqual(processor.search_boolean("casa AND NOT verde"), [111])
+        self.assertListEqual(processor.search_boolean("verde OR casa"), [5, 111, 100102])
+
+        seed(30)
+        self.index = self.create_index()
+        dic_docs = {}
+        lst_doc_ids = list(range(1, 1001))
+        shuffle(lst_doc_ids)
+        for doc_id in lst_doc_ids:
+            dic_docs[doc_id] = {f"t{randrange(0, 20)}": randrange(1, 5) for _ in range(randrange(1, 8))}
+            for term, freq in dic_docs[doc_id].items():
+                self.index.index(term, doc_id, freq)
+        self.index.finish_indexing()
+
+        processor = QueryProcessor(self.index)
+        self.assertListEqual(processor.search_boolean("t1 AND NOT t2"),
+                             sorted(doc_id for doc_id, dic_terms in dic_docs.items()
+                                    if "t1" in dic_terms and "t2" not in dic_terms))
+        for query in ["t1 t2", "t3 t4 t5"]:
+            self.assertListEqual([round(score, 9) for _, score in processor.search_wand(query, k=10)],
+                                 [round(score, 9) for _, score in processor.search(query, k=10)],
+                                 f"O WAND deveria retornar os mesmos scores da avaliação completa para '{query}'")
+
+    def test_dense_doc_ids(self):
+        # mesmos resultados, com os doc_ids externos, usando ids internos densos
+        seed(40)
+        self.index = self.create_index()
+        dense_index = self.create_dense_index()
+        dic_docs = {}
+        for doc_id in range(1, 200):
+            external_id = 100000 + doc_id * 13 % 199
+            dic_terms = {f"t{randrange(0, 15)}": randrange(1, 4) for _ in range(randrange(1, 6))}
+            dic_docs[external_id] = dic_terms
+            for term, freq in dic_terms.items():
+                self.index.index(term, external_id, freq)
+                dense_index.index(term, external_id, freq)
+        self.index.finish_indexing()
+        dense_index.finish_indexing()
+
+        processor = QueryProcessor(self.index)
+        dense_processor = QueryProcessor(dense_index)
+        for query in ["t1 t2", "t3 t4 t5"]:
+            self.assertListEqual([round(score, 9) for _, score in dense_processor.search(query)],
+                                 [round(score, 9) for _, score in processor.search(query)])
+            self.assertSetEqual({doc_id for doc_id, _ in dense_processor.search_wand(query, k=200)},
+                                {doc_id for doc_id, _ in processor.search_wand(query, k=200)})
+        # os ids internos seguem a ordem de indexação, então as listas ficam
+        # ordenadas mesmo com os doc_ids externos fora de ordem
+        self.assertListEqual(dense_processor.search_boolean("t1 AND NOT t2"),
+                             sorted(doc_id for doc_id, dic_terms in dic_docs.items()
+                                    if "t1" in dic_terms and "t2" not in dic_terms))
+
+    def create_dense_index(self):
+        return HashIndex(dense_doc_ids=True)
+
+
+class CompactQueryTest(QueryTest):
+    def create_index(self):
+        return CompactHashIndex()
+
+    def create_dense_index(self):
+        return CompactHashIndex(dense_doc_ids=True)
+
+
+class FileQueryTest(QueryTest):
+    def create_dense_index(self):
+        return FileIndex(dense_doc_ids=True, str_idx_file_name="occur_idx_file_dense")
+
+    def tearDown(self):
+        for str_file_name in ["occur_idx_file_dense", "occur_idx_file_dense.skip"]:
+            if os.path.exists(str_file_name):
+                os.remove(str_file_name)
+
+    def create_index(self):
+        return FileIndex(skip_interval=16)
+
+
+class PositionalQueryTest(unittest.TestCase):
+    TEXTS = {1: "a casa verde tem uma porta verde",
+             2: "a verde casa",
+             3: "casa grande e muito verde",
+             4: "predio azul"}
+
+    def create_index(self):
+        return HashIndex(positional=True)
+
+    def setUp(self):
+        self.index = self.create_index()
+        for doc_id, text in PositionalQueryTest.TEXTS.items():
+            dic_positions = {}
+            for position, term in enumerate(text.split()):
+                dic_positions.setdefault(term, []).append(position)
+            for term, positions in dic_positions.items():
+                self.index.index(term, doc_id, len(positions), positions)
+            self.flush()
+        self.index.finish_indexing()
+
+    def flush(self):
+        pass
+
+    def test_positions(self):
+        self.assertDictEqual(self.index.get_position_lists("verde", [1, 3, 4]), {1: [2, 6], 3: [4]})
+        self.assertDictEqual(self.index.get_position_lists("xuxu", [1]), {})
+
+    def test_phrase(self):
+        processor = QueryProcessor(self.index)
+        self.assertListEqual(processor.search_phrase("casa verde"), [1])
+        self.assertListEqual(processor.search_phrase("verde casa"), [2])
+        self.assertListEqual(processor.search_phrase("casa verde", slop=1), [1])
+        self.assertListEqual(processor.search_phrase("casa verde", slop=3), [1, 2, 3],
+                             "O deslocamento tolerado vale para os dois lados")
+        self.assertListEqual(processor.search_phrase("porta verde"), [1])
+        self.assertListEqual(processor.search_phrase("casa azul"), [])
+
+    def test_proximity(self):
+        processor = QueryProcessor(self.index)
+        self.assertListEqual(processor.search_proximity("verde casa", window=2), [1, 2],
+                             "Na proximidade a ordem dos termos não importa")
+        self.assertListEqual(processor.search_proximity("casa verde", window=5), [1, 2, 3])
+        self.assertListEqual(processor.search_proximity("casa porta", window=3), [])
+
+    def test_out_of_order(self):
+        # mesmos textos indexados na ordem inversa dos doc_ids
+        self.index = self.create_index()
+        for doc_id, text in reversed(PositionalQueryTest.TEXTS.items()):
+            dic_positions = {}
+            for position, term in enumerate(text.split()):
+                dic_positions.setdefault(term, []).append(position)
+            for term, positions in dic_positions.items():
+                self.index.index(term, doc_id, len(positions), positions)
+            self.flush()
+        self.index.finish_indexing()
+
+        processor = QueryProcessor(self.index)
+        self.assertListEqual(processor.search_phrase("casa verde"), [1])
+        self.assertListEqual(processor.search_phrase("casa verde", slop=3), [1, 2, 3])
+        self.assertListEqual(processor.search_proximity("verde casa", window=2), [1, 2])
+        self.assertListEqual(processor.search_proximity("casa verde", window=5), [1, 2, 3])
+
+    def test_not_positional(self):
+        self.assertRaises(Exception, self.index.index, "casa", 5, 1)
+        index = HashIndex()
+        index.index("casa", 1, 1, [0])
+        index.finish_indexing()
+        self.assertRaises(Exception, index.get_position_lists, "casa", [1])
+
+
+class CompactPositionalQueryTest(PositionalQueryTest):
+    def create_index(self):
+        return CompactHashIndex(positional=True)
+
+
+class FilePositionalQueryTest(PositionalQueryTest):
+    def create_index(self):
+        # varias runs e merges intermediarios para testar a ordem das posições
+        return FileIndex(merge_fan_in=2, positional=True)
+
+    def flush(self):
+        self.index.save_tmp_occurrences()
+
+    def test_reader(self):
+        with self.index.open_reader() as reader:
+            self.assertDictEqual(reader.get_position_lists("verde", [1, 2]), {1: [2, 6], 2: [1]})
+            self.assertListEqual(QueryProcessor(reader).search_phrase("casa verde"), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
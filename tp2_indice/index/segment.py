@@ -0,0 +1,280 @@
+from typing import List, Tuple
+from operator import attrgetter
+from os import path
+import heapq
+import tempfile
+
+from .structure import Index, CompactHashIndex, FileIndex
+from .lexicon import SortedLexicon
+
+
+# Documentos removidos de um segmento: bitmap indexado pelo doc_id
+class Tombstones:
+    def __init__(self):
+        self.bitmap = bytearray()
+        self.count = 0
+
+    def add(self, doc_id: int):
+        byte, bit = divmod(doc_id, 8)
+        if byte >= len(self.bitmap):
+            self.bitmap.extend(bytes(byte - len(self.bitmap) + 1))
+        if not self.bitmap[byte] >> bit & 1:
+            self.bitmap[byte] |= 1 << bit
+            self.count += 1
+
+    def __contains__(self, doc_id: int) -> bool:
+        byte, bit = divmod(doc_id, 8)
+        return byte < len(self.bitmap) and bool(self.bitmap[byte] >> bit & 1)
+
+    def __len__(self):
+        return self.count
+
+
+# Segmento do SegmentedIndex: o segmento em memória (CompactHashIndex) ou um
+# FileIndex imutavel, consultado pelo seu leitor (mmap). Documentos removidos
+# apenas são marcados nas tombstones até o segmento participar de um merge
+class Segment:
+    def __init__(self, index: Index, occurrence_count: int = 0):
+        self.index = index
+        self.reader = index.open_reader() if isinstance(index, FileIndex) else index
+        self.tombstones = Tombstones()
+        self.occurrence_count = occurrence_count
+
+    def is_live(self, doc_id: int) -> bool:
+        return doc_id in self.index.set_documents and doc_id not in self.tombstones
+
+    @property
+    def live_document_count(self) -> int:
+        return len(self.index.set_documents) - len(self.tombstones)
+
+    def get_occurrence_list(self, term: str) -> List:
+        lst_occurrences = self.reader.get_occurrence_list(term)
+        if self.reader is self.index:
+            # no segmento em memória os documentos ficam na ordem de inserção
+            lst_occurrences = sorted(lst_occurrences, key=attrgetter("doc_id"))
+        if not self.tombstones:
+            return lst_occurrences
+        return [occurrence for occurrence in lst_occurrences if occurrence.doc_id not in self.tombstones]
+
+    def document_count_with_term(self, term: str) -> int:
+        if not self.tombstones:
+            return self.reader.document_count_with_term(term)
+        return len(self.get_occurrence_list(term))
+
+    def get_position_lists(self, term: str, lst_doc_ids: List[int]) -> dict:
+        return self.reader.get_position_lists(term, [doc_id for doc_id in lst_doc_ids if self.is_live(doc_id)])
+
+    def close(self):
+        if self.reader is not self.index:
+            self.reader.close()
+
+    def remove(self):
+        self.close()
+        if isinstance(self.index, FileIndex):
+            self.index.remove_files()
+
+
+# Indice incremental: os documentos novos vão para um segmento em memória
+# que, ao atingir segment_limit ocorrencias, é gravado como um FileIndex
+# imutavel. Remoções marcam o documento nas tombstones do segmento que o
+# contém e as consultas percorrem todos os segmentos (as listas de
+# ocorrencias são intercaladas por doc_id). Para limitar a quantidade de
+# segmentos, eles são agrupados em niveis por tamanho (segment_limit,
+# segment_limit * merge_factor, ...) e, quando um nivel acumula merge_factor
+# segmentos, eles são unidos em um só, descartando os documentos removidos.
+class SegmentedIndex(Index):
+    SEGMENT_LIMIT = 100000
+    MERGE_FACTOR = 4
+
+    def __init__(self, str_dir: str = None, segment_limit: int = None, merge_factor: int = None,
+                 codec: str = None, positional: bool = False):
+        super().__init__(positional)
+        self.str_dir = str_dir if str_dir else tempfile.mkdtemp(prefix="segments_")
+        self.segment_limit = segment_limit if segment_limit else SegmentedIndex.SEGMENT_LIMIT
+        self.merge_factor = merge_factor if merge_factor else SegmentedIndex.MERGE_FACTOR
+        self.codec = codec
+        self.segment_counter = 0
+        self.lst_segments = []
+        self.memory_segment = self.new_memory_segment()
+        self.last_doc_id = None
+
+    def new_memory_segment(self) -> Segment:
+        return Segment(CompactHashIndex(positional=self.positional))
+
+    @property
+    def segments(self) -> List[Segment]:
+        return self.lst_segments + [self.memory_segment]
+
+    def index(self, term: str, doc_id: int, term_freq: int, positions: List[int] = None):
+        if self.positional and positions is None:
+            raise Exception("O indice é posicional: as posições do termo devem ser informadas")
+
+        if doc_id != self.last_doc_id:
+            if doc_id in self.set_documents and not self.memory_segment.is_live(doc_id):
+                raise Exception(f"O documento {doc_id} já está indexado: remova-o antes de indexá-lo novamente")
+            # o segmento só é gravado entre dois documentos, assim cada
+            # documento fica inteiro em um unico segmento. Um documento removido
+            # do segmento em memória só pode voltar em um novo segmento
+            if (self.memory_segment.occurrence_count >= self.segment_limit
+                    or doc_id in self.memory_segment.tombstones):
+                self.flush()
+            self.last_doc_id = doc_id
+
+        self.memory_segment.index.index(term, doc_id, term_freq, positions)
+        self.memory_segment.occurrence_count += 1
+        self.set_documents.add(doc_id)
+        self.dic_document_length[doc_id] = self.dic_document_length.get(doc_id, 0) + term_freq
+        self.total_document_length = None
+        self.generation += 1
+        self.dic_index[term] = self.dic_index.get(term, 0) + 1
+
+    def index_document(self, doc_id: int, dic_terms: dict):
+        for term, value in dic_terms.items():
+            if self.positional:
+                self.index(term, doc_id, len(value), value)
+            else:
+                self.index(term, doc_id, value)
+
+    def delete_document(self, doc_id: int) -> bool:
+        if not doc_id in self.set_documents:
+            return False
+
+        for segment in self.segments:
+            if segment.is_live(doc_id):
+                segment.tombstones.add(doc_id)
+        self.set_documents.remove(doc_id)
+        del self.dic_document_length[doc_id]
+        self.total_document_length = None
+        self.generation += 1
+        self.last_doc_id = None
+        return True
+
+    def update_document(self, doc_id: int, dic_terms: dict):
+        # nova versão do documento: dic_terms é termo -> frequencia ou, no
+        # modo posicional, termo -> lista de posições
+        self.delete_document(doc_id)
+        self.index_document(doc_id, dic_terms)
+
+    def new_segment_file_name(self) -> str:
+        str_file_name = path.join(self.str_dir, f"segment{self.segment_counter}")
+        self.segment_counter += 1
+        return str_file_name
+
+    def write_segment(self, lst_segments: List[Segment]) -> Segment:
+        # grava as ocorrencias dos documentos não removidos dos segmentos em
+        # um novo FileIndex
+        file_index = FileIndex(tmp_dir=self.str_dir, codec=self.codec, positional=self.positional,
+                               str_idx_file_name=self.new_segment_file_name())
+        set_terms = set()
+        for segment in lst_segments:
+            set_terms.update(segment.index.vocabulary)
+
+        occurrence_count = 0
+        for term in sorted(set_terms):
+            for segment in lst_segments:
+                lst_occurrences = segment.get_occurrence_list(term)
+                dic_positions = (segment.reader.get_position_lists(term, [o.doc_id for o in lst_occurrences])
+                                 if self.positional else {})
+                for occurrence in lst_occurrences:
+                    file_index.index(term, occurrence.doc_id, occurrence.term_freq,
+                                     dic_positions.get(occurrence.doc_id))
+                occurrence_count += len(lst_occurrences)
+        file_index.finish_indexing()
+        return Segment(file_index, occurrence_count)
+
+    def flush(self):
+        if self.memory_segment.live_document_count > 0:
+            self.lst_segments.append(self.write_segment([self.memory_segment]))
+        self.memory_segment = self.new_memory_segment()
+        self.last_doc_id = None
+        self.maybe_merge()
+
+    def segment_tier(self, segment: Segment) -> int:
+        tier = 0
+        size = self.segment_limit * self.merge_factor
+        while segment.occurrence_count >= size:
+            size *= self.merge_factor
+            tier += 1
+        return tier
+
+    def maybe_merge(self):
+        while True:
+            dic_tiers = {}
+            for segment in self.lst_segments:
+                dic_tiers.setdefault(self.segment_tier(segment), []).append(segment)
+            lst_full_tiers = [lst_tier for _, lst_tier in sorted(dic_tiers.items())
+                              if len(lst_tier) >= self.merge_factor]
+            if not lst_full_tiers:
+                return
+            self.merge_segments(lst_full_tiers[0][:self.merge_factor])
+
+    def merge_segments(self, lst_segments: List[Segment]):
+        merged_segment = self.write_segment(lst_segments)
+        for segment in lst_segments:
+            segment.remove()
+        self.lst_segments = [segment for segment in self.lst_segments if segment not in lst_segments]
+        if merged_segment.live_document_count > 0:
+            self.lst_segments.append(merged_segment)
+        else:
+            merged_segment.remove()
+
+        # os termos de documentos removidos só deixam o vocabulario no merge;
+        # o lexico é reconstruido na proxima consulta (o tamanho do
+        # vocabulario pode ser o mesmo, então get_lexicon não detectaria)
+        self.dic_index = {}
+        self.lexicon = None
+        for segment in self.segments:
+            for term in segment.index.vocabulary:
+                self.dic_index[term] = self.dic_index.get(term, 0) + segment.reader.document_count_with_term(term)
+
+    def force_merge(self):
+        # une todos os segmentos em um unico, sem documentos removidos
+        self.flush()
+        if len(self.lst_segments) > 1 or any(segment.tombstones for segment in self.lst_segments):
+            self.merge_segments(self.lst_segments)
+
+    def finish_indexing(self):
+        self.flush()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_term_id(self, term: str):
+        raise Exception("O SegmentedIndex não possui term_id: cada segmento possui os seus")
+
+    def build_lexicon(self):
+        self.lexicon = SortedLexicon(self.dic_index.keys())
+
+    def get_occurrence_list(self, term: str) -> List:
+        if not term in self.dic_index:
+            return []
+        return list(heapq.merge(*[segment.get_occurrence_list(term) for segment in self.segments],
+                                key=attrgetter("doc_id")))
+
+    def document_count_with_term(self, term: str) -> int:
+        if not term in self.dic_index:
+            return 0
+        return sum(segment.document_count_with_term(term) for segment in self.segments)
+
+    def term_score_bounds(self, term: str) -> Tuple[int, int]:
+        # limites dos segmentos (documentos removidos não os invalidam)
+        lst_bounds = [segment.reader.term_score_bounds(term) for segment in self.segments
+                      if segment.reader.document_count_with_term(term)]
+        if not lst_bounds:
+            return 0, 0
+        return max(max_term_freq for max_term_freq, _ in lst_bounds), min(min_len for _, min_len in lst_bounds)
+
+    def get_position_lists(self, term: str, lst_doc_ids: List[int]) -> dict:
+        if not self.positional:
+            raise Exception("O indice não é posicional")
+        dic_positions = {}
+        for segment in self.segments:
+            dic_positions.update(segment.get_position_lists(term, lst_doc_ids))
+        return dic_positions
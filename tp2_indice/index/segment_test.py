@@ -0,0 +1,128 @@
+from .structure import *
+from .segment import *
+from .query import *
+import unittest
+import shutil
+from random import randrange, seed
+
+
+class TombstonesTest(unittest.TestCase):
+    def test_tombstones(self):
+        tombstones = Tombstones()
+        for doc_id in [3, 100, 3, 0]:
+            tombstones.add(doc_id)
+        self.assertEqual(len(tombstones), 3)
+        self.assertIn(100, tombstones)
+        self.assertNotIn(4, tombstones)
+        self.assertNotIn(10000, tombstones)
+
+
+class SegmentedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SegmentedIndex(segment_limit=10, merge_factor=3)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.index.str_dir, ignore_errors=True)
+
+    def create_documents(self, int_docs: int) -> dict:
+        seed(30)
+        dic_docs = {}
+        for doc_id in range(1, int_docs + 1):
+            dic_docs[doc_id] = {f"t{randrange(0, 20)}": randrange(1, 5) for _ in range(randrange(1, 6))}
+            for term, freq in dic_docs[doc_id].items():
+                self.index.index(term, doc_id, freq)
+        return dic_docs
+
+    def check_index(self, dic_docs: dict):
+        hash_index = HashIndex()
+        for doc_id, dic_terms in sorted(dic_docs.items()):
+            for term, freq in dic_terms.items():
+                hash_index.index(term, doc_id, freq)
+
+        self.assertSetEqual(self.index.set_documents, set(dic_docs))
+        for term in hash_index.vocabulary:
+            # cada segmento possui seus proprios term_ids
+            self.assertListEqual([(o.doc_id, o.term_freq) for o in self.index.get_occurrence_list(term)],
+                                 [(o.doc_id, o.term_freq) for o in hash_index.get_occurrence_list(term)],
+                                 f"Ocorrencias incorretas do termo {term}")
+            self.assertEqual(self.index.document_count_with_term(term), hash_index.document_count_with_term(term))
+
+    def test_segments(self):
+        dic_docs = self.create_documents(200)
+        self.index.finish_indexing()
+        self.assertGreater(len(self.index.lst_segments), 1)
+        # merge por niveis: no maximo merge_factor - 1 segmentos por nivel
+        dic_tiers = {}
+        for segment in self.index.lst_segments:
+            dic_tiers[self.index.segment_tier(segment)] = dic_tiers.get(self.index.segment_tier(segment), 0) + 1
+        self.assertLess(max(dic_tiers.values()), self.index.merge_factor)
+        self.check_index(dic_docs)
+
+    def test_delete_update(self):
+        dic_docs = self.create_documents(100)
+        # remove documentos já gravados e ainda em memória
+        for doc_id in [1, 50, 99, 100]:
+            self.assertTrue(self.index.delete_document(doc_id))
+            del dic_docs[doc_id]
+        self.assertFalse(self.index.delete_document(1))
+        self.check_index(dic_docs)
+
+        dic_docs[50] = {"novo": 2, "t1": 1}
+        self.index.update_document(50, dic_docs[50])
+        dic_docs[100] = {"novo": 1}
+        self.index.update_document(100, dic_docs[100])
+        self.assertRaises(Exception, self.index.index, "t1", 2, 1)
+        self.check_index(dic_docs)
+
+        self.index.force_merge()
+        self.assertEqual(len(self.index.lst_segments), 1)
+        self.assertEqual(len(self.index.lst_segments[0].tombstones), 0)
+        self.check_index(dic_docs)
+
+    def test_query(self):
+        dic_docs = self.create_documents(150)
+        for doc_id in range(1, 150, 7):
+            self.index.delete_document(doc_id)
+            del dic_docs[doc_id]
+        hash_index = HashIndex()
+        for doc_id, dic_terms in sorted(dic_docs.items()):
+            for term, freq in dic_terms.items():
+                hash_index.index(term, doc_id, freq)
+
+        for query in ["t1 t2", "t3"]:
+            self.assertListEqual(QueryProcessor(self.index).search_wand(query), QueryProcessor(hash_index).search(query))
+        self.assertListEqual(QueryProcessor(self.index).search_boolean("t1 AND NOT t2"),
+                             QueryProcessor(hash_index).search_boolean("t1 AND NOT t2"))
+
+    def test_lexicon_after_merge(self):
+        # o merge remove "a" e o vocabulario mantém o mesmo tamanho
+        self.index.index("a", 1, 1)
+        self.index.flush()
+        self.index.index("b", 2, 1)
+        self.index.flush()
+        self.assertListEqual(self.index.prefix_terms("a"), ["a"])
+        self.index.delete_document(1)
+        self.index.index("c", 3, 1)
+        self.index.force_merge()
+        self.assertListEqual(self.index.prefix_terms("c"), ["c"])
+        self.assertListEqual(self.index.prefix_terms("a"), [])
+        self.assertListEqual(QueryProcessor(self.index).search_boolean("c* OR a*"), [3])
+
+
+class PositionalSegmentedIndexTest(unittest.TestCase):
+    def test_phrase(self):
+        index = SegmentedIndex(segment_limit=3, positional=True)
+        for doc_id, text in enumerate(["casa verde", "verde casa", "a casa verde", "predio"], 1):
+            for position, term in enumerate(text.split()):
+                index.index(term, doc_id, 1, [position])
+        index.delete_document(1)
+        self.assertListEqual(QueryProcessor(index).search_phrase("casa verde"), [3])
+        index.force_merge()
+        self.assertListEqual(QueryProcessor(index).search_phrase("casa verde"), [3])
+        index.close()
+        shutil.rmtree(index.str_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+
+
+# Estatisticas opcionais da indexação: tempo acumulado por etapa (html,
+# tokenize, normalize, stemming, index, flush, merge...) e contadores
+# (documentos, tokens, stopwords removidas, ocorrencias gravadas, bytes
+# lidos/escritos, passadas de merge...). O Cleaner, o HTMLIndexer e o
+# FileIndex só registram algo quando possuem um objeto de estatisticas
+# (atributo stats diferente de None); sem ele, o custo é apenas o teste do
+# atributo. progress_callback(stats) é chamado, no maximo, a cada
+# progress_interval segundos, ao final de cada documento indexado. Os
+# contadores e tempos são atualizados sob um lock, pois a leitura dos
+# arquivos (prefetch) registra suas estatisticas em outra thread.
+class IndexingStats:
+    def __init__(self, progress_callback: Callable[["IndexingStats"], None] = None,
+                 progress_interval: float = 10.0):
+        self.dic_times = {}
+        self.dic_counters = {}
+        self.lock = Lock()
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.start_time = perf_counter()
+        self.last_progress_time = self.start_time
+
+    def add(self, str_name: str, value: int = 1):
+        with self.lock:
+            self.dic_counters[str_name] = self.dic_counters.get(str_name, 0) + value
+
+    def set(self, str_name: str, value: int):
+        with self.lock:
+            self.dic_counters[str_name] = value
+
+    def add_time(self, str_name: str, seconds: float):
+        with self.lock:
+            self.dic_times[str_name] = self.dic_times.get(str_name, 0) + seconds
+
+    @contextmanager
+    def timer(self, str_name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(str_name, perf_counter() - start)
+
+    def counter(self, str_name: str) -> int:
+        return self.dic_counters.get(str_name, 0)
+
+    def time(self, str_name: str) -> float:
+        return self.dic_times.get(str_name, 0)
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.start_time
+
+    def progress(self, force: bool = False):
+        if self.progress_callback is None:
+            return
+        now = perf_counter()
+        if force or now - self.last_progress_time >= self.progress_interval:
+            self.last_progress_time = now
+            self.progress_callback(self)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {"elapsed_seconds": self.elapsed, "times": dict(self.dic_times), "counters": dict(self.dic_counters)}
+
+    def __str__(self):
+        str_times = "; ".join(f"{name} {seconds:.2f}s" for name, seconds in sorted(self.dic_times.items()))
+        str_counters = "; ".join(f"{name} {value:,}" for name, value in sorted(self.dic_counters.items()))
+        return f"Tempo total: {self.elapsed:.2f}s\nEtapas: {str_times}\nContadores: {str_counters}"
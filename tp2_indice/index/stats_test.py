@@ -0,0 +1,72 @@
+from .stats import *
+from .structure import *
+import unittest
+
+
+class IndexingStatsTest(unittest.TestCase):
+    def test_counters(self):
+        lst_progress = []
+        stats = IndexingStats(progress_callback=lst_progress.append, progress_interval=3600)
+        stats.add("documents")
+        stats.add("tokens", 10)
+        stats.add("documents")
+        stats.set("stem_cache_hits", 4)
+        with stats.timer("html"):
+            pass
+        stats.add_time("html", 1)
+
+        self.assertEqual(stats.counter("documents"), 2)
+        self.assertEqual(stats.counter("xuxu"), 0)
+        self.assertGreaterEqual(stats.time("html"), 1)
+        self.assertDictEqual(stats.as_dict()["counters"], {"documents": 2, "tokens": 10, "stem_cache_hits": 4})
+
+        # o intervalo ainda não passou: o callback só é chamado se forçado
+        stats.progress()
+        self.assertListEqual(lst_progress, [])
+        stats.progress(force=True)
+        self.assertListEqual(lst_progress, [stats])
+
+    def test_threads(self):
+        # a thread de leitura e a de indexação atualizam os mesmos contadores
+        from threading import Thread
+        import sys
+        stats = IndexingStats()
+        int_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            lst_threads = [Thread(target=lambda: [stats.add("documents") for _ in range(20000)]) for _ in range(4)]
+            for thread in lst_threads:
+                thread.start()
+            for thread in lst_threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(int_switch_interval)
+        self.assertEqual(stats.counter("documents"), 80000, "Nenhum incremento deveria ser perdido")
+
+    def test_file_index_stats(self):
+        index = FileIndex(memory_budget=2 * FileIndex.VOCABULARY_ENTRY_BYTES + 5 * 12, merge_fan_in=2)
+        index.stats = IndexingStats()
+        for doc_id in range(1, 21):
+            index.index_document(doc_id, {"casa": 1, "verde": doc_id})
+        index.finish_indexing()
+        index.get_occurrence_list("casa")
+
+        stats = index.stats
+        self.assertEqual(stats.counter("postings_flushed"), 40, "Todas as ocorrencias deveriam ser gravadas nas runs")
+        self.assertEqual(stats.counter("runs"), 7)
+        self.assertGreater(stats.counter("merge_passes"), 1, "Com fan-in 2 deveria haver merges intermediarios")
+        self.assertGreater(stats.counter("bytes_written"), stats.counter("bytes_read"))
+        self.assertIn("flush", stats.dic_times)
+        self.assertIn("merge", stats.dic_times)
+        index.remove_files()
+
+    def test_disabled(self):
+        index = FileIndex()
+        index.index("casa", 1, 1)
+        index.finish_indexing()
+        self.assertIsNone(index.stats)
+        index.remove_files()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,29 +1,203 @@
-from IPython.display import clear_output
-from typing import List, Set, Union
+from typing import List, Set, Tuple, Union
 from abc import abstractmethod
 from functools import total_ordering
+from operator import attrgetter
 from os import path
-import pickle
+from itertools import groupby, repeat
+from array import array
+from bisect import bisect_left
+from copy import copy, deepcopy
+import heapq
+import json
+import math
+import shutil
+import tempfile
+import mmap
 import os
 import gc
 import sys
+import tracemalloc
+from time import perf_counter
 
+from .codec import *
+from .lexicon import SortedLexicon, Lexicon, DocumentTable, write_lexicon, write_document_table
+from .cache import create_cache
 
-class Index:
+
+# Mapeamento entre os doc_ids externos (ex. nome do arquivo, 100102) e ids
+# internos densos (0, 1, 2, ...), atribuidos na ordem de indexação. Com ids
+# densos, as estatisticas por documento podem ficar em arrays
+class DocumentMapping:
     def __init__(self):
+        self.dic_internal_ids = {}
+        self.external_ids = array("Q")
+
+    def internal_id(self, external_id: int) -> int:
+        internal_id = self.dic_internal_ids.get(external_id)
+        if internal_id is None:
+            internal_id = len(self.external_ids)
+            self.dic_internal_ids[external_id] = internal_id
+            self.external_ids.append(external_id)
+        return internal_id
+
+    def find_internal_id(self, external_id: int) -> int:
+        return self.dic_internal_ids.get(external_id)
+
+    def external_id(self, internal_id: int) -> int:
+        return self.external_ids[internal_id]
+
+    def __len__(self):
+        return len(self.external_ids)
+
+    def __contains__(self, external_id: int) -> bool:
+        return external_id in self.dic_internal_ids
+
+    def save(self, str_file_name: str):
+        with open(str_file_name, "wb") as mapping_file:
+            self.external_ids.tofile(mapping_file)
+
+    @staticmethod
+    def load(str_file_name: str) -> "DocumentMapping":
+        mapping = DocumentMapping()
+        with open(str_file_name, "rb") as mapping_file:
+            mapping.external_ids.frombytes(mapping_file.read())
+        mapping.dic_internal_ids = {external_id: i for i, external_id in enumerate(mapping.external_ids)}
+        return mapping
+
+
+# Tamanho dos documentos indexado pelo doc_id interno (denso) em um array,
+# com a mesma interface do dicionário doc_id -> tamanho
+class DenseDocumentLength:
+    def __init__(self):
+        self.lengths = array("I")
+        self.count = 0
+
+    def __setitem__(self, doc_id: int, length: int):
+        if doc_id >= len(self.lengths):
+            self.lengths.extend(bytes(doc_id - len(self.lengths) + 1))
+        if not self.lengths[doc_id]:
+            self.count += 1
+        self.lengths[doc_id] = length
+
+    def __getitem__(self, doc_id: int) -> int:
+        if not doc_id in self:
+            raise KeyError(doc_id)
+        return self.lengths[doc_id]
+
+    def get(self, doc_id: int, default=None):
+        return self.lengths[doc_id] if doc_id in self else default
+
+    def __contains__(self, doc_id: int) -> bool:
+        return 0 <= doc_id < len(self.lengths) and self.lengths[doc_id] > 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (doc_id for doc_id, length in enumerate(self.lengths) if length)
+
+    def values(self):
+        return (length for length in self.lengths if length)
+
+    def items(self):
+        return ((doc_id, length) for doc_id, length in enumerate(self.lengths) if length)
+
+
+class Index:
+    def __init__(self, positional: bool = False, dense_doc_ids: bool = False):
         self.dic_index = {}
+        # termo -> term_id, consultado uma unica vez por ocorrencia indexada
+        self.dic_term_ids = {}
         self.set_documents = set()
+        # tamanho (soma das frequencias dos termos) de cada documento, usado no ranking
+        self.dic_document_length = DenseDocumentLength() if dense_doc_ids else {}
+        self.total_document_length = None
+        # com dense_doc_ids, os doc_ids informados na indexação são mapeados
+        # para ids internos densos; as consultas retornam os ids externos
+        self.document_mapping = DocumentMapping() if dense_doc_ids else None
+        # no modo posicional cada ocorrencia guarda também as posições do termo
+        # no documento, usadas nas consultas por frase e proximidade
+        self.positional = positional
+        self.dic_positions = {}
+        # vocabulario ordenado (SortedLexicon), construido no finish_indexing
+        self.lexicon = None
+        # estatisticas opcionais da indexação (IndexingStats)
+        self.stats = None
+        # cache opcional das ocorrencias decodificadas (FileIndex e
+        # FileIndexReader). generation muda sempre que o indice é alterado
+        # ou finalizado, invalidando os caches de resultados das consultas
+        self.posting_cache = None
+        self.generation = 0
+
+    def index(self, term: str, doc_id: int, term_freq: int, positions: List[int] = None):
+        if self.positional and positions is None:
+            raise Exception("O indice é posicional: as posições do termo devem ser informadas")
+        if not self.positional:
+            positions = None
+        if self.document_mapping is not None:
+            doc_id = self.document_mapping.internal_id(doc_id)
 
-    def index(self, term: str, doc_id: int, term_freq: int):
         self.set_documents.add(doc_id)
-        
-        if term not in self.dic_index:
-            int_term_id = len(self.dic_index) + 1
+        self.dic_document_length[doc_id] = self.dic_document_length.get(doc_id, 0) + term_freq
+        self.total_document_length = None
+        self.generation += 1
+
+        int_term_id = self.dic_term_ids.get(term)
+        if int_term_id is None:
+            int_term_id = len(self.dic_term_ids) + 1
+            self.dic_term_ids[term] = int_term_id
             self.dic_index[term] = self.create_index_entry(int_term_id)
+
+        self.add_index_occur(self.dic_index[term], doc_id, int_term_id, term_freq, positions)
+
+    # Indexação em lote: todas as ocorrencias de um documento de uma vez.
+    # dic_terms é termo -> frequencia ou, no modo posicional, termo -> lista
+    # de posições (o mesmo formato de HTMLIndexer.text_terms). As estatisticas
+    # do documento são atualizadas uma unica vez e os term_ids de todos os
+    # termos são resolvidos juntos antes de adicionar as ocorrencias.
+    def index_document(self, doc_id: int, dic_terms: dict):
+        if not dic_terms:
+            return
+        lst_terms = list(dic_terms)
+        if self.positional:
+            lst_positions = list(dic_terms.values())
+            lst_term_freqs = [len(positions) for positions in lst_positions]
         else:
-            int_term_id = self.get_term_id(term)
+            lst_positions = None
+            lst_term_freqs = list(dic_terms.values())
+        if self.document_mapping is not None:
+            doc_id = self.document_mapping.internal_id(doc_id)
 
-        self.add_index_occur(self.dic_index[term], doc_id, int_term_id, term_freq)
+        self.set_documents.add(doc_id)
+        self.dic_document_length[doc_id] = self.dic_document_length.get(doc_id, 0) + sum(lst_term_freqs)
+        self.total_document_length = None
+        self.generation += 1
+
+        self.add_document_occurrences(doc_id, lst_terms, self.resolve_term_ids(lst_terms), lst_term_freqs,
+                                      lst_positions)
+
+    def index_batch(self, documents):
+        # documents: iteravel de (doc_id, dic_terms)
+        for doc_id, dic_terms in documents:
+            self.index_document(doc_id, dic_terms)
+
+    def resolve_term_ids(self, lst_terms: List[str]) -> List[int]:
+        lst_term_ids = list(map(self.dic_term_ids.get, lst_terms))
+        if None in lst_term_ids:
+            for i, term in enumerate(lst_terms):
+                if lst_term_ids[i] is None:
+                    lst_term_ids[i] = len(self.dic_term_ids) + 1
+                    self.dic_term_ids[term] = lst_term_ids[i]
+                    self.dic_index[term] = self.create_index_entry(lst_term_ids[i])
+        return lst_term_ids
+
+    def add_document_occurrences(self, doc_id: int, lst_terms: List[str], lst_term_ids: List[int],
+                                 lst_term_freqs: List[int], lst_positions: List[List[int]] = None):
+        # subclasses podem adicionar as ocorrencias do documento de uma vez
+        dic_index = self.dic_index
+        for i, term in enumerate(lst_terms):
+            self.add_index_occur(dic_index[term], doc_id, lst_term_ids[i], lst_term_freqs[i],
+                                 lst_positions[i] if lst_positions else None)
 
     @property
     def vocabulary(self) -> List:
@@ -31,18 +205,44 @@ class Index:
 
     @property
     def document_count(self) -> int:
-        return len(self.dic_index)
+        return len(self.set_documents)
+
+    @property
+    def average_document_length(self) -> float:
+        if not self.dic_document_length:
+            return 0
+        if self.total_document_length is None:
+            self.total_document_length = sum(self.dic_document_length.values())
+        return self.total_document_length / len(self.dic_document_length)
+
+    def document_length(self, doc_id: int) -> int:
+        return self.dic_document_length.get(doc_id, 0)
+
+    def external_doc_id(self, doc_id: int) -> int:
+        return self.document_mapping.external_id(doc_id) if self.document_mapping is not None else doc_id
+
+    def internal_doc_id(self, external_id: int) -> int:
+        return self.document_mapping.find_internal_id(external_id) if self.document_mapping is not None else external_id
+
+    def term_score_bounds(self, term: str) -> Tuple[int, int]:
+        # (maior frequencia, menor tamanho de documento) entre as ocorrencias
+        # do termo; subclasses podem retornar valores pré-calculados
+        lst_occurrences = self.get_occurrence_list(term)
+        if not lst_occurrences:
+            return 0, 0
+        return (max(occurrence.term_freq for occurrence in lst_occurrences),
+                min(self.document_length(occurrence.doc_id) for occurrence in lst_occurrences))
 
-    @abstractmethod
     def get_term_id(self, term: str):
-        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+        return self.dic_term_ids[term]
 
     @abstractmethod
     def create_index_entry(self, termo_id: int):
         raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
 
     @abstractmethod
-    def add_index_occur(self, entry_dic_index, doc_id: int, term_id: int, freq_termo: int):
+    def add_index_occur(self, entry_dic_index, doc_id: int, term_id: int, freq_termo: int,
+                        positions: List[int] = None):
         raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
 
     @abstractmethod
@@ -53,8 +253,52 @@ class Index:
     def document_count_with_term(self, term: str) -> int:
         raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
 
+    def get_posting_cursor(self, term: str) -> "ListPostingCursor":
+        # em memoria as ocorrencias ficam na ordem de inserção, mas o cursor
+        # (advance_to, interseção, WAND) precisa delas ordenadas por doc_id
+        lst_postings = sorted((occurrence.doc_id, occurrence.term_freq)
+                              for occurrence in self.get_occurrence_list(term))
+        return ListPostingCursor([doc_id for doc_id, _ in lst_postings],
+                                 [term_freq for _, term_freq in lst_postings])
+
+    def add_index_positions(self, term_id: int, doc_id: int, positions: List[int]):
+        self.dic_positions[(term_id, doc_id)] = array("I", positions)
+
+    def get_position_lists(self, term: str, lst_doc_ids: List[int]) -> dict:
+        # posições do termo em cada um dos documentos (doc_id -> lista de posições)
+        if not self.positional:
+            raise Exception("O indice não é posicional")
+        if not term in self.dic_index:
+            return {}
+
+        term_id = self.get_term_id(term)
+        return {doc_id: list(self.dic_positions[(term_id, doc_id)])
+                for doc_id in lst_doc_ids if (term_id, doc_id) in self.dic_positions}
+
+    def build_lexicon(self):
+        self.lexicon = SortedLexicon(self.dic_index.keys(), {term: self.get_term_id(term) for term in self.dic_index})
+
+    def get_lexicon(self) -> SortedLexicon:
+        # termos indexados após o finish_indexing invalidam o lexico (os
+        # indices que removem termos do vocabulario descartam o lexico)
+        if self.lexicon is None or len(self.lexicon) != len(self.dic_index):
+            self.build_lexicon()
+        return self.lexicon
+
+    def prefix_terms(self, prefix: str) -> List[str]:
+        return self.get_lexicon().prefix_terms(prefix)
+
+    def wildcard_terms(self, pattern: str) -> List[str]:
+        return self.get_lexicon().wildcard_terms(pattern)
+
+    def invalidate_caches(self):
+        self.generation += 1
+        if self.posting_cache is not None:
+            self.posting_cache.clear()
+
     def finish_indexing(self):
-        pass
+        self.build_lexicon()
+        self.invalidate_caches()
 
     def __str__(self):
         arr_index = []
@@ -69,13 +313,16 @@ class Index:
 
 @total_ordering
 class TermOccurrence:
+    # sem __dict__ por instancia: reduz a memoria de cada ocorrencia
+    __slots__ = ("doc_id", "term_id", "term_freq")
+
     def __init__(self, doc_id: int, term_id: int, term_freq: int):
         self.doc_id = doc_id
         self.term_id = term_id
         self.term_freq = term_freq
 
     def write(self, idx_file):
-        pass
+        idx_file.write(OCCURRENCE_RECORD.pack(self.term_id, self.doc_id, self.term_freq))
 
     def __hash__(self):
         return hash((self.doc_id, self.term_id, self.term_freq))
@@ -103,16 +350,79 @@ class TermOccurrence:
         return str(self)
 
 
+# ocorrencia do FileIndex posicional: carrega as posições já codificadas
+# (encode_positions) até a escrita da run
+class PositionalTermOccurrence(TermOccurrence):
+    __slots__ = ("positions",)
+
+    def __init__(self, doc_id: int, term_id: int, term_freq: int, positions: bytes):
+        super().__init__(doc_id, term_id, term_freq)
+        self.positions = positions
+
+
+# Cursores percorrem as ocorrencias de um termo em ordem de doc_id. advance_to
+# posiciona o cursor no primeiro documento >= doc_id, permitindo pular
+# ocorrencias nas interseções (consultas booleanas e WAND)
+class ListPostingCursor:
+    END = float("inf")
+
+    def __init__(self, doc_ids: List[int], term_freqs: List[int]):
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def doc_id(self):
+        return self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else ListPostingCursor.END
+
+    @property
+    def term_freq(self) -> int:
+        return self.term_freqs[self.pos]
+
+    def next(self):
+        self.pos += 1
+
+    def advance_to(self, doc_id: int):
+        # busca galopante: dobra o passo até ultrapassar doc_id e, depois,
+        # faz a busca binaria apenas no ultimo intervalo
+        doc_ids = self.doc_ids
+        size = len(doc_ids)
+        if self.pos >= size or doc_ids[self.pos] >= doc_id:
+            return
+
+        low = self.pos
+        step = 1
+        high = low + step
+        while high < size and doc_ids[high] < doc_id:
+            low = high
+            step *= 2
+            high = low + step
+        self.pos = bisect_left(doc_ids, doc_id, low, min(high, size))
+
+
 # HashIndex é subclasse de Index
 class HashIndex(Index):
-    def get_term_id(self, term: str):
-        return self.dic_index[term][0].term_id
-
     def create_index_entry(self, term_id: int) -> List:
         return []
 
-    def add_index_occur(self, entry_dic_index: List[TermOccurrence], doc_id: int, term_id: int, term_freq: int):
+    def add_index_occur(self, entry_dic_index: List[TermOccurrence], doc_id: int, term_id: int, term_freq: int,
+                        positions: List[int] = None):
         entry_dic_index.append(TermOccurrence(doc_id, term_id, term_freq))
+        if positions is not None:
+            self.add_index_positions(term_id, doc_id, positions)
+
+    def add_document_occurrences(self, doc_id: int, lst_terms: List[str], lst_term_ids: List[int],
+                                 lst_term_freqs: List[int], lst_positions: List[List[int]] = None):
+        if lst_positions:
+            return super().add_document_occurrences(doc_id, lst_terms, lst_term_ids, lst_term_freqs, lst_positions)
+
+        # as ocorrencias são criadas pelo map (em C) e cada lista recebe a sua
+        for entry, occurrence in zip(map(self.dic_index.__getitem__, lst_terms),
+                                     map(TermOccurrence, repeat(doc_id), lst_term_ids, lst_term_freqs)):
+            entry.append(occurrence)
 
     def get_occurrence_list(self, term: str) -> List:
         return self.dic_index[term] if term in self.dic_index else []
@@ -120,27 +430,427 @@ class HashIndex(Index):
     def document_count_with_term(self, term: str) -> int:
         return len(self.dic_index[term]) if term in self.dic_index else 0
 
+
+# Entrada do CompactHashIndex: o term_id é guardado uma unica vez e as
+# ocorrencias ficam em arrays tipados (4 bytes por inteiro) ao inves de
+# um objeto TermOccurrence por ocorrencia
+class TermPostings:
+    __slots__ = ("term_id", "doc_ids", "term_freqs")
+
+    def __init__(self, term_id: int):
+        self.term_id = term_id
+        self.doc_ids = array("I")
+        self.term_freqs = array("I")
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __str__(self):
+        return f"term_id: {self.term_id}, doc_ids: {list(self.doc_ids)}, term_freqs: {list(self.term_freqs)}"
+
+    def __repr__(self):
+        return str(self)
+
+
+# HashIndex compacto: as instancias de TermOccurrence são criadas apenas
+# quando a lista de ocorrencias é solicitada
+class CompactHashIndex(Index):
+    def get_term_id(self, term: str):
+        return self.dic_index[term].term_id
+
+    def create_index_entry(self, term_id: int) -> TermPostings:
+        return TermPostings(term_id)
+
+    def add_index_occur(self, entry_dic_index: TermPostings, doc_id: int, term_id: int, term_freq: int,
+                        positions: List[int] = None):
+        entry_dic_index.doc_ids.append(doc_id)
+        entry_dic_index.term_freqs.append(term_freq)
+        if positions is not None:
+            self.add_index_positions(term_id, doc_id, positions)
+
+    def add_document_occurrences(self, doc_id: int, lst_terms: List[str], lst_term_ids: List[int],
+                                 lst_term_freqs: List[int], lst_positions: List[List[int]] = None):
+        if lst_positions:
+            return super().add_document_occurrences(doc_id, lst_terms, lst_term_ids, lst_term_freqs, lst_positions)
+
+        for entry, term_freq in zip(map(self.dic_index.__getitem__, lst_terms), lst_term_freqs):
+            entry.doc_ids.append(doc_id)
+            entry.term_freqs.append(term_freq)
+
+    def get_occurrence_list(self, term: str) -> List:
+        if not term in self.dic_index:
+            return []
+
+        entry = self.dic_index[term]
+        return [TermOccurrence(doc_id, entry.term_id, term_freq)
+                for doc_id, term_freq in zip(entry.doc_ids, entry.term_freqs)]
+
+    def document_count_with_term(self, term: str) -> int:
+        return len(self.dic_index[term]) if term in self.dic_index else 0
+
+
 class TermFilePosition:
-    def __init__(self, term_id: int, term_file_start_pos: int = None, doc_count_with_term: int = None):
+    __slots__ = ("term_id", "term_file_start_pos", "doc_count_with_term", "term_file_length",
+                 "max_term_freq", "min_document_length", "skip_file_start_pos",
+                 "positions_file_start_pos", "positions_file_length")
+
+    def __init__(self, term_id: int, term_file_start_pos: int = None, doc_count_with_term: int = None,
+                 term_file_length: int = None, max_term_freq: int = None, min_document_length: int = None,
+                 skip_file_start_pos: int = None, positions_file_start_pos: int = None,
+                 positions_file_length: int = None):
         self.term_id = term_id
         self.term_file_start_pos = term_file_start_pos
         self.doc_count_with_term = doc_count_with_term
+        # tamanho, em bytes, das ocorrencias do termo no arquivo
+        self.term_file_length = term_file_length
+        # maior frequencia e menor documento entre as ocorrencias do termo:
+        # usados para limitar a contribuição maxima do termo no ranking
+        self.max_term_freq = max_term_freq
+        self.min_document_length = min_document_length
+        # posição dos ponteiros de salto do termo (None se há um unico bloco)
+        self.skip_file_start_pos = skip_file_start_pos
+        # bloco de posições do termo no arquivo de posições (indice posicional)
+        self.positions_file_start_pos = positions_file_start_pos
+        self.positions_file_length = positions_file_length
 
     def __str__(self):
-        return f"term_id: {self.term_id}, doc_count_with_term: {self.doc_count_with_term}, term_file_start_pos: {self.term_file_start_pos}"
+        return (f"term_id: {self.term_id}, doc_count_with_term: {self.doc_count_with_term}, "
+                f"term_file_start_pos: {self.term_file_start_pos}, term_file_length: {self.term_file_length}")
 
     def __repr__(self):
         return str(self)
 
 
-class FileIndex(Index):
-    TMP_OCCURRENCES_LIMIT = 1000000
+# Cursor sobre as ocorrencias de um termo no FileIndex: as ocorrencias são
+# divididas em blocos de skip_interval e os ponteiros de salto (doc_id anterior
+# ao bloco, posição do bloco) permitem decodificar apenas os blocos que podem
+# conter o documento procurado
+class FilePostingCursor(ListPostingCursor):
+    def __init__(self, codec: PostingCodec, term_id: int, doc_count: int, buffer, lst_skips: List[Tuple[int, int]]):
+        super().__init__([], [])
+        self.codec = codec
+        self.term_id = term_id
+        self.buffer = buffer
+        self.lst_skips = lst_skips if lst_skips else [(0, 0)]
+        self.lst_skip_doc_ids = [base_doc_id for base_doc_id, _ in self.lst_skips]
+        self.chunk = -1
+        self.doc_count = doc_count
+        self.decoded_postings = 0
+        self.load_chunk(0)
+
+    def __len__(self):
+        return self.doc_count
+
+    def load_chunk(self, chunk: int):
+        base_doc_id, start = self.lst_skips[chunk]
+        end = self.lst_skips[chunk + 1][1] if chunk + 1 < len(self.lst_skips) else len(self.buffer)
+        lst_postings = self.codec.decode(self.term_id, self.buffer[start:end], base_doc_id)
+        self.doc_ids = [doc_id for doc_id, _ in lst_postings]
+        self.term_freqs = [term_freq for _, term_freq in lst_postings]
+        self.decoded_postings += len(lst_postings)
+        self.chunk = chunk
+        self.pos = 0
+
+    def next(self):
+        self.pos += 1
+        if self.pos >= len(self.doc_ids) and self.chunk + 1 < len(self.lst_skips):
+            self.load_chunk(self.chunk + 1)
+
+    def advance_to(self, doc_id: int):
+        if self.doc_id >= doc_id:
+            return
+
+        # ultimo bloco cujo doc_id anterior é menor que o procurado
+        chunk = bisect_left(self.lst_skip_doc_ids, doc_id) - 1
+        if chunk > self.chunk:
+            self.load_chunk(chunk)
+        super().advance_to(doc_id)
+        if self.pos >= len(self.doc_ids) and self.chunk + 1 < len(self.lst_skips):
+            self.load_chunk(self.chunk + 1)
+
+
+# Ocorrencias do FileIndex ainda não gravadas em uma run, empacotadas em
+# arrays: (term_id, doc_id) em uma chave de 64 bits e a frequencia em 32 bits.
+# No modo posicional, as posições codificadas ficam concatenadas em um
+# bytearray, com a posição final de cada ocorrencia em positions_end.
+# Cada ocorrencia ocupa 12 bytes, contra ~70 de um TermOccurrence na lista
+class OccurrenceBuffer:
+    # term_id e doc_id ocupam 32 bits cada na chave (e nos registros das runs)
+    ID_LIMIT = 1 << 32
+
+    def __init__(self, positional: bool = False):
+        self.positional = positional
+        self.keys = array("Q")
+        self.term_freqs = array("I")
+        self.positions = bytearray()
+        self.positions_end = array("Q")
+
+    def add(self, doc_id: int, term_id: int, term_freq: int, positions: bytes = None):
+        OccurrenceBuffer.check_ids(doc_id, term_id)
+        self.keys.append(term_id << 32 | doc_id)
+        self.term_freqs.append(term_freq)
+        if self.positional:
+            self.positions += positions
+            self.positions_end.append(len(self.positions))
+
+    def add_document(self, doc_id: int, lst_term_ids: List[int], lst_term_freqs: List[int],
+                     lst_positions: List[bytes] = None):
+        # os term_ids não são negativos: basta verificar o maior
+        OccurrenceBuffer.check_ids(doc_id, max(lst_term_ids, default=0))
+        self.keys.extend([term_id << 32 | doc_id for term_id in lst_term_ids])
+        self.term_freqs.extend(lst_term_freqs)
+        if self.positional:
+            for positions in lst_positions:
+                self.positions += positions
+                self.positions_end.append(len(self.positions))
+
+    @staticmethod
+    def check_ids(doc_id: int, term_id: int):
+        # fora do intervalo, o id invadiria o outro campo da chave
+        if not 0 <= doc_id < OccurrenceBuffer.ID_LIMIT:
+            raise ValueError(f"doc_id fora do intervalo [0, 2^32): {doc_id}")
+        if not 0 <= term_id < OccurrenceBuffer.ID_LIMIT:
+            raise ValueError(f"term_id fora do intervalo [0, 2^32): {term_id}")
+
+    def append(self, occurrence: TermOccurrence):
+        self.add(occurrence.doc_id, occurrence.term_id, occurrence.term_freq,
+                 occurrence.positions if self.positional else None)
+
+    def extend(self, occurrences):
+        for occurrence in occurrences:
+            self.append(occurrence)
 
-    def __init__(self):
-        super().__init__()
+    @property
+    def nbytes(self) -> int:
+        return (len(self.keys) * self.keys.itemsize + len(self.term_freqs) * self.term_freqs.itemsize
+                + len(self.positions) + len(self.positions_end) * self.positions_end.itemsize)
+
+    def occurrence_positions(self, i: int) -> bytes:
+        start = self.positions_end[i - 1] if i > 0 else 0
+        return bytes(self.positions[start:self.positions_end[i]])
+
+    def __getitem__(self, i: int) -> TermOccurrence:
+        i = range(len(self))[i]
+        term_id, doc_id = divmod(self.keys[i], 1 << 32)
+        if self.positional:
+            return PositionalTermOccurrence(doc_id, term_id, self.term_freqs[i], self.occurrence_positions(i))
+        return TermOccurrence(doc_id, term_id, self.term_freqs[i])
+
+    def pop(self, i: int = -1) -> TermOccurrence:
+        i = range(len(self))[i]
+        occurrence = self[i]
+        del self.keys[i]
+        del self.term_freqs[i]
+        if self.positional:
+            start = self.positions_end[i - 1] if i > 0 else 0
+            length = self.positions_end[i] - start
+            del self.positions[start:start + length]
+            del self.positions_end[i]
+            for j in range(i, len(self.positions_end)):
+                self.positions_end[j] -= length
+        return occurrence
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def sorted_records(self):
+        # registros (term_id, doc_id, term_freq[, posições]) ordenados por
+        # term_id, doc_id: apenas os indices são ordenados, pela chave empacotada
+        keys = self.keys
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            term_id, doc_id = divmod(keys[i], 1 << 32)
+            if self.positional:
+                yield term_id, doc_id, self.term_freqs[i], self.occurrence_positions(i)
+            else:
+                yield term_id, doc_id, self.term_freqs[i]
+
+
+# Leitura das ocorrencias de um arquivo final (codec, ponteiros de salto e
+# posições), comum ao FileIndex e ao FileIndexReader. As subclasses definem
+# como os trechos dos arquivos são lidos: read_term_range, read_skips e
+# read_positions (e os atributos codec, skip_interval e dic_index)
+class FilePostingsIndex(Index):
+    @abstractmethod
+    def read_term_range(self, tfp: TermFilePosition, start: int, length: int):
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    @abstractmethod
+    def read_skips(self, tfp: TermFilePosition) -> List[Tuple[int, int]]:
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    @abstractmethod
+    def read_positions(self, tfp: TermFilePosition, start: int, length: int):
+        raise NotImplementedError("Voce deve criar uma subclasse e a mesma deve sobrepor este método")
+
+    def read_term_block(self, tfp: TermFilePosition) -> bytes:
+        return self.read_term_range(tfp, 0, tfp.term_file_length)
+
+    # Cache das ocorrencias decodificadas, por term_id, limitado a
+    # int_max_bytes ("lru" ou "slru", o LRU segmentado). Cada termo ocupa os
+    # arrays de doc_ids e frequencias; as consultas por cursor também passam a
+    # usar as listas em cache (decodificando a lista inteira na primeira vez)
+    def enable_posting_cache(self, int_max_bytes: int, policy: str = "lru"):
+        self.posting_cache = create_cache(int_max_bytes, policy)
+
+    def cached_postings(self, tfp: TermFilePosition) -> Tuple[array, array]:
+        entry = self.posting_cache.get(tfp.term_id)
+        if entry is None:
+            lst_postings = self.codec.decode(tfp.term_id, self.read_term_block(tfp))
+            entry = (array("I", [doc_id for doc_id, _ in lst_postings]),
+                     array("I", [term_freq for _, term_freq in lst_postings]))
+            self.posting_cache.put(tfp.term_id, entry, sys.getsizeof(entry[0]) + sys.getsizeof(entry[1]))
+        return entry
+
+    def get_occurrence_list(self, term: str) -> List:
+        if not term in self.dic_index or not self.dic_index[term].term_file_length:
+            return []
+
+        tfp = self.dic_index[term]
+        if self.posting_cache is not None:
+            doc_ids, term_freqs = self.cached_postings(tfp)
+            return list(map(TermOccurrence, doc_ids, repeat(tfp.term_id), term_freqs))
+
+        return [TermOccurrence(doc_id, tfp.term_id, term_freq)
+                for doc_id, term_freq in self.codec.decode(tfp.term_id, self.read_term_block(tfp))]
+
+    def document_count_with_term(self, term: str) -> int:
+        return (
+            self.dic_index[term].doc_count_with_term 
+            if term in self.dic_index and self.dic_index[term].doc_count_with_term
+            else 0)
+
+    def term_score_bounds(self, term: str) -> Tuple[int, int]:
+        if not term in self.dic_index or not self.dic_index[term].doc_count_with_term:
+            return 0, 0
+        return self.dic_index[term].max_term_freq, self.dic_index[term].min_document_length
+
+    def skip_count(self, tfp: TermFilePosition) -> int:
+        return math.ceil(tfp.doc_count_with_term / self.skip_interval) if tfp.skip_file_start_pos is not None else 0
+
+    def get_posting_cursor(self, term: str) -> ListPostingCursor:
+        if not term in self.dic_index or not self.dic_index[term].term_file_length:
+            return ListPostingCursor([], [])
+
+        tfp = self.dic_index[term]
+        if self.posting_cache is not None:
+            return ListPostingCursor(*self.cached_postings(tfp))
+
+        # o bloco do termo é lido de uma vez, mas decodificado sob demanda
+        return FilePostingCursor(self.codec, tfp.term_id, tfp.doc_count_with_term, self.read_term_block(tfp),
+                                 self.read_skips(tfp))
+
+    def get_position_lists(self, term: str, lst_doc_ids: List[int]) -> dict:
+        if not self.positional:
+            raise Exception("O indice não é posicional")
+        if not term in self.dic_index or not self.dic_index[term].positions_file_length:
+            return {}
+
+        return self.select_position_lists(self.dic_index[term], lst_doc_ids)
+
+    def select_position_lists(self, tfp: TermFilePosition, lst_doc_ids: List[int]) -> dict:
+        # apenas os blocos de ocorrencias que podem conter os documentos pedidos
+        # (pelos ponteiros de salto) são lidos e decodificados, assim como as
+        # posições desses blocos
+        lst_skips = self.read_skips(tfp)
+        if lst_skips:
+            int_table_size = POSITIONS_LENGTH.size * len(lst_skips)
+            lst_offsets = [offset for offset, in POSITIONS_LENGTH.iter_unpack(self.read_positions(tfp, 0, int_table_size))]
+        else:
+            lst_skips = [(0, 0)]
+            int_table_size = 0
+            lst_offsets = [0]
+        lst_skip_doc_ids = [base_doc_id for base_doc_id, _ in lst_skips]
+        set_doc_ids = set(lst_doc_ids)
+
+        dic_positions = {}
+        for chunk in sorted({max(0, bisect_left(lst_skip_doc_ids, doc_id) - 1) for doc_id in set_doc_ids}):
+            base_doc_id, start = lst_skips[chunk]
+            end = lst_skips[chunk + 1][1] if chunk + 1 < len(lst_skips) else tfp.term_file_length
+            lst_postings = self.codec.decode(tfp.term_id, self.read_term_range(tfp, start, end - start), base_doc_id)
+            positions_end = (lst_offsets[chunk + 1] if chunk + 1 < len(lst_offsets)
+                             else tfp.positions_file_length - int_table_size)
+            block = self.read_positions(tfp, int_table_size + lst_offsets[chunk], positions_end - lst_offsets[chunk])
+            lst_positions = decode_positions(block, [term_freq for _, term_freq in lst_postings])
+            for (doc_id, _), positions in zip(lst_postings, lst_positions):
+                if doc_id in set_doc_ids:
+                    dic_positions[doc_id] = positions
+        return dic_positions
+
+
+class FileIndex(FilePostingsIndex):
+    # memoria (em bytes) das ocorrencias em memória e do vocabulario a partir
+    # da qual as ocorrencias são gravadas em uma nova run
+    MEMORY_BUDGET = 64 * 1024 * 1024
+    # estimativa do custo de cada termo do vocabulario: TermFilePosition,
+    # string do termo e entradas em dic_index e dic_term_ids
+    VOCABULARY_ENTRY_BYTES = 256
+    # fração minima do limite reservada às ocorrencias: o vocabulario não é
+    # liberado pelas runs e, quando ocupa quase todo o limite, o buffer de
+    # ocorrencias ainda tem esse tamanho (senão cada documento geraria uma run)
+    MIN_BUFFER_FRACTION = 0.1
+    # limite opcional de ocorrencias em memória, além do limite de memoria
+    TMP_OCCURRENCES_LIMIT = None
+    # quantidade maxima de runs abertas simultaneamente durante o merge
+    MERGE_FAN_IN = 64
+    # codec usado no arquivo final de ocorrencias ("fixed" ou "vbyte")
+    POSTING_CODEC = "fixed"
+    # quantidade de ocorrencias entre dois ponteiros de salto
+    SKIP_INTERVAL = 128
+    # arquivos de um indice salvo com save(str_dir)
+    SAVED_POSTINGS_FILE = "postings"
+    SAVED_LEXICON_FILE = "lexicon"
+    SAVED_DOCUMENTS_FILE = "documents"
+    SAVED_METADATA_FILE = "metadata.json"
+    SAVED_DOCUMENT_MAPPING_FILE = "document_mapping"
+    SAVED_INDEX_VERSION = 1
+
+    def __init__(self, tmp_dir: str = None, merge_fan_in: int = None, codec: str = None,
+                 skip_interval: int = None, positional: bool = False, str_idx_file_name: str = None,
+                 dense_doc_ids: bool = False, memory_budget: int = None, track_memory: bool = False):
+        super().__init__(positional, dense_doc_ids)
         self.lst_occurrences_tmp = []
+        self.memory_budget = memory_budget if memory_budget else FileIndex.MEMORY_BUDGET
+        # com track_memory (e o tracemalloc ativo) a estimativa é conferida
+        # com a memoria alocada desde a primeira verificação
+        self.track_memory = track_memory
+        self.traced_memory_base = None
+        # quantidade de ocorrencias no buffer da proxima verificação do limite
+        self.next_budget_check = 0
         self.idx_file_counter = 0
-        self.str_idx_file_name = "occur_idx_file"  
+        self.str_final_idx_file_name = str_idx_file_name if str_idx_file_name else "occur_idx_file"
+        self.str_idx_file_name = self.str_final_idx_file_name
+        self.str_skip_file_name = f"{self.str_final_idx_file_name}.skip"
+        # no modo posicional as posições ficam em um arquivo separado, lido
+        # apenas pelas consultas por frase/proximidade
+        self.str_positions_file_name = f"{self.str_final_idx_file_name}.pos"
+
+        # cada flush gera uma run ordenada independente em tmp_dir
+        self.tmp_dir = tmp_dir
+        self.merge_fan_in = merge_fan_in if merge_fan_in is not None else FileIndex.MERGE_FAN_IN
+        # cada merge intermediario precisa reduzir a quantidade de runs
+        if self.merge_fan_in < 2:
+            raise ValueError(f"merge_fan_in deve ser ao menos 2: {self.merge_fan_in}")
+        self.lst_run_files = []
+        self.str_run_dir = None
+        # após o finish_indexing o arquivo final contém as ocorrencias já
+        # indexadas; um novo finish_indexing o inclui no merge das novas runs
+        self.is_finished = False
+
+        self.codec = CODECS_BY_NAME[codec if codec else FileIndex.POSTING_CODEC]
+        self.skip_interval = skip_interval if skip_interval else FileIndex.SKIP_INTERVAL
+
+    @property
+    def lst_occurrences_tmp(self) -> OccurrenceBuffer:
+        return self.occurrence_buffer
+
+    @lst_occurrences_tmp.setter
+    def lst_occurrences_tmp(self, occurrences):
+        # uma lista de TermOccurrence é empacotada no buffer
+        self.occurrence_buffer = OccurrenceBuffer(self.positional)
+        self.occurrence_buffer.extend(occurrences)
 
     def get_term_id(self, term: str):
         return self.dic_index[term].term_id
@@ -148,135 +858,607 @@ class FileIndex(Index):
     def create_index_entry(self, term_id: int) -> TermFilePosition:
         return TermFilePosition(term_id)
 
-    def add_index_occur(self, entry_dic_index: TermFilePosition, doc_id: int, term_id: int, term_freq: int):
-        self.lst_occurrences_tmp.append(TermOccurrence(doc_id, term_id, term_freq))
-
-        if len(self.lst_occurrences_tmp) >= FileIndex.TMP_OCCURRENCES_LIMIT:
+    def memory_usage(self) -> int:
+        # estimativa: ocorrencias empacotadas mais o vocabulario, que cresce
+        # durante toda a indexação e não é liberado pelas runs
+        int_estimate = self.occurrence_buffer.nbytes + len(self.dic_index) * FileIndex.VOCABULARY_ENTRY_BYTES
+        if not self.track_memory or not tracemalloc.is_tracing():
+            return int_estimate
+
+        int_traced, _ = tracemalloc.get_traced_memory()
+        if self.traced_memory_base is None:
+            self.traced_memory_base = int_traced - int_estimate
+        return max(int_estimate, int_traced - self.traced_memory_base)
+
+    def memory_limit(self) -> int:
+        # o limite cresce além de memory_budget apenas quando o vocabulario
+        # não deixa espaço para o tamanho minimo do buffer de ocorrencias
+        return max(self.memory_budget, len(self.dic_index) * FileIndex.VOCABULARY_ENTRY_BYTES +
+                   int(self.memory_budget * FileIndex.MIN_BUFFER_FRACTION))
+
+    def check_memory_budget(self):
+        int_count = len(self.occurrence_buffer)
+        if int_count < self.next_budget_check:
+            return
+
+        int_usage = self.memory_usage()
+        int_limit = self.memory_limit()
+        if int_count > 0 and (int_usage >= int_limit or
+                              FileIndex.TMP_OCCURRENCES_LIMIT and int_count >= FileIndex.TMP_OCCURRENCES_LIMIT):
             self.save_tmp_occurrences()
+            self.next_budget_check = 0
+        elif not self.positional and not self.track_memory:
+            # cada nova ocorrencia usa no maximo 12 bytes e um termo novo, assim
+            # o limite (que só aumenta com o vocabulario) não pode ser atingido
+            # antes da proxima verificação
+            int_step = max(1, (int_limit - int_usage) // (12 + FileIndex.VOCABULARY_ENTRY_BYTES))
+            if FileIndex.TMP_OCCURRENCES_LIMIT:
+                int_step = min(int_step, FileIndex.TMP_OCCURRENCES_LIMIT - int_count)
+            self.next_budget_check = int_count + int_step
+
+    def add_index_occur(self, entry_dic_index: TermFilePosition, doc_id: int, term_id: int, term_freq: int,
+                        positions: List[int] = None):
+        self.occurrence_buffer.add(doc_id, term_id, term_freq,
+                                   encode_positions(positions) if positions is not None else None)
+        self.check_memory_budget()
+
+    def add_document_occurrences(self, doc_id: int, lst_terms: List[str], lst_term_ids: List[int],
+                                 lst_term_freqs: List[int], lst_positions: List[List[int]] = None):
+        self.occurrence_buffer.add_document(doc_id, lst_term_ids, lst_term_freqs,
+                                            list(map(encode_positions, lst_positions)) if lst_positions else None)
+
+        # o limite é verificado uma vez por documento
+        self.check_memory_budget()
 
     def next_from_list(self) -> TermOccurrence:
-        return self.lst_occurrences_tmp.pop(0) if self.lst_occurrences_tmp else None
+        return self.occurrence_buffer.pop(0) if self.occurrence_buffer else None
 
     def next_from_file(self, file_idx: "BufferedReader") -> TermOccurrence:
-        file_idx.read
-        termOccurrence = None
-        gc.disable()
-        try:
-            to = pickle.load(file_idx)
-            
-            if not to["doc_id"] and not to["term_id"] or not to["term_freq"]:
-                raise Exception("Bad structure format")
+        if file_idx.tell() == 0:
+            read_idx_file_header(file_idx)
 
-            termOccurrence = TermOccurrence(to["doc_id"], to["term_id"], to["term_freq"])
-        except:
+        record = file_idx.read(OCCURRENCE_RECORD.size)
+        if len(record) < OCCURRENCE_RECORD.size:
             return None
-        finally:
-            gc.disable()
-            return termOccurrence
 
-    def save_tmp_occurrences(self):
+        term_id, doc_id, term_freq = OCCURRENCE_RECORD.unpack(record)
+        return TermOccurrence(doc_id, term_id, term_freq)
+
+    def write_records(self, records, w_file, positions_file=None):
+        # empacota os registros em blocos para escrever em poucas chamadas. No
+        # modo posicional os registros são (term_id, doc_id, term_freq, posições)
+        # e as posições de cada registro vão para positions_file, na mesma
+        # ordem e precedidas do seu tamanho
+        write_idx_file_header(w_file)
+        buffer = bytearray()
+        positions_buffer = bytearray()
+        pack = OCCURRENCE_RECORD.pack
+        for i, record in enumerate(records, 1):
+            buffer += pack(record[0], record[1], record[2])
+            if positions_file:
+                positions_buffer += POSITIONS_LENGTH.pack(len(record[3]))
+                positions_buffer += record[3]
+            if i % IO_BUFFER_RECORDS == 0:
+                w_file.write(buffer)
+                buffer = bytearray()
+                if positions_file:
+                    positions_file.write(positions_buffer)
+                    positions_buffer = bytearray()
+        w_file.write(buffer)
+        if positions_file:
+            positions_file.write(positions_buffer)
+
+    def write_postings(self, records, w_file, skip_file, positions_file=None) -> dict:
+        # escreve o arquivo final agrupando os registros por termo e codificando
+        # cada bloco com o codec do indice. Retorna, para cada term_id, um
+        # TermFilePosition com a posição (relativa ao inicio dos registros, após
+        # o cabeçalho), o tamanho em bytes, a quantidade de documentos e os
+        # limites usados no ranking. Termos com mais de skip_interval
+        # ocorrencias também têm seus ponteiros de salto gravados em skip_file.
+        # No modo posicional, as posições de todas as ocorrencias do termo são
+        # concatenadas em um bloco de positions_file, precedidas (se houver
+        # mais de um bloco de ocorrencias) da posição das posições de cada bloco
+        write_idx_file_header(w_file, self.codec.flag)
+        write_idx_file_header(skip_file, self.skip_interval)
+        if positions_file:
+            write_idx_file_header(positions_file, POSITIONS_CHUNK_OFFSETS)
+        dic_term_positions = {}
+        dic_document_length = self.dic_document_length
+        pos = 0
+        skip_pos = 0
+        positions_pos = 0
+        buffer = bytearray()
+        for term_id, term_records in groupby(records, key=lambda record: record[0]):
+            lst_records = list(term_records)
+            lst_postings = [(record[1], record[2]) for record in lst_records]
+            lst_chunks = self.codec.encode_chunks(term_id, lst_postings, self.skip_interval)
+            block = b"".join([chunk for _, chunk in lst_chunks])
+            tfp = TermFilePosition(
+                term_id, pos, len(lst_postings), len(block),
+                max(term_freq for _, term_freq in lst_postings),
+                min(dic_document_length.get(doc_id, 0) for doc_id, _ in lst_postings))
+
+            if len(lst_chunks) > 1:
+                tfp.skip_file_start_pos = skip_pos
+                chunk_pos = 0
+                for base_doc_id, chunk in lst_chunks:
+                    skip_file.write(SKIP_RECORD.pack(base_doc_id, chunk_pos))
+                    chunk_pos += len(chunk)
+                skip_pos += SKIP_RECORD.size * len(lst_chunks)
+
+            if positions_file:
+                lst_positions = [record[3] for record in lst_records]
+                positions_block = b"".join(lst_positions)
+                if len(lst_chunks) > 1:
+                    lst_offsets = []
+                    offset = 0
+                    for i in range(0, len(lst_positions), self.skip_interval):
+                        lst_offsets.append(offset)
+                        offset += sum(map(len, lst_positions[i:i + self.skip_interval]))
+                    positions_block = b"".join(map(POSITIONS_LENGTH.pack, lst_offsets)) + positions_block
+                positions_file.write(positions_block)
+                tfp.positions_file_start_pos = positions_pos
+                tfp.positions_file_length = len(positions_block)
+                positions_pos += len(positions_block)
+
+            dic_term_positions[term_id] = tfp
+            pos += len(block)
+            buffer += block
+            if len(buffer) >= OCCURRENCE_RECORD.size * IO_BUFFER_RECORDS:
+                w_file.write(buffer)
+                buffer = bytearray()
+        w_file.write(buffer)
+        return dic_term_positions
+
+    def records_from_file(self, str_file_name: str):
+        # percorre o arquivo retornando as tuplas (term_id, doc_id, term_freq)
+        # ou, no modo posicional, (term_id, doc_id, term_freq, posições)
+        if self.positional:
+            return self.positional_records_from_file(str_file_name)
+        return self.occurrence_records_from_file(str_file_name)
+
+    def occurrence_records_from_file(self, str_file_name: str):
+        with open(str_file_name, "rb") as r_file:
+            read_idx_file_header(r_file)
+            while True:
+                block = r_file.read(OCCURRENCE_RECORD.size * IO_BUFFER_RECORDS)
+                if not block:
+                    break
+                if len(block) % OCCURRENCE_RECORD.size:
+                    raise Exception("Bad structure format")
+
+                yield from OCCURRENCE_RECORD.iter_unpack(block)
+
+    def positional_records_from_file(self, str_file_name: str):
+        records = self.occurrence_records_from_file(str_file_name)
+        with open(self.positions_file_name(str_file_name), "rb") as positions_file:
+            for term_id, doc_id, term_freq in records:
+                length, = POSITIONS_LENGTH.unpack(positions_file.read(POSITIONS_LENGTH.size))
+                yield term_id, doc_id, term_freq, positions_file.read(length)
+
+    def positions_file_name(self, str_run_file_name: str) -> str:
+        return f"{str_run_file_name}.pos"
 
-        # ordena pelo term_id, doc_id
+    def run_file_size(self, str_run_file_name: str) -> int:
+        int_size = os.path.getsize(str_run_file_name)
+        if self.positional:
+            int_size += os.path.getsize(self.positions_file_name(str_run_file_name))
+        return int_size
+
+    def remove_run(self, str_run_file_name: str):
+        os.remove(str_run_file_name)
+        if self.positional:
+            os.remove(self.positions_file_name(str_run_file_name))
+
+    def new_run_file_name(self) -> str:
+        if not self.str_run_dir:
+            self.str_run_dir = tempfile.mkdtemp(prefix="occur_runs_", dir=self.tmp_dir)
+
+        str_file_name = path.join(self.str_run_dir, f"{path.basename(self.str_final_idx_file_name)}{self.idx_file_counter}")
+        self.idx_file_counter = self.idx_file_counter + 1
+        return str_file_name
+
+    def save_tmp_occurrences(self):
         # Para eficiencia, todo o codigo deve ser feito com o garbage
         # collector desabilitado
         gc.disable()
+        start = perf_counter() if self.stats is not None else None
+
+        # ordena pelo term_id, doc_id usando a chave empacotada do buffer
+        records = self.occurrence_buffer.sorted_records()
+
+        # cada flush gera uma nova run ordenada; o merge de todas as runs
+        # é feito uma unica vez no finish_indexing
+        self.str_idx_file_name = self.new_run_file_name()
+        with open(self.str_idx_file_name, "wb") as w_file:
+            if self.positional:
+                with open(self.positions_file_name(self.str_idx_file_name), "wb") as positions_file:
+                    self.write_records(records, w_file, positions_file)
+            else:
+                self.write_records(records, w_file)
+
+        self.lst_run_files.append(self.str_idx_file_name)
+        if self.stats is not None:
+            self.stats.add("postings_flushed", len(self.occurrence_buffer))
+            self.stats.add("runs")
+            self.stats.add("bytes_written", self.run_file_size(self.str_idx_file_name))
+            self.stats.add_time("flush", perf_counter() - start)
+        self.lst_occurrences_tmp = []
+
+        gc.enable()
 
-        # ordena pelo term_id, doc_id
-        self.lst_occurrences_tmp = sorted(self.lst_occurrences_tmp)
-
-        ### Abra um arquivo novo faça a ordenação externa: comparar sempre a primeira posição
-        ### da lista com a primeira posição do arquivo usando os métodos next_from_list e next_from_file
-        ### para armazenar no novo indice ordenado
-        if self.idx_file_counter == 0:
-            open(self.str_idx_file_name, "wb+").close()
-
-        with open(self.str_idx_file_name, "rb") as r_file:
-
-            self.str_idx_file_name = (
-                (self.str_idx_file_name + str(self.idx_file_counter))
-                if self.idx_file_counter == 0
-                else self.str_idx_file_name.replace(str(self.idx_file_counter - 1), str(self.idx_file_counter)))
-
-            with open(self.str_idx_file_name, "ab") as w_file:
-                # RECURSIVE OPTION
-                # def compare_and_add (nff, nfl):
-                #     if not nff and not nfl:
-                #         return None
-
-                #     if (nff and not nfl) or nff < nfl:
-                #         pickle.dump({ "doc_id": nff.doc_id, "term_id": nff.term_id, "term_freq": nff.term_freq}, w_file)
-                #         compare_and_add(self.next_from_file(r_file), nfl)
-                #     else:
-                #         pickle.dump({ "doc_id": nfl.doc_id, "term_id": nfl.term_id, "term_freq": nfl.term_freq}, w_file)
-                #         compare_and_add(nff, self.next_from_list())
-
-                # compare_and_add(self.next_from_file(r_file), self.next_from_list())
-
-                nff = self.next_from_file(r_file)
-                nfl = self.next_from_list()
-                while nff or nfl:
-                    if (nff and not nfl) or nff < nfl:
-                        pickle.dump({ "doc_id": nff.doc_id, "term_id": nff.term_id, "term_freq": nff.term_freq}, w_file)
-                        nff = self.next_from_file(r_file)
+    def merge_runs(self, lst_run_files: List[str], str_out_file_name: str, is_final: bool = False,
+                   lst_records: List = None):
+        # merge k-way usando um heap (heapq.merge) sobre as runs ordenadas;
+        # as tuplas (term_id, doc_id, term_freq) já são comparadas na ordem correta.
+        # lst_records são entradas adicionais já no formato dos registros
+        gc.disable()
+        start = perf_counter() if self.stats is not None else None
+        dic_term_positions = None
+        with open(str_out_file_name, "wb") as w_file:
+            records = heapq.merge(*[self.records_from_file(run) for run in lst_run_files], *(lst_records or []))
+            if is_final:
+                with open(self.str_skip_file_name, "wb") as skip_file:
+                    if self.positional:
+                        with open(self.str_positions_file_name, "wb") as positions_file:
+                            dic_term_positions = self.write_postings(records, w_file, skip_file, positions_file)
                     else:
-                        pickle.dump({ "doc_id": nfl.doc_id, "term_id": nfl.term_id, "term_freq": nfl.term_freq}, w_file)
-                        nfl = self.next_from_list()
+                        dic_term_positions = self.write_postings(records, w_file, skip_file)
+            elif self.positional:
+                with open(self.positions_file_name(str_out_file_name), "wb") as positions_file:
+                    self.write_records(records, w_file, positions_file)
+            else:
+                self.write_records(records, w_file)
+        gc.enable()
 
-                self.idx_file_counter = self.idx_file_counter + 1
+        if self.stats is not None:
+            self.stats.add("merge_passes")
+            self.stats.add("bytes_read", sum(self.run_file_size(run) for run in lst_run_files))
+            int_written = os.path.getsize(str_out_file_name)
+            if is_final:
+                int_written += os.path.getsize(self.str_skip_file_name)
+                if self.positional:
+                    int_written += os.path.getsize(self.str_positions_file_name)
+            elif self.positional:
+                int_written += os.path.getsize(self.positions_file_name(str_out_file_name))
+            self.stats.add("bytes_written", int_written)
+            self.stats.add_time("merge", perf_counter() - start)
+        return dic_term_positions
+
+    def finished_records(self, str_file_name: str, lst_term_positions: List[TermFilePosition]):
+        # registros de um arquivo final (str_file_name e, no modo posicional,
+        # seu arquivo de posições) a partir das posições dos termos, em ordem de term_id
+        with open(str_file_name, "rb") as r_file:
+            positions_file = open(self.positions_file_name(str_file_name), "rb") if self.positional else None
+            try:
+                for tfp in lst_term_positions:
+                    r_file.seek(IDX_FILE_HEADER.size + tfp.term_file_start_pos)
+                    lst_postings = self.codec.decode(tfp.term_id, r_file.read(tfp.term_file_length))
+                    if not positions_file:
+                        for doc_id, term_freq in lst_postings:
+                            yield tfp.term_id, doc_id, term_freq
+                        continue
+
+                    # a tabela de posições dos blocos é descartada (o merge a reconstroi)
+                    int_chunks = math.ceil(len(lst_postings) / self.skip_interval)
+                    int_table_size = POSITIONS_LENGTH.size * int_chunks if int_chunks > 1 else 0
+                    positions_file.seek(IDX_FILE_HEADER.size + tfp.positions_file_start_pos + int_table_size)
+                    lst_positions = split_positions(positions_file.read(tfp.positions_file_length - int_table_size),
+                                                    [term_freq for _, term_freq in lst_postings])
+                    for (doc_id, term_freq), positions in zip(lst_postings, lst_positions):
+                        yield tfp.term_id, doc_id, term_freq, positions
+            finally:
+                if positions_file:
+                    positions_file.close()
+
+    def previous_records(self) -> List:
+        # move o arquivo final de um finish_indexing anterior para o diretorio
+        # das runs, retornando seus registros como uma entrada a mais do merge
+        if not self.is_finished or not path.exists(self.str_final_idx_file_name):
+            return []
 
-        gc.enable()
+        lst_term_positions = sorted((tfp for tfp in self.dic_index.values() if tfp.term_file_length),
+                                    key=attrgetter("term_id"))
+        lst_term_positions = [TermFilePosition(tfp.term_id, tfp.term_file_start_pos, tfp.doc_count_with_term,
+                                               tfp.term_file_length, 0, 0, None, tfp.positions_file_start_pos,
+                                               tfp.positions_file_length) for tfp in lst_term_positions]
+        str_previous = self.new_run_file_name()
+        os.replace(self.str_final_idx_file_name, str_previous)
+        if self.positional:
+            os.replace(self.str_positions_file_name, self.positions_file_name(str_previous))
+        if path.exists(self.str_skip_file_name):
+            os.remove(self.str_skip_file_name)
+        self.str_previous_file_name = str_previous
+        return [self.finished_records(str_previous, lst_term_positions)]
+
+    def merge_all_runs(self) -> dict:
+        lst_runs = self.lst_run_files
+        self.str_previous_file_name = None
+        lst_previous = self.previous_records()
+
+        # caso haja mais runs que o fan-in, faz passadas intermediarias
+        # agrupando merge_fan_in runs por vez
+        while len(lst_runs) + len(lst_previous) > self.merge_fan_in:
+            lst_next_runs = []
+            for i in range(0, len(lst_runs), self.merge_fan_in):
+                lst_group = lst_runs[i:i + self.merge_fan_in]
+                str_merged = self.new_run_file_name()
+                self.merge_runs(lst_group, str_merged)
+                [self.remove_run(run) for run in lst_group]
+                lst_next_runs.append(str_merged)
+            lst_runs = lst_next_runs
+
+        dic_term_positions = self.merge_runs(lst_runs, self.str_final_idx_file_name, is_final=True,
+                                             lst_records=lst_previous)
+        [self.remove_run(run) for run in lst_runs]
+        if self.str_previous_file_name:
+            self.remove_run(self.str_previous_file_name)
+
+        if self.str_run_dir:
+            shutil.rmtree(self.str_run_dir, ignore_errors=True)
+            self.str_run_dir = None
+
+        self.lst_run_files = []
+        self.str_idx_file_name = self.str_final_idx_file_name
+        return dic_term_positions
 
     def finish_indexing(self):
         if len(self.lst_occurrences_tmp) > 0:
             self.save_tmp_occurrences()
-
-        # Sugestão: faça a navegação e obetenha um mapeamento
-        # id_termo -> obj_termo armazene-o em dic_ids_por_termo
-        
-        dic_ids_por_termo = {}
-        for str_term, obj_term in self.dic_index.items():
-            dic_ids_por_termo[obj_term.term_id] = { "term": str_term, "tfp": obj_term }
-
-        # navega nas ocorrencias para atualizar cada termo em dic_ids_por_termo
-        # apropriadamente
+        # nada foi indexado desde o ultimo finish_indexing
+        if self.is_finished and not self.lst_run_files:
+            return
+
+        # o merge final já retorna, por term_id, a posição, o tamanho do bloco
+        # e a quantidade de documentos de cada termo no arquivo
+        dic_term_positions = self.merge_all_runs()
+
+        for obj_term in self.dic_index.values():
+            tfp = dic_term_positions.get(obj_term.term_id, TermFilePosition(obj_term.term_id, None, 0, 0, 0, 0))
+            obj_term.term_file_start_pos = tfp.term_file_start_pos
+            obj_term.term_file_length = tfp.term_file_length
+            obj_term.doc_count_with_term = tfp.doc_count_with_term
+            obj_term.max_term_freq = tfp.max_term_freq
+            obj_term.min_document_length = tfp.min_document_length
+            obj_term.skip_file_start_pos = tfp.skip_file_start_pos
+            obj_term.positions_file_start_pos = tfp.positions_file_start_pos
+            obj_term.positions_file_length = tfp.positions_file_length
+
+        self.is_finished = True
+        self.build_lexicon()
+        self.invalidate_caches()
+
+    def read_term_range(self, tfp: TermFilePosition, start: int, length: int) -> bytes:
+        # lê diretamente (parte d)o bloco de ocorrencias do termo
         with open(self.str_idx_file_name, 'rb') as idx_file:
-            pos = 0
-            while True:
-                to = self.next_from_file(idx_file)
-                if not to:
-                    break
+            idx_file.seek(IDX_FILE_HEADER.size + tfp.term_file_start_pos + start)
+            block = idx_file.read(length)
+        if self.stats is not None:
+            self.stats.add("bytes_read", len(block))
+        return block
+
+    def read_skips(self, tfp: TermFilePosition) -> List[Tuple[int, int]]:
+        if tfp.skip_file_start_pos is None:
+            return []
+        with open(self.str_skip_file_name, 'rb') as skip_file:
+            skip_file.seek(IDX_FILE_HEADER.size + tfp.skip_file_start_pos)
+            return list(SKIP_RECORD.iter_unpack(skip_file.read(SKIP_RECORD.size * self.skip_count(tfp))))
+
+    def read_positions(self, tfp: TermFilePosition, start: int, length: int) -> bytes:
+        with open(self.str_positions_file_name, 'rb') as positions_file:
+            positions_file.seek(IDX_FILE_HEADER.size + tfp.positions_file_start_pos + start)
+            return positions_file.read(length)
+
+    def remove_files(self):
+        for str_file_name in (self.str_final_idx_file_name, self.str_skip_file_name, self.str_positions_file_name):
+            if path.exists(str_file_name):
+                os.remove(str_file_name)
+        # runs de um indice que não foi finalizado
+        if self.str_run_dir:
+            shutil.rmtree(self.str_run_dir, ignore_errors=True)
+            self.str_run_dir = None
+            self.lst_run_files = []
+
+    def open_reader(self) -> "FileIndexReader":
+        # o leitor mapeia o arquivo atual e recebe uma copia das posições dos
+        # termos e dos documentos: um novo finish_indexing grava outro arquivo
+        # (o antigo continua mapeado pelo leitor) e altera as posições do
+        # escritor, mas não as do leitor
+        dic_index = {term: copy(tfp) for term, tfp in self.dic_index.items()}
+        reader = FileIndexReader(self.str_idx_file_name, dic_index, set(self.set_documents),
+                                 deepcopy(self.dic_document_length), self.str_skip_file_name,
+                                 self.str_positions_file_name if self.positional else None)
+        reader.document_mapping = deepcopy(self.document_mapping)
+        # cache proprio: o do escritor é invalidado a cada finish_indexing
+        if self.posting_cache is not None:
+            reader.posting_cache = type(self.posting_cache)(self.posting_cache.max_size)
+        reader.generation = self.generation
+        return reader
+
+    # Persistencia: save grava em str_dir os arquivos de ocorrencias, o lexico
+    # (termos ordenados com front coding e um registro de tamanho fixo por
+    # termo), a tabela de documentos e os metadados. FileIndex.open abre o
+    # diretorio sem decodificar o vocabulario: o lexico e as ocorrencias são
+    # mapeados em memória e lidos sob demanda.
+    def save(self, str_dir: str):
+        if self.lst_occurrences_tmp or self.lst_run_files:
+            raise Exception("O indice deve ser finalizado (finish_indexing) antes de ser salvo")
+
+        os.makedirs(str_dir, exist_ok=True)
+        str_postings_file_name = path.join(str_dir, FileIndex.SAVED_POSTINGS_FILE)
+        shutil.copyfile(self.str_idx_file_name, str_postings_file_name)
+        shutil.copyfile(self.str_skip_file_name, f"{str_postings_file_name}.skip")
+        if self.positional:
+            shutil.copyfile(self.str_positions_file_name, f"{str_postings_file_name}.pos")
+
+        write_lexicon(path.join(str_dir, FileIndex.SAVED_LEXICON_FILE),
+                      [(term, tuple(getattr(tfp, field) for field in TermFilePosition.__slots__))
+                       for term, tfp in sorted(self.dic_index.items())])
+        write_document_table(path.join(str_dir, FileIndex.SAVED_DOCUMENTS_FILE), self.dic_document_length)
+        if self.document_mapping is not None:
+            self.document_mapping.save(path.join(str_dir, FileIndex.SAVED_DOCUMENT_MAPPING_FILE))
+
+        dic_metadata = {"version": FileIndex.SAVED_INDEX_VERSION,
+                        "codec": self.codec.name,
+                        "skip_interval": self.skip_interval,
+                        "positional": self.positional,
+                        "dense_doc_ids": self.document_mapping is not None,
+                        "term_count": len(self.dic_index),
+                        "document_count": self.document_count,
+                        "total_document_length": sum(self.dic_document_length.values())}
+        with open(path.join(str_dir, FileIndex.SAVED_METADATA_FILE), "w") as metadata_file:
+            json.dump(dic_metadata, metadata_file, indent=2)
+
+    @staticmethod
+    def open(str_dir: str) -> "FileIndexReader":
+        with open(path.join(str_dir, FileIndex.SAVED_METADATA_FILE)) as metadata_file:
+            dic_metadata = json.load(metadata_file)
+        if dic_metadata["version"] != FileIndex.SAVED_INDEX_VERSION:
+            raise Exception(f"Versão do indice não suportada: {dic_metadata['version']}")
+
+        str_postings_file_name = path.join(str_dir, FileIndex.SAVED_POSTINGS_FILE)
+        document_table = DocumentTable(path.join(str_dir, FileIndex.SAVED_DOCUMENTS_FILE))
+        reader = FileIndexReader(str_postings_file_name,
+                                 Lexicon(path.join(str_dir, FileIndex.SAVED_LEXICON_FILE), TermFilePosition),
+                                 document_table, document_table, f"{str_postings_file_name}.skip",
+                                 f"{str_postings_file_name}.pos" if dic_metadata["positional"] else None)
+        reader.total_document_length = dic_metadata["total_document_length"]
+        if dic_metadata["dense_doc_ids"]:
+            reader.document_mapping = DocumentMapping.load(path.join(str_dir, FileIndex.SAVED_DOCUMENT_MAPPING_FILE))
+        return reader
+
+
+# Leitor somente leitura de um FileIndex já finalizado: o arquivo de ocorrencias
+# é mapeado em memória uma unica vez e as ocorrencias de cada termo são
+# obtidas como fatias (sem copia) do mapeamento. Como o mapeamento é somente
+# leitura, processos diferentes compartilham as mesmas paginas do cache do SO.
+class FileIndexReader(FilePostingsIndex):
+    def __init__(self, str_idx_file_name: str, dic_index: dict, set_documents: Set = None,
+                 dic_document_length: dict = None, str_skip_file_name: str = None,
+                 str_positions_file_name: str = None):
+        super().__init__(str_positions_file_name is not None)
+        self.str_idx_file_name = str_idx_file_name
+        self.str_skip_file_name = str_skip_file_name
+        self.str_positions_file_name = str_positions_file_name
+        self.dic_index = dic_index
+        self.set_documents = set_documents if set_documents is not None else set()
+        self.dic_document_length = dic_document_length if dic_document_length is not None else {}
+        self.open_file()
+
+    def open_file(self):
+        self.idx_file = open(self.str_idx_file_name, "rb")
+        self.mm_idx_file = mmap.mmap(self.idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.codec = CODECS[read_idx_file_header(self.idx_file)]
+        self.mv_occurrences = memoryview(self.mm_idx_file)[IDX_FILE_HEADER.size:]
+
+        self.skip_interval = None
+        self.skip_file = None
+        if self.str_skip_file_name and path.exists(self.str_skip_file_name):
+            self.skip_file = open(self.str_skip_file_name, "rb")
+            self.mm_skip_file = mmap.mmap(self.skip_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.skip_interval = read_idx_file_header(self.skip_file)
+            self.mv_skips = memoryview(self.mm_skip_file)[IDX_FILE_HEADER.size:]
+
+        self.positions_file = None
+        if self.positional:
+            self.positions_file = open(self.str_positions_file_name, "rb")
+            self.mm_positions_file = mmap.mmap(self.positions_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if not read_idx_file_header(self.positions_file) & POSITIONS_CHUNK_OFFSETS:
+                raise Exception("Arquivo de posições sem a posição dos blocos: o indice deve ser gravado novamente")
+            self.mv_positions = memoryview(self.mm_positions_file)[IDX_FILE_HEADER.size:]
+
+    def close(self):
+        if self.mm_idx_file is None:
+            return
+        self.mv_occurrences.release()
+        FileIndexReader.close_mmap(self.mm_idx_file)
+        self.idx_file.close()
+        self.mm_idx_file = None
+        if self.skip_file:
+            self.mv_skips.release()
+            FileIndexReader.close_mmap(self.mm_skip_file)
+            self.skip_file.close()
+            self.skip_file = None
+        if self.positions_file:
+            self.mv_positions.release()
+            FileIndexReader.close_mmap(self.mm_positions_file)
+            self.positions_file.close()
+            self.positions_file = None
+        if isinstance(self.dic_index, Lexicon):
+            self.dic_index.close()
+
+    @staticmethod
+    def close_mmap(mm_file: mmap.mmap):
+        # fatias do arquivo ainda em uso (ex. o bloco de um FilePostingCursor)
+        # impedem o close do mmap: nesse caso ele é liberado pelo coletor de
+        # lixo quando a ultima fatia deixar de ser usada
+        try:
+            mm_file.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ao enviar o leitor para outro processo, apenas o nome do arquivo e o
+    # vocabulario são serializados; o arquivo é mapeado novamente no destino
+    def __getstate__(self):
+        return {"str_idx_file_name": self.str_idx_file_name,
+                "dic_index": self.dic_index,
+                "set_documents": self.set_documents,
+                "dic_document_length": self.dic_document_length,
+                "str_skip_file_name": self.str_skip_file_name,
+                "str_positions_file_name": self.str_positions_file_name,
+                "positional": self.positional,
+                "total_document_length": self.total_document_length,
+                "document_mapping": self.document_mapping,
+                "lexicon": None,
+                "posting_cache": None,
+                "generation": self.generation,
+                "stats": None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open_file()
+
+    def index(self, term: str, doc_id: int, term_freq: int, positions: List[int] = None):
+        raise Exception("FileIndexReader é somente leitura")
+
+    def index_document(self, doc_id: int, dic_terms: dict):
+        raise Exception("FileIndexReader é somente leitura")
 
-                if to.term_id in dic_ids_por_termo:
-                    dic_ids_por_termo[to.term_id]["tfp"].doc_count_with_term = (
-                        self.document_count_with_term(dic_ids_por_termo[to.term_id]["term"]) + 1)
-                    dic_ids_por_termo[to.term_id]["tfp"].term_file_start_pos = pos
+    def get_term_id(self, term: str):
+        return self.dic_index[term].term_id
 
-        for i, e in dic_ids_por_termo.items():
-            self.dic_index[e["term"]] = e["tfp"]
+    def get_lexicon(self):
+        # o indice salvo (FileIndex.open) já tem o vocabulario ordenado
+        if isinstance(self.dic_index, Lexicon):
+            return self.dic_index
+        return super().get_lexicon()
 
-    def get_occurrence_list(self, term: str) -> List:
-        occurrence_list = []
-        if not term in self.dic_index:
-            return []
-
-        with open(self.str_idx_file_name, 'rb') as idx_file:
-            while True:
-                to = self.next_from_file(idx_file)
-                if not to:
-                    break
-                else:
-                    if to.term_id == self.dic_index[term].term_id:
-                        occurrence_list.append(to)
+    def get_occurrence_view(self, term: str) -> memoryview:
+        if not term in self.dic_index or not self.dic_index[term].term_file_length:
+            return memoryview(b"")
 
+        tfp = self.dic_index[term]
+        return self.mv_occurrences[tfp.term_file_start_pos:tfp.term_file_start_pos + tfp.term_file_length]
 
+    def read_term_range(self, tfp: TermFilePosition, start: int, length: int) -> memoryview:
+        start += tfp.term_file_start_pos
+        return self.mv_occurrences[start:start + length]
 
-        return occurrence_list
+    def read_skips(self, tfp: TermFilePosition) -> List[Tuple[int, int]]:
+        if tfp.skip_file_start_pos is None or not self.skip_file:
+            return []
+        start = tfp.skip_file_start_pos
+        return list(SKIP_RECORD.iter_unpack(self.mv_skips[start:start + SKIP_RECORD.size * self.skip_count(tfp)]))
 
-    def document_count_with_term(self, term: str) -> int:
-        return (
-            self.dic_index[term].doc_count_with_term 
-            if term in self.dic_index and self.dic_index[term].doc_count_with_term
-            else 0)
+    def read_positions(self, tfp: TermFilePosition, start: int, length: int) -> memoryview:
+        start += tfp.positions_file_start_pos
+        return self.mv_positions[start:start + length]
 
 
 class Indexer: